@@ -12,8 +12,18 @@ import logging
 from typing import Optional
 from urllib.parse import urlparse
 
-from distiller_cm5_python.utils.config import N_CTX, LLAMA_CPP_START_WAIT_TIME
+from distiller_cm5_python.utils.config import (
+    N_CTX,
+    KV_CACHE_TYPE,
+    FIT_N_CTX,
+    PREFETCH_MODEL,
+    USE_MLOCK,
+    LLAMA_CPP_START_WAIT_TIME,
+    WARMUP_SPEC_PATH,
+)
 from distiller_cm5_python.utils.distiller_exception import UserVisibleError
+from distiller_cm5_python.client.llm_infra.transport import get_status, unix_socket_path
+from distiller_cm5_python.llm_server.page_cache import PrefetchTask, prefetch_file
 
 # Get logger instance for this module
 logger = logging.getLogger(__name__)
@@ -28,7 +38,8 @@ class LlamaCppServerManager:
         """Initialize the manager.
 
         Args:
-            server_url: The URL where the server should run (e.g., "http://127.0.0.1:8000").
+            server_url: The URL where the server should run (e.g., "http://127.0.0.1:8000",
+                or "unix:///tmp/llm_server.sock" to serve on a Unix domain socket).
             model_name: The name of the model the server should load.
             health_endpoint: The endpoint path used for health checks.
         """
@@ -37,6 +48,8 @@ class LlamaCppServerManager:
         self.health_endpoint = health_endpoint
         self.process: Optional[subprocess.Popen] = None
         self.pid: Optional[int] = None
+        # Background read of the model file into the page cache, see start()
+        self.prefetch: Optional[PrefetchTask] = None
         self.script_path: Optional[str] = self._find_server_script()
 
         logger.debug(
@@ -79,35 +92,56 @@ class LlamaCppServerManager:
                 "Cannot start llama-cpp server: server script not found."
             )
 
-        # Parse host and port
-        try:
-            parsed_url = urlparse(self.server_url)
-            host = parsed_url.hostname
-            port = parsed_url.port
-            if not host or not port:
-                raise ValueError("Host or port not found in server_url")
-        except Exception as e:
-            logger.error(
-                f"Invalid server URL format for starting server: {self.server_url}. Error: {e}"
-            )
-            raise UserVisibleError(
-                f"Invalid server URL: {self.server_url}. Expected format like http://127.0.0.1:8000"
-            )
+        socket_path = unix_socket_path(self.server_url)
+        if socket_path:
+            bind_args = ["--uds", socket_path]
+        else:
+            # Parse host and port
+            try:
+                parsed_url = urlparse(self.server_url)
+                host = parsed_url.hostname
+                port = parsed_url.port
+                if not host or not port:
+                    raise ValueError("Host or port not found in server_url")
+            except Exception as e:
+                logger.error(
+                    f"Invalid server URL format for starting server: {self.server_url}. Error: {e}"
+                )
+                raise UserVisibleError(
+                    f"Invalid server URL: {self.server_url}. Expected format like http://127.0.0.1:8000"
+                )
+            bind_args = ["--host", host, "--port", str(port)]
 
         command = [
             sys.executable,
             self.script_path,
-            "--host",
-            host,
-            "--port",
-            str(port),
+            *bind_args,
             "--model_name",
             self.model_name,
             "--n_ctx",
             str(N_CTX),
+            "--cache_type_k",
+            KV_CACHE_TYPE,
+            "--cache_type_v",
+            KV_CACHE_TYPE,
         ]
+        if FIT_N_CTX:
+            command.append("--fit_n_ctx")
+        if USE_MLOCK:
+            command.append("--mlock")
+        if WARMUP_SPEC_PATH:
+            command += ["--warmup_spec", WARMUP_SPEC_PATH]
         logger.info(f"Starting llama-cpp server with command: {' '.join(command)}")
 
+        model_path = os.path.join(
+            os.path.dirname(self.script_path), "models", self.model_name
+        )
+        if PREFETCH_MODEL and os.path.isfile(model_path):
+            # Reading the model from SD/eMMC overlaps with the server's imports and
+            # the UI starting, so the load and first tokens do not wait on page faults
+            self.prefetch = prefetch_file(model_path)
+            logger.info(f"Prefetching {self.model_name} into the page cache")
+
         try:
             # Start in background, allow output to parent terminal for debugging
             self.process = subprocess.Popen(command)
@@ -152,6 +186,12 @@ class LlamaCppServerManager:
         logger.info(
             f"Llama-cpp server started successfully (PID: {self.pid}) and connection verified."
         )
+        if self.prefetch is not None:
+            progress = self.prefetch.progress()
+            logger.info(
+                f"Model prefetch {progress['state']}: "
+                f"{progress['prefetched_bytes'] >> 20}/{progress['file_bytes'] >> 20} MB"
+            )
         return True
 
     def stop(self) -> bool:
@@ -162,6 +202,8 @@ class LlamaCppServerManager:
         """
         process_to_stop = self.process
         pid_to_stop = self.pid
+        if self.prefetch is not None:
+            self.prefetch.cancel()
 
         if process_to_stop is None and pid_to_stop is not None:
             # If we only have PID, try to find process using psutil
@@ -229,13 +271,13 @@ class LlamaCppServerManager:
         try:
             # Ensure URL includes scheme for requests
             url_to_check = self.server_url
-            if not url_to_check.startswith(("http://", "https://")):
+            if not url_to_check.startswith(("http://", "https://", "unix://")):
                 url_to_check = "http://" + url_to_check
 
             endpoint = f"{url_to_check.rstrip('/')}/{self.health_endpoint.lstrip('/')}"
             # Use a short timeout for health checks
-            response = requests.get(endpoint, timeout=2)
-            if response.status_code == 200:
+            status_code = get_status(url_to_check, self.health_endpoint, timeout=2)
+            if status_code == 200:
                 # Optional: Check if the process associated with self.pid still exists
                 if self.pid and not psutil.pid_exists(self.pid):
                     logger.warning(
@@ -248,10 +290,10 @@ class LlamaCppServerManager:
                 return True
             else:
                 logger.debug(
-                    f"Llama-cpp connection check failed at {endpoint}. Status: {response.status_code}"
+                    f"Llama-cpp connection check failed at {endpoint}. Status: {status_code}"
                 )
                 return False
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, OSError) as e:
             logger.debug(f"Llama-cpp connection check failed at {endpoint}. Error: {e}")
             return False
         except Exception as e:
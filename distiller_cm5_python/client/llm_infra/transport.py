@@ -0,0 +1,74 @@
+"""
+HTTP transport to the local LLM server: TCP loopback for http:// server URLs,
+or a Unix domain socket for unix:///path/to/socket server URLs.
+"""
+
+import http.client
+import logging
+import socket
+from typing import Dict, Optional
+
+import aiohttp
+import requests
+
+logger = logging.getLogger(__name__)
+
+UNIX_SCHEME = "unix://"
+
+# Requests over a Unix socket still need a host for the URL and Host header
+UNIX_BASE_URL = "http://localhost"
+
+
+def unix_socket_path(server_url: str) -> Optional[str]:
+    """The socket path of a unix:// server URL, or None for any other URL."""
+    if server_url.startswith(UNIX_SCHEME):
+        return server_url[len(UNIX_SCHEME) :].rstrip("/") or None
+    return None
+
+
+def http_base_url(server_url: str) -> str:
+    """The base URL that endpoint paths are appended to."""
+    if unix_socket_path(server_url):
+        return UNIX_BASE_URL
+    return server_url.rstrip("/")
+
+
+def client_session(server_url: str, **kwargs) -> aiohttp.ClientSession:
+    """An aiohttp session that connects over the server URL's transport."""
+    path = unix_socket_path(server_url)
+    if path:
+        kwargs.setdefault("connector", aiohttp.UnixConnector(path=path))
+    return aiohttp.ClientSession(**kwargs)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def get_status(
+    server_url: str, path: str, timeout: float, headers: Optional[Dict[str, str]] = None
+) -> int:
+    """Status code of a synchronous GET of path on the server.
+
+    Raises requests.exceptions.RequestException over TCP and OSError or
+    http.client.HTTPException over a Unix socket.
+    """
+    socket_path = unix_socket_path(server_url)
+    if not socket_path:
+        endpoint = f"{http_base_url(server_url)}/{path.lstrip('/')}"
+        return requests.get(endpoint, timeout=timeout, headers=headers).status_code
+    connection = _UnixHTTPConnection(socket_path, timeout)
+    try:
+        connection.request("GET", "/" + path.lstrip("/"), headers=headers or {})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
@@ -2,22 +2,34 @@
 LLM Server Provider - Unified provider for all LLM backends via HTTP
 """
 
+import copy
 import json
+import os
+import re
 import aiohttp
 import time
 import requests  # Add requests for sync check
+import socket
 import uuid
 import logging  # Added
-from typing import Any, Dict, List, Optional, AsyncGenerator, Callable, AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, AsyncGenerator, Callable, AsyncIterator, Tuple
 from distiller_cm5_python.utils.config import (
     TEMPERATURE,
     TOP_P,
     TOP_K,
     REPETITION_PENALTY,
     N_CTX,
+    KV_CACHE_TYPE,
+    FIT_N_CTX,
     MAX_TOKENS,
     STOP,
     MIN_P,
+    WARMUP_SPEC_PATH,
+    STREAMING_CHUNK_SIZE,
+    STREAMING_INTERVAL_MS,
+    TOOL_GRAMMAR,
+    SESSIONS_ENABLED,
 )  # Removed unused OPENAI_URL, DEEPSEEK_URL
 from distiller_cm5_python.utils.distiller_exception import (
     UserVisibleError,
@@ -31,6 +43,11 @@ from distiller_cm5_python.client.llm_infra.parsing_utils import (
     check_is_c_ntx_too_long,
     transform_tool_arguments,
 )
+from distiller_cm5_python.client.llm_infra.transport import (
+    client_session,
+    get_status,
+    http_base_url,
+)
 from distiller_cm5_python.client.ui.events.event_types import (
     EventType,
     StatusType,
@@ -41,6 +58,33 @@ from distiller_cm5_python.client.ui.events.event_dispatcher import EventDispatch
 # Get logger instance for this module
 logger = logging.getLogger(__name__)
 
+# Rough characters per prompt token, for budgeting history against n_ctx
+# without a tokenizer; errs towards overestimating tokens
+_CHARS_PER_TOKEN = 3
+
+# A history over budget is trimmed to this fraction of it, so the kept prefix
+# (and a server session) stays the same for the next few turns
+_HISTORY_TRIM_TARGET = 0.75
+
+# Histories estimated above this fraction of the budget are counted exactly
+# by the llama-cpp server's /count_tokens before they are trimmed
+_COUNT_TOKENS_FROM = 0.5
+
+# Tags the streaming parser acts on. The server coalesces tokens into frames,
+# so a tag can be split across two of them
+_STREAM_TAGS = ("<think>", "</think>", "<tool_call>")
+_THINK_TAG_RE = re.compile(r"\s*</?think>\s*")
+
+
+def _split_partial_tag(text: str) -> Tuple[str, str]:
+    """Split streamed text into what can be handled now and a trailing prefix of
+    a stream tag (e.g. "<tool_") that the next frame may complete."""
+    start = max(len(text) - max(len(tag) for tag in _STREAM_TAGS) + 1, 0)
+    for i in range(start, len(text)):
+        if text[i] == "<" and any(tag.startswith(text[i:]) for tag in _STREAM_TAGS):
+            return text[:i], text[i:]
+    return text, ""
+
 
 class _ToolCallAccumulator:
     """Helper class to accumulate tool call chunks from a stream and dispatch when complete."""
@@ -224,7 +268,7 @@ class LLMClient:
         """Initialize the LLM server provider. Assumes server is already running.
 
         Args:
-            server_url: URL of the LLM server (e.g., "http://localhost:8000" for llama-cpp or "https://openrouter.ai/api/v1" for openrouter)
+            server_url: URL of the LLM server (e.g., "http://localhost:8000" or "unix:///tmp/llm_server.sock" for llama-cpp or "https://openrouter.ai/api/v1" for openrouter)
             model: Model to use for completions (e.g., "local-model.gguf" or "openai/gpt-4o")
             provider_type: Type of provider ("llama-cpp" or "openrouter")
             api_key: API key (required for "openrouter")
@@ -248,6 +292,28 @@ class LLMClient:
         self.load_model_url = "/setModel"
         # Llama.cpp health endpoint (used for simple check)
         self.health_endpoint = "/health"
+        self.sessions_url = "/sessions"
+
+        # Llama.cpp server-side session: the server keeps the tools and history,
+        # so each request only uploads the messages added since the last one
+        self.use_sessions = SESSIONS_ENABLED
+        self._reset_session()
+
+        # Context the server actually loaded the model with; it can be smaller
+        # than N_CTX when the server fits n_ctx to free RAM
+        self.n_ctx = N_CTX
+        # Oldest messages left out of requests to fit n_ctx
+        self._dropped_messages: List[Dict] = []
+        self.count_tokens_url = "/count_tokens"
+        # Cleared when the server has no /count_tokens
+        self._server_token_counts = True
+
+        # Llama.cpp scheduling: "interactive" requests are served before
+        # "background" ones, and the server shares its queue fairly by client id
+        self.request_class = "interactive"
+        self.client_id = f"{socket.gethostname()}-{os.getpid()}"
+        # Queue position and estimated wait the server reported for the last request
+        self.last_queue_status: Optional[Tuple[int, float]] = None
 
         self.inference_configs = {
             "temperature": TEMPERATURE,
@@ -285,7 +351,7 @@ class LLMClient:
 
     def _get_endpoint(self, path: str) -> str:
         """Constructs the full endpoint URL"""
-        base = self.server_url.rstrip("/")
+        base = http_base_url(self.server_url)
         path = path.lstrip("/")
         return f"{base}/{path}"
 
@@ -366,6 +432,7 @@ class LLMClient:
         self.api_key = new_api_key
         self.timeout = new_timeout
         self.streaming = new_streaming
+        self._reset_session()
 
         # Removed creation/start of new manager
         return True
@@ -391,16 +458,16 @@ class LLMClient:
         """Synchronously check connection for llama-cpp server using health endpoint."""
         endpoint = self._get_endpoint(self.health_endpoint)
         try:
-            # Use requests for sync check, short timeout
-            response = requests.get(endpoint, timeout=2)
-            if response.status_code == 200:
+            # Sync check with a short timeout, over TCP or the Unix socket
+            status_code = get_status(self.server_url, self.health_endpoint, timeout=2)
+            if status_code == 200:
                 return True
             else:
                 logger.warning(
-                    f"Sync llama-cpp connection check failed at {endpoint}. Status: {response.status_code}"
+                    f"Sync llama-cpp connection check failed at {endpoint}. Status: {status_code}"
                 )
                 return False
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, OSError) as e:
             logger.warning(
                 f"Sync llama-cpp connection check failed at {endpoint}. Error: {e}"
             )
@@ -460,7 +527,7 @@ class LLMClient:
             return False
 
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session(self.server_url) as session:
                 async with session.get(
                     endpoint, timeout=10, headers=headers
                 ) as response:
@@ -489,7 +556,11 @@ class LLMClient:
         return headers
 
     def _prepare_chat_completion_payload(
-        self, messages: List[Dict], tools: Optional[List[Dict]], stream: bool
+        self,
+        messages: List[Dict],
+        tools: Optional[List[Dict]],
+        stream: bool,
+        request_id: Optional[str] = None,
     ) -> Dict:
         """Prepares the payload for the /chat/completions endpoint."""
         payload = {
@@ -499,11 +570,30 @@ class LLMClient:
             "inference_configs": self.inference_configs,
             # Include load_model_configs for llama.cpp provider
             "load_model_configs": (
-                {"n_ctx": N_CTX} if self.provider_type == "llama-cpp" else {}
+                self._load_model_configs() if self.provider_type == "llama-cpp" else {}
             ),
         }
         if tools:
             payload["tools"] = tools
+            if self.provider_type == "llama-cpp" and TOOL_GRAMMAR is not None:
+                # Server constrains <tool_call> blocks to the tool schemas;
+                # unset, the server's --tool_grammar default applies
+                payload["inference_configs"] = {
+                    **self.inference_configs,
+                    "tool_grammar": TOOL_GRAMMAR,
+                }
+        if request_id and self.provider_type == "llama-cpp":
+            # Lets the server cancel this generation via /cancel/{request_id}
+            payload["request_id"] = request_id
+        if self.provider_type == "llama-cpp":
+            payload["request_class"] = self.request_class
+            payload["client_id"] = self.client_id
+        if stream and self.provider_type == "llama-cpp":
+            # Let the server coalesce tokens into fewer SSE frames
+            payload["stream_options"] = {
+                "chunk_tokens": STREAMING_CHUNK_SIZE,
+                "interval_ms": STREAMING_INTERVAL_MS,
+            }
 
         # Log summary
         log_summary = {
@@ -516,6 +606,299 @@ class LLMClient:
         logger.debug(f"Prepared chat completion payload: {log_summary}")
         return payload
 
+    def _load_model_configs(self) -> Dict[str, Any]:
+        return {
+            "n_ctx": N_CTX,
+            "type_k": KV_CACHE_TYPE,
+            "type_v": KV_CACHE_TYPE,
+            "fit_n_ctx": FIT_N_CTX,
+        }
+
+    # --- Context budget (llama-cpp) ---
+
+    def _note_n_ctx(self, data: Any):
+        """Record the effective n_ctx a server response reports."""
+        n_ctx = data.get("n_ctx") if isinstance(data, dict) else None
+        if isinstance(n_ctx, int) and n_ctx > 0 and n_ctx != self.n_ctx:
+            logger.info(f"LLM server context window is {n_ctx} tokens (configured {N_CTX})")
+            self.n_ctx = n_ctx
+
+    def _history_budget(self) -> int:
+        return self.n_ctx - min(MAX_TOKENS, self.n_ctx // 4)
+
+    def _estimate_tokens(self, messages: List[Dict], tools: Optional[List[Dict]]) -> int:
+        chars = len(json.dumps(messages)) + (len(json.dumps(tools)) if tools else 0)
+        return chars // _CHARS_PER_TOKEN
+
+    async def _count_tokens(
+        self,
+        http_session: aiohttp.ClientSession,
+        messages: List[Dict],
+        tools: Optional[List[Dict]],
+    ) -> Optional[Dict[str, Any]]:
+        """Per-message prompt token counts from the server, or None when the
+        history is clearly within budget or the server cannot count."""
+        if not self._server_token_counts:
+            return None
+        if self._estimate_tokens(messages, tools) < self._history_budget() * _COUNT_TOKENS_FROM:
+            return None
+        payload = {"model": self.model, "messages": messages, "tools": tools or []}
+        try:
+            async with http_session.post(
+                self._get_endpoint(self.count_tokens_url),
+                json=payload,
+                headers=self._get_headers(),
+                timeout=self.timeout,
+            ) as response:
+                if response.status in (404, 405):
+                    logger.info("LLM server cannot count tokens; estimating from characters")
+                    self._server_token_counts = False
+                    return None
+                if response.status != 200:
+                    logger.warning(
+                        f"Token count failed (status {response.status}): "
+                        f"{(await response.text())[:200]}"
+                    )
+                    return None
+                data = await response.json()
+        except aiohttp.ClientError as e:
+            logger.warning(f"Token count request failed: {e}")
+            return None
+        self._note_n_ctx(data)
+        if len(data.get("messages", [])) != len(messages):
+            return None
+        return data
+
+    def _budget_history(
+        self,
+        messages: List[Dict],
+        tools: Optional[List[Dict]],
+        token_counts: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict]:
+        """Leave out the oldest turns when the history would not fit n_ctx.
+
+        Leading system messages and the latest turn are always kept. Once a turn
+        is left out it stays out, so the history sent keeps a stable prefix; a
+        rewritten history starts over. Tokens come from the server's
+        /count_tokens response when given, else they are estimated from
+        characters; the server's context policy still makes the exact cut.
+        """
+        head = 0
+        while head < len(messages) and messages[head].get("role") == "system":
+            head += 1
+        dropped = len(self._dropped_messages)
+        if messages[head : head + dropped] != self._dropped_messages:
+            self._dropped_messages, dropped = [], 0
+        budget = self._history_budget()
+
+        if token_counts is not None:
+            costs = {id(m): n for m, n in zip(messages, token_counts["messages"])}
+            fixed = token_counts["total_tokens"] - sum(token_counts["messages"])
+
+            def estimate(kept: List[Dict]) -> int:
+                return fixed + sum(costs[id(m)] for m in kept)
+
+        else:
+
+            def estimate(kept: List[Dict]) -> int:
+                return self._estimate_tokens(kept, tools)
+
+        kept = messages[:head] + messages[head + dropped :]
+        if estimate(kept) <= budget:
+            return kept
+        while estimate(kept) > budget * _HISTORY_TRIM_TARGET:
+            # The next turn starts at the first user message after the current one
+            turn_end = next(
+                (
+                    i
+                    for i in range(head + 1, len(kept))
+                    if kept[i].get("role") == "user"
+                ),
+                None,
+            )
+            if turn_end is None:
+                break
+            self._dropped_messages.extend(copy.deepcopy(kept[head:turn_end]))
+            kept = kept[:head] + kept[turn_end:]
+        logger.info(
+            f"Left out the {len(self._dropped_messages)} oldest messages to fit "
+            f"n_ctx {self.n_ctx} (~{estimate(kept)} prompt tokens sent)"
+        )
+        return kept
+
+    # --- Admission and queueing (llama-cpp) ---
+
+    def _note_queue_status(
+        self, response: aiohttp.ClientResponse, dispatcher: Optional[EventDispatcher] = None
+    ):
+        """Record (and show) where the server queued a streamed request before its first token."""
+        position = response.headers.get("X-Queue-Position")
+        if position is None:
+            self.last_queue_status = None
+            return
+        try:
+            self.last_queue_status = (
+                int(position),
+                float(response.headers.get("X-Estimated-Wait-S", 0)),
+            )
+        except ValueError:
+            self.last_queue_status = None
+            return
+        ahead, wait_s = self.last_queue_status
+        if ahead > 0:
+            logger.info(f"LLM request queued behind {ahead} others (~{wait_s:.1f}s)")
+            if dispatcher:
+                dispatcher.dispatch(
+                    MessageSchema(
+                        type=EventType.STATUS,
+                        content=f"Waiting for the LLM server ({ahead} ahead, ~{wait_s:.0f}s)",
+                        status=StatusType.IN_PROGRESS,
+                    )
+                )
+
+    def _server_busy(self, response: aiohttp.ClientResponse, detail: Any) -> UserVisibleError:
+        """The error for a request the server rejected with 429 (queue full)."""
+        retry_after = response.headers.get("Retry-After", "a few")
+        logger.warning(f"LLM server rejected the request as busy: {detail}")
+        return UserVisibleError(
+            f"The LLM server is busy ({detail}). Please try again in {retry_after} seconds."
+        )
+
+    # --- Server-side sessions (llama-cpp) ---
+
+    def _reset_session(self):
+        """Forget the server-side session; the next request opens a new one."""
+        self._session_id: Optional[str] = None
+        self._session_tools: Optional[List[Dict]] = None
+        # Copies of the messages the server holds for the session
+        self._session_messages: List[Dict] = []
+
+    def _sessions_active(self) -> bool:
+        return self.use_sessions and self.provider_type == "llama-cpp"
+
+    async def _open_session(
+        self, http_session: aiohttp.ClientSession, tools: Optional[List[Dict]]
+    ) -> bool:
+        """Open a session for tools, closing the previous one. Returns False (and
+        stops using sessions) if the server does not support them."""
+        if self._session_id is not None:
+            try:
+                async with http_session.delete(
+                    self._get_endpoint(f"{self.sessions_url}/{self._session_id}"),
+                    timeout=self.timeout,
+                ):
+                    pass
+            except aiohttp.ClientError as e:
+                logger.debug(f"Could not close session {self._session_id}: {e}")
+        self._reset_session()
+        payload = {
+            "model": self.model,
+            "tools": tools or [],
+            "load_model_configs": self._load_model_configs(),
+        }
+        async with http_session.post(
+            self._get_endpoint(self.sessions_url),
+            json=payload,
+            headers=self._get_headers(),
+            timeout=self.timeout,
+        ) as response:
+            if response.status in (404, 405):
+                logger.info("LLM server does not support sessions; sending full histories")
+                self.use_sessions = False
+                return False
+            if response.status != 200:
+                # e.g. too many open sessions: this request sends the full history
+                logger.warning(
+                    f"Could not open an LLM server session (status {response.status}): "
+                    f"{(await response.text())[:200]}"
+                )
+                return False
+            data = await response.json()
+        self._note_n_ctx(data)
+        self._session_id = data["session_id"]
+        self._session_tools = copy.deepcopy(tools or [])
+        logger.debug(f"Opened LLM server session {self._session_id}")
+        return True
+
+    async def _chat_completion_request(
+        self,
+        http_session: aiohttp.ClientSession,
+        messages: List[Dict],
+        tools: Optional[List[Dict]],
+        stream: bool,
+        request_id: Optional[str] = None,
+    ) -> Tuple[str, Dict, int]:
+        """Endpoint, payload and session base (-1 without a session) for a chat
+        completion. In a session only the messages after the first base are sent;
+        a new session is opened when the tools change or the history was rewritten."""
+        if self._sessions_active():
+            base = len(self._session_messages)
+            if (
+                self._session_id is None
+                or (tools or []) != self._session_tools
+                or messages[:base] != self._session_messages
+            ):
+                if await self._open_session(http_session, tools):
+                    base = 0
+            if self._session_id is not None:
+                payload = self._prepare_chat_completion_payload(
+                    messages[base:], tools, stream, request_id
+                )
+                # The session holds the model, its load configs and the tools
+                for key in ("model", "tools", "load_model_configs"):
+                    payload.pop(key, None)
+                payload["base"] = base
+                endpoint = self._get_endpoint(
+                    f"{self.sessions_url}/{self._session_id}{self.chat_completion_url}"
+                )
+                return endpoint, payload, base
+        payload = self._prepare_chat_completion_payload(messages, tools, stream, request_id)
+        return self._get_endpoint(self.chat_completion_url), payload, -1
+
+    @asynccontextmanager
+    async def _post_chat_completion(
+        self,
+        http_session: aiohttp.ClientSession,
+        messages: List[Dict],
+        tools: Optional[List[Dict]],
+        stream: bool,
+        request_id: Optional[str] = None,
+    ):
+        """POST a chat completion and yield the response.
+
+        If the server no longer has the session (restart, expiry, a turn it did
+        not finish), the session is reopened and the request sent once more with
+        the full history.
+        """
+        if self.provider_type == "llama-cpp":
+            token_counts = await self._count_tokens(http_session, messages, tools)
+            messages = self._budget_history(messages, tools, token_counts)
+        endpoint, payload, base = await self._chat_completion_request(
+            http_session, messages, tools, stream, request_id
+        )
+        response = await http_session.post(
+            endpoint, json=payload, headers=self._get_headers(), timeout=self.timeout
+        )
+        try:
+            if base >= 0 and response.status in (404, 409):
+                logger.info(
+                    f"LLM server session {self._session_id} is out of sync "
+                    f"(status {response.status}); reopening it"
+                )
+                response.release()
+                self._reset_session()
+                endpoint, payload, base = await self._chat_completion_request(
+                    http_session, messages, tools, stream, request_id
+                )
+                response = await http_session.post(
+                    endpoint, json=payload, headers=self._get_headers(), timeout=self.timeout
+                )
+            if base >= 0 and response.status == 200:
+                self._session_messages.extend(copy.deepcopy(messages[base:]))
+            yield response
+        finally:
+            response.release()
+
     async def restore_cache(self, messages: List[Dict], tools: List[Dict]):
         """(Llama-cpp only) Restore the KV cache via API call."""
         if self.provider_type != "llama-cpp":
@@ -532,7 +915,7 @@ class LLMClient:
             "inference_configs": self.inference_configs,
         }
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session(self.server_url) as session:
                 async with session.post(
                     endpoint,
                     json=payload,
@@ -552,6 +935,26 @@ class LLMClient:
             logger.error(f"Unexpected error restoring cache: {e}")
             return {"status": "error", "detail": str(e)}
 
+    def write_warmup_spec(self, messages: List[Dict], tools: List[Dict]) -> bool:
+        """(Llama-cpp only) Save the static prompt prefix for the server's boot warmup.
+
+        The local server reads this file on its next start and pre-evaluates the
+        system prompt and tool schemas before the first query arrives.
+        """
+        if self.provider_type != "llama-cpp" or not WARMUP_SPEC_PATH:
+            return False
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(WARMUP_SPEC_PATH)), exist_ok=True)
+            tmp_path = WARMUP_SPEC_PATH + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"messages": messages, "tools": tools}, f)
+            os.replace(tmp_path, WARMUP_SPEC_PATH)
+            logger.debug(f"Wrote warmup spec to {WARMUP_SPEC_PATH}")
+            return True
+        except OSError as e:
+            logger.warning(f"Failed to write warmup spec {WARMUP_SPEC_PATH}: {e}")
+            return False
+
     async def load_model(self):
         """(Llama-cpp only) Request the server to load the current model via API call."""
         if self.provider_type != "llama-cpp":
@@ -564,9 +967,9 @@ class LLMClient:
             f"LLMClient.load_model: Requesting server to load model '{self.model}' via API"
         )
         endpoint = self._get_endpoint(self.load_model_url)
-        payload = {"model_name": self.model, "inference_configs": {"n_ctx": N_CTX}}
+        payload = {"model_name": self.model, "load_model_configs": self._load_model_configs()}
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session(self.server_url) as session:
                 async with session.post(
                     endpoint,
                     json=payload,
@@ -578,6 +981,7 @@ class LLMClient:
                         f"Load model response status: {response.status}, data: {response_data}"
                     )
                     response.raise_for_status()
+                    self._note_n_ctx(response_data)
                     return response_data
         except aiohttp.ClientError as e:
             logger.error(f"Error requesting model load: {e}")
@@ -606,17 +1010,13 @@ class LLMClient:
         Returns:
             Dict: The full response from the LLM, formatted as {"message": {...}}
         """
-        endpoint = self._get_endpoint(self.chat_completion_url)
-        payload = self._prepare_chat_completion_payload(messages, tools, stream=False)
-        headers = self._get_headers()
-
         start_time_req = time.time()
 
         response_data = None
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    endpoint, json=payload, headers=headers, timeout=self.timeout
+            async with client_session(self.server_url) as session:
+                async with self._post_chat_completion(
+                    session, messages, tools, stream=False
                 ) as response:
                     status_code = response.status
                     response_text = await response.text()
@@ -633,6 +1033,8 @@ class LLMClient:
                         except json.JSONDecodeError:
                             pass
 
+                        if self.provider_type == "llama-cpp" and status_code == 429:
+                            raise self._server_busy(response, error_detail)
                         if self.provider_type == "llama-cpp":
                             ctx_info = check_is_c_ntx_too_long(str(error_detail))
                             if ctx_info:
@@ -650,6 +1052,7 @@ class LLMClient:
                         response.raise_for_status()
 
                     response_data = json.loads(response_text)
+                    self._note_n_ctx(response_data)
 
             end_time_req = time.time()
             # Log summary of successful response at DEBUG
@@ -782,9 +1185,6 @@ class LLMClient:
         """
         start_time_req = time.time()
         endpoint = self._get_endpoint(self.chat_completion_url)
-        payload = self._prepare_chat_completion_payload(messages, tools, stream=True)
-        headers = self._get_headers()
-
         # Use a unique ID for this streaming request for event tracking
         stream_request_id = str(uuid.uuid4())
         logger.info(
@@ -798,11 +1198,12 @@ class LLMClient:
             uuid.uuid4()
         )  # ID for the current continuous message/action content
         current_content_type = EventType.MESSAGE  # Start expecting message content
+        held_content = ""  # Possible start of a tag, completed by the next frame
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    endpoint, json=payload, headers=headers, timeout=self.timeout
+            async with client_session(self.server_url) as session:
+                async with self._post_chat_completion(
+                    session, messages, tools, stream=True, request_id=stream_request_id
                 ) as response:
                     # --- Initial Response Check ---
                     if response.status != 200:
@@ -816,6 +1217,8 @@ class LLMClient:
                         except json.JSONDecodeError:
                             pass
 
+                        if self.provider_type == "llama-cpp" and response.status == 429:
+                            raise self._server_busy(response, error_detail)
                         # Check for specific llama-cpp context length error
                         if self.provider_type == "llama-cpp":
                             req_tokens, ctx_window = check_is_c_ntx_too_long(
@@ -836,11 +1239,16 @@ class LLMClient:
                         )
                         response.raise_for_status()  # Raise ClientResponseError for non-200 status
 
+                    if self.provider_type == "llama-cpp":
+                        self._note_queue_status(response, dispatcher)
+
                     # --- Stream Processing ---
                     async for event in _parse_llm_stream(response):
                         if event["type"] == "data":
                             try:
                                 chunk_data = event["payload"]
+                                # The first chunk reports the server's n_ctx
+                                self._note_n_ctx(chunk_data)
                                 if (
                                     "choices" in chunk_data
                                     and len(chunk_data["choices"]) > 0
@@ -852,10 +1260,13 @@ class LLMClient:
                                         "content" in delta
                                         and delta["content"] is not None
                                     ):
-                                        delta_content = delta["content"]
+                                        # Hold back a tag cut off at the frame boundary
+                                        delta_content, held_content = _split_partial_tag(
+                                            held_content + delta["content"]
+                                        )
                                         # adapt for thinking method in Qwen 3 
                                         if "<think>" in delta_content or "</think>" in delta_content: 
-                                            delta_content = delta_content.replace("<think>", "").replace("</think>", "").strip()
+                                            delta_content = _THINK_TAG_RE.sub("", delta_content)
 
                                         if delta_content == "" or delta_content == "\n\n":
                                             continue
@@ -937,6 +1348,19 @@ class LLMClient:
                             # Decide if we should continue or break on parsing error?
                             # For now, let's continue processing subsequent lines if possible.
 
+                    if held_content:
+                        # The stream ended on text that only looked like a tag
+                        full_response_content += held_content
+                        if dispatcher:
+                            dispatcher.dispatch(
+                                MessageSchema(
+                                    id=current_content_event_id,
+                                    type=current_content_type,
+                                    content=held_content,
+                                    status=StatusType.IN_PROGRESS,
+                                )
+                            )
+
                     # dispatch the last one
                     if current_content_type == EventType.MESSAGE:
                         self._emit_success(
@@ -186,6 +186,12 @@ class MCPClient:
                     CacheEvent.restoration_started(model_name=self.llm_provider.model)
                 )
 
+                # Let the server pre-evaluate this prefix on its next boot
+                self.llm_provider.write_warmup_spec(
+                    self.message_processor.get_formatted_messages(),
+                    self.available_tools,
+                )
+
                 try:
                     # Restore cache (this is the operation that can cause errors if interrupted)
                     await self.llm_provider.restore_cache(
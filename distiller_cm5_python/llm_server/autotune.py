@@ -0,0 +1,272 @@
+"""
+Auto Tune - Finds the llama.cpp thread counts and batch sizes that run a model
+fastest on this device. Short prompt-eval and decode benchmarks are run over a
+grid of thread counts and (n_batch, n_ubatch) pairs, and the fastest choice is
+stored in cache/autotune.json, keyed by a hash of the model file and the CPU it
+was measured on. Later loads of the same model on the same CPU apply it.
+"""
+import hashlib
+import json
+import logging
+import os
+import platform
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from llama_cpp import Llama
+
+logger = logging.getLogger(__name__)
+
+TUNING_FILENAME = "autotune.json"
+
+# Load options chosen by the tuner
+TUNED_KEYS = ("n_threads", "n_threads_batch", "n_batch", "n_ubatch")
+
+# (n_batch, n_ubatch) pairs tried for every thread count
+DEFAULT_BATCH_SIZES: Tuple[Tuple[int, int], ...] = (
+    (512, 512),
+    (512, 256),
+    (256, 256),
+    (512, 128),
+    (128, 128),
+)
+
+# Bytes hashed from each end of a model file; size plus head and tail tell
+# GGUF files apart without reading gigabytes of weights
+FINGERPRINT_BYTES = 1 << 20
+
+_BENCH_TEXT = (
+    "The quick brown fox jumps over the lazy dog while the assistant reads the "
+    "tool schemas, the system prompt and the conversation so far. "
+)
+# Prompt tokens evaluated before timing, so page faults on mmap'd weights are not measured
+_WARMUP_TOKENS = 8
+
+_fingerprints: Dict[Tuple[str, int, int], str] = {}
+
+
+def cpu_info() -> Dict[str, Any]:
+    """What identifies this CPU: model name, architecture and usable cores."""
+    model = None
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                # x86 has "model name"; ARM boards report "Model" or "Hardware"
+                if key.strip() in ("model name", "Model", "Hardware") and value.strip():
+                    model = value.strip()
+                    break
+    except OSError:
+        pass
+    try:
+        usable = len(os.sched_getaffinity(0))
+    except AttributeError:
+        usable = os.cpu_count() or 1
+    return {
+        "model": model or platform.processor() or "unknown",
+        "machine": platform.machine(),
+        "cpus": os.cpu_count() or 1,
+        "usable_cpus": usable,
+    }
+
+
+def cpu_fingerprint(info: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(info, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def model_fingerprint(model_path: str) -> str:
+    """Hash of a model file's size, first and last MiB; memoized by path and mtime.
+
+    Models without a file (the fake backend) are identified by their name.
+    """
+    if not os.path.exists(model_path):
+        return hashlib.sha256(b"name:" + os.path.basename(model_path).encode("utf-8")).hexdigest()[:16]
+    real_path = os.path.realpath(model_path)
+    stat = os.stat(real_path)
+    key = (real_path, stat.st_mtime_ns, stat.st_size)
+    fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        digest = hashlib.sha256(str(stat.st_size).encode("ascii"))
+        with open(real_path, "rb") as f:
+            digest.update(f.read(FINGERPRINT_BYTES))
+            if stat.st_size > FINGERPRINT_BYTES:
+                f.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+                digest.update(f.read(FINGERPRINT_BYTES))
+        fingerprint = _fingerprints[key] = digest.hexdigest()[:16]
+    return fingerprint
+
+
+def thread_candidates(cpus: int) -> List[int]:
+    """Thread counts to try: every count up to 8 cores, quarters of the cores above."""
+    if cpus <= 8:
+        return list(range(1, cpus + 1))
+    return sorted({cpus // 4, cpus // 2, 3 * cpus // 4, cpus})
+
+
+def _bench_tokens(model: Llama, n_tokens: int) -> List[int]:
+    text_tokens = model.tokenize(_BENCH_TEXT.encode("utf-8"), add_bos=False)
+    repeats = n_tokens // len(text_tokens) + 1
+    return [model.token_bos()] + (text_tokens * repeats)[: n_tokens - 1]
+
+
+def benchmark(model: Llama, prompt_tokens: int, decode_tokens: int) -> Tuple[float, float]:
+    """(prompt eval tokens/s, decode tokens/s) of a loaded model; decode_tokens=0 skips decode."""
+    tokens = _bench_tokens(model, prompt_tokens)
+    model.reset()
+    model.eval(tokens[:_WARMUP_TOKENS])
+    model.reset()
+
+    started = time.perf_counter()
+    model.eval(tokens)
+    prompt_tps = len(tokens) / (time.perf_counter() - started)
+
+    decode_tps = 0.0
+    if decode_tokens > 0:
+        started = time.perf_counter()
+        for i in range(decode_tokens):
+            model.eval([tokens[1 + i % (len(tokens) - 1)]])
+        decode_tps = decode_tokens / (time.perf_counter() - started)
+    model.reset()
+    return prompt_tps, decode_tps
+
+
+def autotune(
+    load: Callable[[Dict[str, Any]], Llama],
+    threads: Sequence[int],
+    batch_sizes: Sequence[Tuple[int, int]] = DEFAULT_BATCH_SIZES,
+    prompt_tokens: int = 256,
+    decode_tokens: int = 32,
+) -> Dict[str, Any]:
+    """Benchmark every thread count with every (n_batch, n_ubatch) pair.
+
+    load(options) constructs the model with the given load options. Decode speed
+    does not depend on the batch sizes, so it is measured once per thread count.
+    n_threads is the fastest decode thread count; n_threads_batch, n_batch and
+    n_ubatch come from the fastest prompt eval.
+    """
+    grid = []
+    for n_threads in threads:
+        for i, (n_batch, n_ubatch) in enumerate(batch_sizes):
+            options = {
+                "n_threads": n_threads,
+                "n_threads_batch": n_threads,
+                "n_batch": n_batch,
+                "n_ubatch": min(n_ubatch, n_batch),
+            }
+            model = load(options)
+            try:
+                prompt_tps, decode_tps = benchmark(
+                    model, prompt_tokens, decode_tokens if i == 0 else 0
+                )
+            finally:
+                model.close()
+            result = {**options, "prompt_tokens_per_s": round(prompt_tps, 2)}
+            if i == 0:
+                result["decode_tokens_per_s"] = round(decode_tps, 2)
+            logger.info(f"Autotune {options}: {result}")
+            grid.append(result)
+
+    best_prompt = max(grid, key=lambda r: r["prompt_tokens_per_s"])
+    best_decode = max(
+        (r for r in grid if "decode_tokens_per_s" in r), key=lambda r: r["decode_tokens_per_s"]
+    )
+    return {
+        "options": {
+            "n_threads": best_decode["n_threads"],
+            "n_threads_batch": best_prompt["n_threads_batch"],
+            "n_batch": best_prompt["n_batch"],
+            "n_ubatch": best_prompt["n_ubatch"],
+        },
+        "prompt_tokens_per_s": best_prompt["prompt_tokens_per_s"],
+        "decode_tokens_per_s": best_decode["decode_tokens_per_s"],
+        "prompt_tokens": prompt_tokens,
+        "decode_tokens": decode_tokens,
+        "grid": grid,
+    }
+
+
+class TuningStore:
+    """Tuning results per model file and CPU, persisted to a JSON file."""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.path = os.path.join(cache_dir, TUNING_FILENAME) if cache_dir else None
+        self.cpu = cpu_info()
+        self.cpu_key = cpu_fingerprint(self.cpu)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        # Stats
+        self.applied = 0
+        self.tuned = 0
+
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable tuning file {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write tuning file {self.path}: {e}")
+
+    def key(self, model_path: str) -> str:
+        return f"{model_fingerprint(model_path)}-{self.cpu_key}"
+
+    def get(self, model_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(self.key(model_path))
+
+    def options(self, model_path: str) -> Dict[str, Any]:
+        """Tuned load options for the model on this CPU; empty if it was never tuned."""
+        entry = self.get(model_path)
+        if entry is None:
+            return {}
+        self.applied += 1
+        return dict(entry["options"])
+
+    def put(self, model_path: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        entry = {
+            "model": os.path.basename(model_path),
+            "cpu": self.cpu,
+            "tuned_at": time.time(),
+            **result,
+        }
+        with self._lock:
+            self._entries[self.key(model_path)] = entry
+            self.tuned += 1
+            self._save()
+        return entry
+
+    def list(self) -> Dict[str, Dict[str, Any]]:
+        """Entries measured on this CPU, without their full grids."""
+        with self._lock:
+            return {
+                key: {k: v for k, v in entry.items() if k != "grid"}
+                for key, entry in self._entries.items()
+                if key.endswith(self.cpu_key)
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "cpu": self.cpu,
+                "applied": self.applied,
+                "tuned": self.tuned,
+            }
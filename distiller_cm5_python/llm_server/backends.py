@@ -0,0 +1,172 @@
+"""
+Backends - What the server constructs models with: llama-cpp-python for real
+GGUF files, or the deterministic FakeLlama for hardware-free load testing.
+Backends also fork a loaded model into extra contexts for parallel inference slots.
+"""
+import contextlib
+import copy
+import ctypes
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import llama_cpp._internals as internals
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+
+from distiller_cm5_python.llm_server.fake_llama import FakeLlama
+from distiller_cm5_python.llm_server.speculative import GgufDraftModel, SpeculativeLlama
+
+logger = logging.getLogger(__name__)
+
+
+class LlamaBackend:
+    """Models are GGUF files in the models directory, run by llama.cpp."""
+
+    name = "llama"
+
+    def model_exists(self, model_path: str) -> bool:
+        return os.path.exists(model_path)
+
+    def load(
+        self,
+        model_path: str,
+        n_ctx: int,
+        draft: Optional[LlamaDraftModel] = None,
+        **kwargs: Any,
+    ) -> Llama:
+        if draft is not None:
+            logger.info(f"Speculative decoding enabled with {type(draft).__name__}")
+            return SpeculativeLlama(
+                model_path=model_path,
+                verbose=False,
+                n_gpu_layers=0,
+                n_ctx=n_ctx,
+                draft=draft,
+                **kwargs,
+            )
+        return Llama(model_path=model_path, verbose=False, n_gpu_layers=0, n_ctx=n_ctx, **kwargs)
+
+    def fork(self, model: Llama) -> Llama:
+        """Another Llama on the same llama_model with its own context and KV cache.
+
+        The weights are loaded (and mmap'd) once; each fork only allocates a
+        context of the same n_ctx and n_batch. Forks share the model's prefix
+        cache and must be closed before the model they were forked from.
+        """
+        fork = copy.copy(model)
+        fork._stack = contextlib.ExitStack()
+        fork._ctx = fork._stack.enter_context(
+            contextlib.closing(
+                internals.LlamaContext(
+                    model=model._model, params=model.context_params, verbose=model.verbose
+                )
+            )
+        )
+        fork._batch = fork._stack.enter_context(
+            contextlib.closing(
+                internals.LlamaBatch(
+                    n_tokens=model.n_batch,
+                    embd=0,
+                    n_seq_max=model.context_params.n_ctx,
+                    verbose=model.verbose,
+                )
+            )
+        )
+        fork._candidates = internals.LlamaTokenDataArray(n_vocab=model._n_vocab)
+        fork._mirostat_mu = ctypes.c_float(2.0 * 5.0)
+        fork._sampler = None
+        fork._lora_adapter = None
+        fork.n_tokens = 0
+        fork.input_ids = np.ndarray(model.input_ids.shape, dtype=np.intc)
+        fork.scores = np.ndarray(model.scores.shape, dtype=np.single)
+        if isinstance(model, SpeculativeLlama):
+            _fork_draft(fork, model, self)
+        return fork
+
+
+def _fork_draft(fork: SpeculativeLlama, model: SpeculativeLlama, backend: LlamaBackend):
+    """Give a forked SpeculativeLlama its own draft state and counters."""
+    draft = model.default_draft
+    if isinstance(draft, GgufDraftModel):
+        # The draft model keeps its own KV cache, so it needs a context per slot too
+        draft = GgufDraftModel(backend.fork(draft.model), draft.num_pred_tokens)
+    elif draft is not None:
+        draft = copy.copy(draft)
+    fork.default_draft = draft
+    fork.draft_model = fork._draft if draft is not None else None
+    fork._pending_draft = 0
+    fork._last_verify = None
+    fork.drafted_tokens = 0
+    fork.accepted_tokens = 0
+    fork.verify_steps = 0
+
+
+class FakeBackend:
+    """Any model name loads a FakeLlama; no file needs to exist.
+
+    Latencies are in seconds: prompt_eval_s_per_token for every prompt token
+    evaluated and token_s for every generated token.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        prompt_eval_s_per_token: float = 0.0005,
+        token_s: float = 0.02,
+        reply: Optional[str] = None,
+    ):
+        self.prompt_eval_s_per_token = prompt_eval_s_per_token
+        self.token_s = token_s
+        self.reply = reply
+
+    def model_exists(self, model_path: str) -> bool:
+        return True
+
+    def load(
+        self,
+        model_path: str,
+        n_ctx: int,
+        draft: Optional[LlamaDraftModel] = None,
+        **kwargs: Any,
+    ) -> FakeLlama:
+        if draft is not None:
+            logger.info("Speculative decoding is not simulated by the fake backend")
+        options: Dict[str, Any] = {}
+        if self.reply is not None:
+            options["reply"] = self.reply
+        return FakeLlama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            prompt_eval_s_per_token=self.prompt_eval_s_per_token,
+            token_s=self.token_s,
+            **options,
+        )
+
+    def fork(self, model: FakeLlama) -> FakeLlama:
+        """A second fake context with the same settings and prefix cache."""
+        fork = FakeLlama(
+            model_path=model.model_path,
+            n_ctx=model.n_ctx(),
+            n_batch=model.n_batch,
+            prompt_eval_s_per_token=model.prompt_eval_s_per_token,
+            token_s=model.token_s,
+            state_bytes_per_token=model.state_bytes_per_token,
+        )
+        fork.reply_tokens = model.reply_tokens
+        fork.set_cache(model.cache)
+        return fork
+
+
+BACKENDS = ("llama", "fake")
+
+
+def make_backend(name: str, prompt_eval_s_per_token: float = 0.0005, token_s: float = 0.02):
+    """Backend for a --backend value; the latencies only apply to the fake backend."""
+    if name == "llama":
+        return LlamaBackend()
+    if name == "fake":
+        return FakeBackend(prompt_eval_s_per_token=prompt_eval_s_per_token, token_s=token_s)
+    raise ValueError(f"Unknown backend '{name}', expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,169 @@
+"""
+Cancellation - Per-request cancel flags that llama checks after every sampled
+token, so a dropped client or an explicit /cancel stops generation within a token.
+A request with a token budget is preempted the same way once the budget is used
+up and the scheduler has more urgent work waiting; the server then requeues it
+and resume() lets it continue where it stopped.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# CancelToken.reason of a generation stopped for more urgent work
+PREEMPTED = "preempted"
+
+
+class RequestCancelledError(Exception):
+    """Raised when a request is cancelled before its generation started."""
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class CancelToken:
+    """Cancel flag for one generation.
+
+    Instances are callable with llama's StoppingCriteria signature; llama calls
+    them once per sampled token, which is also how generated tokens are counted.
+    """
+
+    def __init__(self, request_id: str, max_tokens: int):
+        self.request_id = request_id
+        self.max_tokens = max_tokens
+        self.generated_tokens = 0
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        # Once token_budget tokens are generated, should_yield() returning True
+        # preempts the generation; 0 never preempts
+        self.token_budget = 0
+        self.should_yield: Optional[Callable[[], bool]] = None
+        # generated_tokens when the current budget started, and resumes so far
+        self._budget_start = 0
+        self.preemptions = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str):
+        # A cancel overrides a preemption, so the request is not resumed
+        if not self._event.is_set() or self.preempted:
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def preempted(self) -> bool:
+        return self.reason == PREEMPTED
+
+    def set_budget(self, token_budget: int, should_yield: Optional[Callable[[], bool]]):
+        """Preempt the generation after token_budget tokens whenever should_yield()."""
+        self.token_budget = token_budget
+        self.should_yield = should_yield
+
+    def resume(self) -> bool:
+        """Clear a preemption so the generation can continue, with a fresh token
+        budget; False if the request was not preempted (or was cancelled since)."""
+        if not self.preempted:
+            return False
+        self.preemptions += 1
+        self._budget_start = self.generated_tokens
+        self.reason = None
+        self._event.clear()
+        return True
+
+    @property
+    def tokens_saved(self) -> int:
+        """Remaining max_tokens budget at the time generation stopped."""
+        if not self.cancelled or self.preempted:
+            return 0
+        return max(self.max_tokens - self.generated_tokens, 0)
+
+    def __call__(self, input_ids, logits) -> bool:
+        self.generated_tokens += 1
+        if (
+            self.should_yield is not None
+            and 0 < self.token_budget <= self.generated_tokens - self._budget_start
+            and not self._event.is_set()
+            and self.should_yield()
+        ):
+            self.cancel(PREEMPTED)
+        return self._event.is_set()
+
+
+class CancellationRegistry:
+    """In-flight requests by id, plus counters for what cancellation saved.
+
+    on_cancel(token) is called for every request cancelled through cancel()
+    (the server drops its jobs that are still queued).
+    """
+
+    def __init__(self, on_cancel: Optional[Callable[[CancelToken], None]] = None):
+        self.on_cancel = on_cancel
+        self._tokens: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+
+        # Stats
+        self.cancelled_requests = 0
+        self.preempted_requests = 0
+        self.resumed_requests = 0
+        self.tokens_saved = 0
+
+    def register(self, request_id: str, max_tokens: int) -> CancelToken:
+        with self._lock:
+            if request_id in self._tokens:
+                raise ValueError(f"Request id '{request_id}' is already in flight")
+            token = CancelToken(request_id, max_tokens)
+            self._tokens[request_id] = token
+            return token
+
+    def cancel(self, request_id: str, reason: str = "cancelled via API") -> bool:
+        """Flag request_id for cancellation; False if it is not in flight."""
+        with self._lock:
+            token = self._tokens.get(request_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        if self.on_cancel is not None:
+            self.on_cancel(token)
+        return True
+
+    def finish(self, token: CancelToken):
+        """Unregister a request once its response is complete (or abandoned)."""
+        with self._lock:
+            if self._tokens.get(token.request_id) is not token:
+                return
+            del self._tokens[token.request_id]
+            if token.preempted or token.preemptions:
+                self.preempted_requests += 1
+            if token.preemptions:
+                self.resumed_requests += 1
+            if token.cancelled and not token.preempted:
+                self.cancelled_requests += 1
+                self.tokens_saved += token.tokens_saved
+        if token.preempted:
+            logger.info(
+                f"Request {token.request_id} preempted after {token.generated_tokens} tokens "
+                f"(budget {token.token_budget})"
+            )
+        elif token.cancelled:
+            logger.info(
+                f"Request {token.request_id} cancelled ({token.reason}) after "
+                f"{token.generated_tokens} tokens, ~{token.tokens_saved} tokens saved"
+            )
+        elif token.preemptions:
+            logger.info(
+                f"Request {token.request_id} finished after resuming from "
+                f"{token.preemptions} preemption(s)"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": list(self._tokens),
+                "cancelled_requests": self.cancelled_requests,
+                "preempted_requests": self.preempted_requests,
+                "resumed_requests": self.resumed_requests,
+                "tokens_saved": self.tokens_saved,
+            }
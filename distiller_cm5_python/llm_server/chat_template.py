@@ -0,0 +1,358 @@
+"""
+Chat Template - Compiles each model's chat template once and builds prompt
+tokens incrementally: the static prefix (system message + tool schemas) is
+rendered and tokenized once per distinct content, later calls only render and
+tokenize the conversation tail.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import jinja2
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+from llama_cpp import Llama
+
+logger = logging.getLogger(__name__)
+
+# Compiled templates keyed by a hash of their source, shared across model loads
+_COMPILED_TEMPLATES: Dict[str, jinja2.Template] = {}
+_COMPILED_TEMPLATES_LOCK = threading.Lock()
+
+
+def _raise_exception(message: str):
+    raise ValueError(message)
+
+
+def content_hash(*parts: Any) -> str:
+    """Stable hash of JSON-serializable parts (messages, tools, configs)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def template_hash(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def compile_template(source: str) -> jinja2.Template:
+    """Compile a chat template with the same Jinja settings llama-cpp-python uses."""
+    key = template_hash(source)
+    with _COMPILED_TEMPLATES_LOCK:
+        template = _COMPILED_TEMPLATES.get(key)
+        if template is None:
+            environment = ImmutableSandboxedEnvironment(
+                loader=jinja2.BaseLoader(), trim_blocks=True, lstrip_blocks=True
+            )
+            template = environment.from_string(source)
+            _COMPILED_TEMPLATES[key] = template
+            logger.debug(f"Compiled chat template {key[:12]}")
+        return template
+
+
+class _StaticPrefix:
+    """Rendered and tokenized system message + tools for one content hash."""
+
+    def __init__(self, text: str, tokens: List[int], bare_text: str):
+        self.text = text
+        self.tokens = tokens
+        # Render of the same system message without tools, used to cut the tail
+        self.bare_text = bare_text
+        # None until the split render has been checked against a full render
+        self.splittable: Optional[bool] = None
+
+
+class PromptState:
+    """Rendered and tokenized prompt of a conversation, without generation prompt.
+
+    Sessions keep one so the next turn only tokenizes its new messages.
+    """
+
+    def __init__(self, text: str, tokens: List[int], template_hash: str):
+        self.text = text
+        self.tokens = tokens
+        self.template_hash = template_hash
+        # None until an extension has been checked against a full tokenization
+        self.incremental: Optional[bool] = None
+
+
+class ChatPromptBuilder:
+    """Builds prompt text and tokens for one loaded model."""
+
+    def __init__(self, model: Llama, max_prefixes: int = 8):
+        self.model = model
+        self.max_prefixes = max_prefixes
+        source = model.metadata.get("tokenizer.chat_template")
+        self.template = compile_template(source) if source else None
+        # Identifies the template in persisted state keys
+        self.template_hash = template_hash(source) if source else ""
+        self.eos_token = self._token_text(model.token_eos())
+        self.bos_token = self._token_text(model.token_bos())
+        self._prefixes: "OrderedDict[str, _StaticPrefix]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        self.full_renders = 0
+        self.extensions = 0
+        # Cumulative time spent in the template engine and the tokenizer, in
+        # total and per thread (inference slots build prompts concurrently)
+        self.render_seconds = 0.0
+        self.tokenize_seconds = 0.0
+        self._thread_seconds = threading.local()
+
+    def _token_text(self, token: int) -> str:
+        if token is None or token < 0:
+            return ""
+        return self.model.detokenize([token], special=True).decode(
+            "utf-8", errors="ignore"
+        )
+
+    @property
+    def available(self) -> bool:
+        return self.template is not None
+
+    def render(
+        self,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+        add_generation_prompt: bool = True,
+    ) -> str:
+        """Full render of the chat template."""
+        started = time.perf_counter()
+        text = self.template.render(
+            messages=messages,
+            tools=tools,
+            eos_token=self.eos_token,
+            bos_token=self.bos_token,
+            raise_exception=_raise_exception,
+            add_generation_prompt=add_generation_prompt,
+            functions=None,
+            function_call=None,
+            tool_choice=None,
+        )
+        elapsed = time.perf_counter() - started
+        self.render_seconds += elapsed
+        self._thread_seconds.render = getattr(self._thread_seconds, "render", 0.0) + elapsed
+        return text
+
+    def tokenize(self, text: str) -> List[int]:
+        started = time.perf_counter()
+        # The template emits its own special tokens (bos included), as in llama's Jinja2ChatFormatter
+        tokens = self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+        elapsed = time.perf_counter() - started
+        self.tokenize_seconds += elapsed
+        self._thread_seconds.tokenize = getattr(self._thread_seconds, "tokenize", 0.0) + elapsed
+        return tokens
+
+    def thread_seconds(self) -> Tuple[float, float]:
+        """(render, tokenize) seconds spent so far by the calling thread."""
+        return (
+            getattr(self._thread_seconds, "render", 0.0),
+            getattr(self._thread_seconds, "tokenize", 0.0),
+        )
+
+    def _get_prefix(self, system_message: Dict[str, Any], tools) -> _StaticPrefix:
+        key = content_hash(system_message, tools)
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is not None:
+                self._prefixes.move_to_end(key)
+                self.prefix_hits += 1
+                return prefix
+            self.prefix_misses += 1
+
+        text = self.render([system_message], tools, add_generation_prompt=False)
+        bare_text = (
+            self.render([system_message], None, add_generation_prompt=False)
+            if tools
+            else text
+        )
+        prefix = _StaticPrefix(text, self.tokenize(text), bare_text)
+        with self._lock:
+            self._prefixes[key] = prefix
+            while len(self._prefixes) > self.max_prefixes:
+                self._prefixes.popitem(last=False)
+        return prefix
+
+    def _full_build(self, messages, tools, add_generation_prompt) -> Tuple[str, List[int]]:
+        self.full_renders += 1
+        text = self.render(messages, tools, add_generation_prompt)
+        return text, self.tokenize(text)
+
+    def build(
+        self,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+        add_generation_prompt: bool = True,
+    ) -> Tuple[str, List[int]]:
+        """Return (prompt text, prompt tokens) for messages and tools.
+
+        The tail is rendered with the same system message but without tools
+        (cheap), cut after the bare system render and appended to the cached
+        prefix. The first use of each prefix is checked against a full render;
+        templates where the split does not reproduce it fall back to full renders.
+        """
+        if not messages or messages[0].get("role") != "system":
+            return self._full_build(messages, tools, add_generation_prompt)
+
+        prefix = self._get_prefix(messages[0], tools)
+        if prefix.splittable is False:
+            return self._full_build(messages, tools, add_generation_prompt)
+
+        bare_full = self.render(messages, None, add_generation_prompt)
+        if not bare_full.startswith(prefix.bare_text):
+            prefix.splittable = False
+            return self._full_build(messages, tools, add_generation_prompt)
+
+        tail = bare_full[len(prefix.bare_text) :]
+        text = prefix.text + tail
+        tokens = prefix.tokens + self.tokenize(tail)
+
+        if prefix.splittable is None:
+            full_text, full_tokens = self._full_build(messages, tools, add_generation_prompt)
+            prefix.splittable = full_text == text and full_tokens == tokens
+            if not prefix.splittable:
+                logger.info(
+                    "Chat template does not render the conversation tail independently of "
+                    "the system prefix; using full renders for this prefix"
+                )
+                return full_text, full_tokens
+        return text, tokens
+
+    def _render_text(self, messages, tools, add_generation_prompt) -> str:
+        """Prompt text only, from the cached prefix when the template splits."""
+        if messages and messages[0].get("role") == "system":
+            prefix = self._get_prefix(messages[0], tools)
+            if prefix.splittable:
+                bare_full = self.render(messages, None, add_generation_prompt)
+                if bare_full.startswith(prefix.bare_text):
+                    return prefix.text + bare_full[len(prefix.bare_text) :]
+        return self.render(messages, tools, add_generation_prompt)
+
+    def extend(
+        self,
+        state: Optional[PromptState],
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+    ) -> Tuple[PromptState, List[int]]:
+        """Return (state of messages, prompt tokens with generation prompt).
+
+        state holds the prompt of a prefix of messages; only the text the new
+        messages add is tokenized. The first extension of a state is checked
+        against a full tokenization; if token boundaries differ at the seam,
+        later extensions of that conversation fall back to build().
+        """
+        if (
+            state is None
+            or state.incremental is False
+            or state.template_hash != self.template_hash
+        ):
+            text, tokens = self.build(messages, tools, add_generation_prompt=False)
+            new_state = PromptState(text, tokens, self.template_hash)
+            if state is not None and state.template_hash == self.template_hash:
+                new_state.incremental = state.incremental
+        else:
+            text = self._render_text(messages, tools, add_generation_prompt=False)
+            if not text.startswith(state.text):
+                # History was rewritten, not appended to
+                text, tokens = self.build(messages, tools, add_generation_prompt=False)
+                new_state = PromptState(text, tokens, self.template_hash)
+            else:
+                tokens = state.tokens + self.tokenize(text[len(state.text) :])
+                new_state = PromptState(text, tokens, self.template_hash)
+                new_state.incremental = state.incremental
+                if state.incremental is None:
+                    full_tokens = self.tokenize(text)
+                    new_state.incremental = full_tokens == tokens
+                    if not new_state.incremental:
+                        logger.info(
+                            "Prompt tokens differ when new messages are tokenized on their "
+                            "own; using full builds for this conversation"
+                        )
+                        new_state.tokens = tokens = full_tokens
+                self.extensions += 1
+
+        prompt_text = self._render_text(messages, tools, add_generation_prompt=True)
+        if prompt_text.startswith(text):
+            prompt_tokens = tokens + self.tokenize(prompt_text[len(text) :])
+        else:
+            _, prompt_tokens = self.build(messages, tools, add_generation_prompt=True)
+        return new_state, prompt_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cached_prefixes": len(self._prefixes),
+                "prefix_tokens": [len(p.tokens) for p in self._prefixes.values()],
+                "prefix_hits": self.prefix_hits,
+                "prefix_misses": self.prefix_misses,
+                "full_renders": self.full_renders,
+                "extensions": self.extensions,
+                "render_seconds": round(self.render_seconds, 3),
+                "tokenize_seconds": round(self.tokenize_seconds, 3),
+            }
+
+
+def completion_to_chat(completion: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a llama text completion into a chat.completion response."""
+    choice = completion["choices"][0]
+    return {
+        "id": "chat" + completion["id"],
+        "object": "chat.completion",
+        "created": completion["created"],
+        "model": completion["model"],
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": choice["text"]},
+                "logprobs": None,
+                "finish_reason": choice["finish_reason"],
+            }
+        ],
+        "usage": completion["usage"],
+    }
+
+
+def completion_chunks_to_chat(
+    chunks: Iterator[Dict[str, Any]],
+) -> Iterator[Dict[str, Any]]:
+    """Convert streamed llama text completion chunks into chat.completion.chunk objects."""
+    for i, chunk in enumerate(chunks):
+        choice = chunk["choices"][0]
+        if i == 0:
+            yield {
+                "id": "chat" + chunk["id"],
+                "model": chunk["model"],
+                "created": chunk["created"],
+                "object": "chat.completion.chunk",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"role": "assistant"},
+                        "logprobs": None,
+                        "finish_reason": None,
+                    }
+                ],
+            }
+        yield {
+            "id": "chat" + chunk["id"],
+            "model": chunk["model"],
+            "created": chunk["created"],
+            "object": "chat.completion.chunk",
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": (
+                        {"content": choice["text"]}
+                        if choice["finish_reason"] is None
+                        else {}
+                    ),
+                    "logprobs": None,
+                    "finish_reason": choice["finish_reason"],
+                }
+            ],
+        }
@@ -0,0 +1,147 @@
+"""
+Context Policy - Fits a conversation into the model's context window before any
+prompt eval, instead of failing after llama has rejected the prompt.
+
+Policies (applied until the prompt leaves room for generation):
+
+- drop_oldest: drop the oldest non-system turns (a user message and the
+  assistant/tool messages answering it); the latest turn is always kept.
+- truncate_tool_results: shorten the longest tool results first, then fall back
+  to drop_oldest.
+- sliding_window: keep the system/tools prefix and the most recent tokens of
+  the conversation, cutting at a token boundary (llama.cpp's n_keep context shift).
+- error: no truncation; prompts that do not fit are rejected as before.
+"""
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("drop_oldest", "truncate_tool_results", "sliding_window", "error")
+
+# Tool results are cut no shorter than this many characters
+MIN_TOOL_RESULT_CHARS = 256
+TRUNCATION_MARKER = "\n...[truncated {} characters]"
+
+
+class ContextOverflowError(ValueError):
+    """Raised when a prompt cannot be fitted into the context window.
+
+    The message keeps llama's wording so clients that parse it keep working.
+    """
+
+    def __init__(self, prompt_tokens: int, n_ctx: int):
+        self.prompt_tokens = prompt_tokens
+        self.n_ctx = n_ctx
+        super().__init__(f"Requested tokens ({prompt_tokens}) exceed context window of {n_ctx}")
+
+
+def _turn_starts(messages: List[Dict[str, Any]]) -> List[int]:
+    """Indexes of the user messages that start each turn."""
+    return [i for i, message in enumerate(messages) if message.get("role") == "user"]
+
+
+class ContextFitter:
+    """Applies a policy for one request. build(messages) must return prompt tokens."""
+
+    def __init__(self, build, n_ctx: int, reserve_tokens: int):
+        self.build = build
+        self.n_ctx = n_ctx
+        # Prompt budget: what is left once generation has its reserve
+        self.budget = max(n_ctx - reserve_tokens, 1)
+
+    def fit(
+        self, messages: List[Dict[str, Any]], policy: str
+    ) -> Tuple[List[Dict[str, Any]], List[int], Optional[Dict[str, Any]]]:
+        """Return (messages, prompt tokens, report); report is None if nothing was cut."""
+        tokens = self.build(messages)
+        if len(tokens) <= self.budget:
+            return messages, tokens, None
+        if policy not in POLICIES or policy == "error":
+            raise ContextOverflowError(len(tokens), self.n_ctx)
+
+        report = {
+            "policy": policy,
+            "n_ctx": self.n_ctx,
+            "prompt_budget": self.budget,
+            "original_prompt_tokens": len(tokens),
+            "dropped_messages": 0,
+            "truncated_tool_results": 0,
+            "dropped_tokens": 0,
+        }
+        if policy == "sliding_window":
+            tokens = self._slide(messages, tokens, report)
+        else:
+            if policy == "truncate_tool_results":
+                messages, tokens = self._truncate_tool_results(messages, tokens, report)
+            if len(tokens) > self.budget:
+                messages, tokens = self._drop_oldest(messages, tokens, report)
+        if len(tokens) > self.budget:
+            raise ContextOverflowError(len(tokens), self.n_ctx)
+
+        report["prompt_tokens"] = len(tokens)
+        logger.info(f"Fitted prompt into context window: {report}")
+        return messages, tokens, report
+
+    def _drop_oldest(self, messages, tokens, report):
+        starts = _turn_starts(messages)
+        if len(starts) < 2:
+            return messages, tokens
+        head = messages[: starts[0]]
+
+        def without_turns(n):
+            return head + messages[starts[n] :]
+
+        # Fewest dropped turns that fit; the last turn is never dropped
+        lo, hi = 1, len(starts) - 1
+        best = None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            candidate = self.build(without_turns(mid))
+            if len(candidate) <= self.budget:
+                best, hi = (mid, candidate), mid - 1
+            else:
+                lo = mid + 1
+        if best is None:
+            best = (len(starts) - 1, self.build(without_turns(len(starts) - 1)))
+        n, fitted = best
+        report["dropped_messages"] += starts[n] - starts[0]
+        return without_turns(n), fitted
+
+    def _truncate_tool_results(self, messages, tokens, report):
+        messages = [dict(m) for m in messages]
+        results = sorted(
+            (i for i, m in enumerate(messages) if m.get("role") == "tool"),
+            key=lambda i: len(messages[i].get("content") or ""),
+            reverse=True,
+        )
+        for i in results:
+            content = messages[i].get("content") or ""
+            if len(tokens) <= self.budget:
+                break
+            if len(content) <= MIN_TOOL_RESULT_CHARS:
+                continue
+            # Size the cut from the prompt's average characters per token, and
+            # cut the marker's length on top so the marker fits too
+            chars = sum(len(m.get("content") or "") for m in messages)
+            marker_chars = len(TRUNCATION_MARKER.format(len(content)))
+            excess = int((len(tokens) - self.budget) * max(chars / len(tokens), 1.0)) + 1
+            keep = max(len(content) - excess - marker_chars, MIN_TOOL_RESULT_CHARS)
+            messages[i]["content"] = content[:keep] + TRUNCATION_MARKER.format(len(content) - keep)
+            report["truncated_tool_results"] += 1
+            tokens = self.build(messages)
+        return messages, tokens
+
+    def _slide(self, messages, tokens, report):
+        prefix_length = 0
+        if messages and messages[0].get("role") == "system":
+            # Tokens shared with a render of the system message (and tools) alone
+            for a, b in zip(self.build(messages[:1]), tokens):
+                if a != b:
+                    break
+                prefix_length += 1
+        keep_tail = self.budget - prefix_length
+        if keep_tail <= 0:
+            return tokens
+        report["dropped_tokens"] = len(tokens) - prefix_length - keep_tail
+        return tokens[:prefix_length] + tokens[len(tokens) - keep_tail :]
@@ -0,0 +1,334 @@
+"""
+Fake Llama - A deterministic, hardware-free stand-in for llama_cpp.Llama.
+
+It has a byte-level tokenizer, a ChatML chat template and a scripted reply, and
+it sleeps for configurable prompt-eval and per-token latencies. It keeps the
+prefix reuse, stopping-criteria and cache behaviour of Llama.create_completion,
+so the HTTP, SSE, queueing and caching layers of the server can be load-tested
+without a GGUF model. Grammars are accepted and ignored.
+"""
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+from llama_cpp import LlamaState
+
+logger = logging.getLogger(__name__)
+
+CHATML_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if loop.first and message['role'] == 'system' %}"
+    "<|im_start|>system\n{{ message['content'] }}"
+    "{% if tools %}\n\n# Tools\n\n<tools>\n"
+    "{% for tool in tools %}{{ tool | tojson }}\n{% endfor %}</tools>{% endif %}"
+    "<|im_end|>\n"
+    "{% else %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endif %}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+DEFAULT_REPLY = "This is a deterministic reply from the fake model backend."
+
+# Control tokens are only rendered with special=True; user-defined ones always are
+_CONTROL_TOKENS = {1: b"<|endoftext|>", 2: b"<|im_start|>", 3: b"<|im_end|>"}
+_USER_TOKENS = {4: b"<tool_call>", 5: b"</tool_call>"}
+_SPECIAL_IDS = {text: token for token, text in {**_CONTROL_TOKENS, **_USER_TOKENS}.items()}
+_BYTE_OFFSET = 8
+N_VOCAB = _BYTE_OFFSET + 256
+
+
+def _longest_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class FakeLlama:
+    """Deterministic Llama replacement; see the module docstring."""
+
+    def __init__(
+        self,
+        model_path: str,
+        n_ctx: int = 4096,
+        n_batch: int = 512,
+        prompt_eval_s_per_token: float = 0.0005,
+        token_s: float = 0.02,
+        reply: str = DEFAULT_REPLY,
+        state_bytes_per_token: int = 4096,
+        seed: int = 0,
+        **kwargs,
+    ):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.prompt_eval_s_per_token = prompt_eval_s_per_token
+        self.token_s = token_s
+        self.reply_tokens = self.tokenize(reply.encode("utf-8"), add_bos=False, special=True)
+        # Size of the simulated KV state, so cache byte budgets behave realistically
+        self.state_bytes_per_token = state_bytes_per_token
+        self.metadata = {
+            "general.architecture": "fake",
+            "general.name": os.path.basename(model_path),
+            "tokenizer.chat_template": CHATML_TEMPLATE,
+        }
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.scores = np.zeros((1, N_VOCAB), dtype=np.single)
+        self.n_tokens = 0
+        self.cache = None
+        self._seed = seed
+        self.draft_model = None
+
+        # Stats
+        self.evaluated_tokens = 0
+
+        logger.info(
+            f"Fake model {self.metadata['general.name']} ready: n_ctx={n_ctx}, "
+            f"prompt eval {prompt_eval_s_per_token * 1000:.2f} ms/token, "
+            f"decode {token_s * 1000:.1f} ms/token"
+        )
+
+    @property
+    def _input_ids(self) -> np.ndarray:
+        return self.input_ids[: self.n_tokens]
+
+    @property
+    def _scores(self) -> np.ndarray:
+        return self.scores
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def n_vocab(self) -> int:
+        return N_VOCAB
+
+    def token_bos(self) -> int:
+        return 1
+
+    def token_eos(self) -> int:
+        return 3
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [self.token_bos()] if add_bos else []
+        i = 0
+        while i < len(text):
+            if special and text[i : i + 1] == b"<":
+                match = next((s for s in _SPECIAL_IDS if text.startswith(s, i)), None)
+                if match is not None:
+                    tokens.append(_SPECIAL_IDS[match])
+                    i += len(match)
+                    continue
+            tokens.append(text[i] + _BYTE_OFFSET)
+            i += 1
+        return tokens
+
+    def detokenize(
+        self, tokens: List[int], prev_tokens: Optional[List[int]] = None, special: bool = False
+    ) -> bytes:
+        out = bytearray()
+        for token in tokens:
+            if token >= _BYTE_OFFSET:
+                out.append(token - _BYTE_OFFSET)
+            elif token in _USER_TOKENS:
+                out += _USER_TOKENS[token]
+            elif special and token in _CONTROL_TOKENS:
+                out += _CONTROL_TOKENS[token]
+        return bytes(out)
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def set_seed(self, seed: int):
+        self._seed = seed
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens: Sequence[int]):
+        if len(tokens) > self._n_ctx - self.n_tokens:
+            raise RuntimeError("Fake llama KV cache is full")
+        # A single token is a decode step; anything longer is prompt eval
+        time.sleep(self.token_s if len(tokens) == 1 else self.prompt_eval_s_per_token * len(tokens))
+        self.input_ids[self.n_tokens : self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+        self.evaluated_tokens += len(tokens)
+
+    def save_state(self) -> LlamaState:
+        size = self.n_tokens * self.state_bytes_per_token
+        return LlamaState(
+            input_ids=self.input_ids.copy(),
+            scores=self.scores.copy(),
+            n_tokens=self.n_tokens,
+            llama_state=bytes(size),
+            llama_state_size=size,
+            seed=self._seed,
+        )
+
+    def load_state(self, state: LlamaState):
+        self.input_ids = state.input_ids.copy()
+        self.n_tokens = state.n_tokens
+        self._seed = state.seed
+
+    def close(self):
+        self.cache = None
+
+    def generate(
+        self,
+        tokens: Sequence[int],
+        reset: bool = True,
+        stopping_criteria=None,
+        **kwargs,
+    ) -> Iterator[int]:
+        """Same KV reuse and stopping-criteria timing as Llama.generate."""
+        if reset and self.n_tokens > 0:
+            longest_prefix = _longest_prefix(self._input_ids.tolist(), tokens[:-1])
+            if longest_prefix > 0:
+                reset = False
+                tokens = tokens[longest_prefix:]
+                self.n_tokens = longest_prefix
+        if reset:
+            self.reset()
+
+        sample_idx = self.n_tokens + len(tokens) - 1
+        tokens = list(tokens)
+        generated = 0
+        while True:
+            self.eval(tokens)
+            while sample_idx < self.n_tokens:
+                token = (
+                    self.reply_tokens[generated]
+                    if generated < len(self.reply_tokens)
+                    else self.token_eos()
+                )
+                generated += 1
+                sample_idx += 1
+                if stopping_criteria is not None and stopping_criteria(
+                    self._input_ids[:sample_idx], self._scores[-1, :]
+                ):
+                    return
+                yield token
+                tokens = [token]
+
+    def create_completion(
+        self,
+        prompt: Union[str, List[int]],
+        max_tokens: Optional[int] = 16,
+        stop: Optional[Union[str, List[str]]] = None,
+        stream: bool = False,
+        stopping_criteria=None,
+        model: Optional[str] = None,
+        **kwargs,
+    ):
+        if isinstance(prompt, str):
+            prompt_tokens = self.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+        else:
+            prompt_tokens = list(prompt)
+        if len(prompt_tokens) >= self._n_ctx:
+            raise ValueError(
+                f"Requested tokens ({len(prompt_tokens)}) exceed context window of {self._n_ctx}"
+            )
+        if max_tokens is None or max_tokens <= 0 or max_tokens + len(prompt_tokens) > self._n_ctx:
+            max_tokens = self._n_ctx - len(prompt_tokens)
+        stop_sequences = [stop] if isinstance(stop, str) else list(stop or [])
+
+        if self.cache:
+            try:
+                cache_item = self.cache[prompt_tokens]
+                cache_prefix_len = _longest_prefix(cache_item.input_ids.tolist(), prompt_tokens)
+                eval_prefix_len = _longest_prefix(self._input_ids.tolist(), prompt_tokens)
+                if cache_prefix_len > eval_prefix_len:
+                    self.load_state(cache_item)
+            except KeyError:
+                pass
+
+        chunks = self._completion_chunks(
+            prompt_tokens,
+            max_tokens,
+            stop_sequences,
+            stopping_criteria,
+            model or self.model_path,
+        )
+        if stream:
+            return chunks
+        text, finish_reason, usage, head = "", None, None, None
+        for chunk in chunks:
+            head = head or chunk
+            text += chunk["choices"][0]["text"]
+            finish_reason = chunk["choices"][0]["finish_reason"] or finish_reason
+            usage = chunk.get("usage", usage)
+        return {
+            "id": head["id"],
+            "object": "text_completion",
+            "created": head["created"],
+            "model": head["model"],
+            "choices": [
+                {"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}
+            ],
+            "usage": usage,
+        }
+
+    def _completion_chunks(
+        self, prompt_tokens, max_tokens, stop_sequences, stopping_criteria, model_name
+    ) -> Iterator[Dict[str, Any]]:
+        completion_id = f"cmpl-{uuid.uuid4()}"
+        created = int(time.time())
+
+        def chunk(text: str, finish_reason: Optional[str] = None) -> Dict[str, Any]:
+            return {
+                "id": completion_id,
+                "object": "text_completion",
+                "created": created,
+                "model": model_name,
+                "choices": [
+                    {"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}
+                ],
+            }
+
+        completion_tokens: List[int] = []
+        returned = 0
+        finish_reason = "length"
+        for token in self.generate(prompt_tokens, stopping_criteria=stopping_criteria):
+            if token == self.token_eos():
+                finish_reason = "stop"
+                break
+            completion_tokens.append(token)
+            text = self.detokenize(completion_tokens).decode("utf-8", errors="ignore")
+            stops = [s for s in stop_sequences if s in text]
+            if stops:
+                text = text[: min(text.index(s) for s in stops)]
+                finish_reason = "stop"
+                break
+            # Hold back text that may be the start of a stop sequence
+            held = max(
+                (n for s in stop_sequences for n in range(1, len(s)) if text.endswith(s[:n])),
+                default=0,
+            )
+            if len(text) - held > returned:
+                yield chunk(text[returned : len(text) - held])
+                returned = len(text) - held
+            if len(completion_tokens) >= max_tokens:
+                break
+        else:
+            text = self.detokenize(completion_tokens).decode("utf-8", errors="ignore")
+        if stopping_criteria is not None and stopping_criteria(self._input_ids, self._scores[-1, :]):
+            finish_reason = "stop"
+        if len(text) > returned:
+            yield chunk(text[returned:])
+
+        if self.cache:
+            self.cache[prompt_tokens + completion_tokens] = self.save_state()
+        final = chunk("", finish_reason)
+        final["usage"] = {
+            "prompt_tokens": len(prompt_tokens),
+            "completion_tokens": len(completion_tokens),
+            "total_tokens": len(prompt_tokens) + len(completion_tokens),
+        }
+        yield final
+
+    def __call__(self, prompt, **kwargs):
+        return self.create_completion(prompt, **kwargs)
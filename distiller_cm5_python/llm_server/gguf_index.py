@@ -0,0 +1,364 @@
+"""
+GGUF Index - Reads model facts straight from GGUF headers (memory-mapped, no
+weights touched) and caches them by path and mtime, so /models can describe
+every model file and estimate its RAM cost without loading it.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GGUF_MAGIC = b"GGUF"
+INDEX_FILENAME = "gguf_index.json"
+
+# Bytes per element of the default f16 KV cache
+KV_ELEMENT_BYTES = 2
+
+# KV cache types llama.cpp accepts for type_k/type_v: ggml_type id and bytes
+# per element (quantized types store blocks of 32 values plus a scale)
+KV_CACHE_TYPES = {
+    "f32": (0, 4.0),
+    "f16": (1, 2.0),
+    "bf16": (30, 2.0),
+    "q8_0": (8, 34 / 32),
+    "q5_1": (7, 24 / 32),
+    "q5_0": (6, 22 / 32),
+    "q4_1": (3, 20 / 32),
+    "q4_0": (2, 18 / 32),
+    "iq4_nl": (20, 18 / 32),
+}
+
+# GGUF metadata value types: struct format of the fixed-size ones
+_SCALAR_FORMATS = {
+    0: "<B",  # uint8
+    1: "<b",  # int8
+    2: "<H",  # uint16
+    3: "<h",  # int16
+    4: "<I",  # uint32
+    5: "<i",  # int32
+    6: "<f",  # float32
+    7: "<?",  # bool
+    10: "<Q",  # uint64
+    11: "<q",  # int64
+    12: "<d",  # float64
+}
+_TYPE_STRING = 8
+_TYPE_ARRAY = 9
+
+# llama_ftype values of general.file_type
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S",
+    22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M",
+    28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16", 36: "TQ1_0", 37: "TQ2_0",
+}
+
+# ggml_type values of tensor infos, for files without general.file_type
+TENSOR_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 6: "Q5_0", 7: "Q5_1", 8: "Q8_0", 9: "Q8_1",
+    10: "Q2_K", 11: "Q3_K", 12: "Q4_K", 13: "Q5_K", 14: "Q6_K", 15: "Q8_K", 16: "IQ2_XXS",
+    17: "IQ2_XS", 18: "IQ3_XXS", 19: "IQ1_S", 20: "IQ4_NL", 21: "IQ3_S", 22: "IQ2_S",
+    23: "IQ4_XS", 24: "I8", 25: "I16", 26: "I32", 27: "I64", 28: "F64", 29: "IQ1_M",
+    30: "BF16", 34: "TQ1_0", 35: "TQ2_0",
+}
+
+
+class GgufFormatError(ValueError):
+    """The file is not a GGUF file this parser understands."""
+
+
+class _Reader:
+    def __init__(self, buffer, version: int = 3):
+        self.buffer = buffer
+        self.offset = 0
+        # GGUF v1 used 32-bit lengths and counts
+        self.count_format = "<I" if version == 1 else "<Q"
+
+    def unpack(self, fmt: str):
+        try:
+            value = struct.unpack_from(fmt, self.buffer, self.offset)[0]
+        except struct.error:
+            raise GgufFormatError("Truncated GGUF header")
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def count(self) -> int:
+        return self.unpack(self.count_format)
+
+    def string(self) -> str:
+        length = self.count()
+        end = self.offset + length
+        if end > len(self.buffer):
+            raise GgufFormatError("Truncated GGUF header")
+        value = bytes(self.buffer[self.offset : end]).decode("utf-8", errors="replace")
+        self.offset = end
+        return value
+
+    def skip_string(self):
+        length = self.count()
+        self.offset += length
+
+    def value(self, value_type: int) -> Any:
+        if value_type in _SCALAR_FORMATS:
+            return self.unpack(_SCALAR_FORMATS[value_type])
+        if value_type == _TYPE_STRING:
+            return self.string()
+        if value_type == _TYPE_ARRAY:
+            item_type = self.unpack("<I")
+            length = self.count()
+            # Arrays (vocabularies, merges) are skipped; only their length is kept
+            if item_type in _SCALAR_FORMATS:
+                self.offset += length * struct.calcsize(_SCALAR_FORMATS[item_type])
+            else:
+                for _ in range(length):
+                    if item_type == _TYPE_STRING:
+                        self.skip_string()
+                    else:
+                        self.value(item_type)
+            return {"array_length": length}
+        raise GgufFormatError(f"Unknown GGUF value type {value_type}")
+
+
+def read_gguf_header(path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Return (metadata, tensor summary) parsed from the header of a GGUF file.
+
+    Array values are replaced by {"array_length": n}. The summary holds the
+    tensor count, the parameter count and the parameter count per tensor type.
+    """
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise GgufFormatError("Empty file")
+    try:
+        if buffer[:4] != GGUF_MAGIC:
+            raise GgufFormatError("Not a GGUF file")
+        if len(buffer) < 8:
+            raise GgufFormatError("Truncated GGUF header")
+        version = struct.unpack_from("<I", buffer, 4)[0]
+        if version not in (1, 2, 3):
+            raise GgufFormatError(f"Unsupported GGUF version {version}")
+        reader = _Reader(buffer, version)
+        reader.offset = 8
+        tensor_count = reader.count()
+        kv_count = reader.count()
+
+        metadata: Dict[str, Any] = {}
+        for _ in range(kv_count):
+            key = reader.string()
+            metadata[key] = reader.value(reader.unpack("<I"))
+
+        parameters = 0
+        parameters_by_type: Dict[str, int] = {}
+        for _ in range(tensor_count):
+            reader.skip_string()
+            n_dims = reader.unpack("<I")
+            if n_dims > 8:
+                raise GgufFormatError(f"Tensor with {n_dims} dimensions")
+            elements = 1
+            for _ in range(n_dims):
+                elements *= reader.count()
+            tensor_type = reader.unpack("<I")
+            reader.unpack("<Q")  # data offset
+            parameters += elements
+            type_name = TENSOR_TYPES.get(tensor_type, str(tensor_type))
+            parameters_by_type[type_name] = parameters_by_type.get(type_name, 0) + elements
+    finally:
+        buffer.close()
+
+    summary = {
+        "version": version,
+        "tensor_count": tensor_count,
+        "parameter_count": parameters,
+        "parameters_by_type": parameters_by_type,
+    }
+    return metadata, summary
+
+
+def _metadata_int(metadata: Dict[str, Any], key: str) -> Optional[int]:
+    try:
+        return int(metadata[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def kv_cache_type(value: Any) -> str:
+    """Name of a KV cache type given as a name ("q8_0") or a ggml_type id."""
+    if isinstance(value, str) and value.lower() in KV_CACHE_TYPES:
+        return value.lower()
+    for name, (type_id, _) in KV_CACHE_TYPES.items():
+        if value == type_id:
+            return name
+    raise ValueError(
+        f"Unsupported KV cache type {value!r}, expected one of {', '.join(KV_CACHE_TYPES)}"
+    )
+
+
+def kv_cache_bytes_per_token(f16_bytes: int, type_k: str = "f16", type_v: str = "f16") -> int:
+    """KV bytes per token with the given cache types, from the f16 figure.
+
+    Exact when keys and values have the same head size, as in common models.
+    """
+    scale = (KV_CACHE_TYPES[type_k][1] + KV_CACHE_TYPES[type_v][1]) / (2 * KV_ELEMENT_BYTES)
+    return int(f16_bytes * scale + 0.5)
+
+
+def kv_bytes_per_token(
+    metadata: Dict[str, Any], type_k: str = "f16", type_v: str = "f16"
+) -> int:
+    """KV cache bytes per context token, from GGUF metadata (0 if unknown).
+
+    Works with parsed headers and with Llama.metadata, whose values are strings.
+    """
+    arch = metadata.get("general.architecture", "")
+    n_layer = _metadata_int(metadata, f"{arch}.block_count")
+    n_embd = _metadata_int(metadata, f"{arch}.embedding_length")
+    n_head = _metadata_int(metadata, f"{arch}.attention.head_count")
+    if not n_layer or not n_embd or not n_head:
+        return 0
+    n_head_kv = _metadata_int(metadata, f"{arch}.attention.head_count_kv") or n_head
+    head_dim_k = _metadata_int(metadata, f"{arch}.attention.key_length") or n_embd // n_head
+    head_dim_v = _metadata_int(metadata, f"{arch}.attention.value_length") or n_embd // n_head
+    bytes_k, bytes_v = KV_CACHE_TYPES[type_k][1], KV_CACHE_TYPES[type_v][1]
+    return int(n_layer * n_head_kv * (head_dim_k * bytes_k + head_dim_v * bytes_v) + 0.5)
+
+
+def describe(path: str) -> Dict[str, Any]:
+    """The facts /models reports for one GGUF file."""
+    metadata, summary = read_gguf_header(path)
+    arch = metadata.get("general.architecture", "")
+    file_type = _metadata_int(metadata, "general.file_type")
+    if file_type is not None:
+        quantization = FILE_TYPES.get(file_type, str(file_type))
+    else:
+        # Most parameters are stored in the dominant quantization type
+        by_type = summary["parameters_by_type"]
+        quantization = max(by_type, key=by_type.get) if by_type else None
+    return {
+        "architecture": arch or None,
+        "name": metadata.get("general.name"),
+        "size_label": metadata.get("general.size_label"),
+        "parameter_count": summary["parameter_count"],
+        "quantization": quantization,
+        "context_length": _metadata_int(metadata, f"{arch}.context_length"),
+        "has_chat_template": isinstance(metadata.get("tokenizer.chat_template"), str),
+        "vocab_size": (metadata.get("tokenizer.ggml.tokens") or {}).get("array_length"),
+        "kv_bytes_per_token": kv_bytes_per_token(metadata),
+        "gguf_version": summary["version"],
+        "tensor_count": summary["tensor_count"],
+    }
+
+
+def estimate_ram_bytes(
+    info: Dict[str, Any], n_ctx: int, type_k: str = "f16", type_v: str = "f16"
+) -> int:
+    """Weights (mapped in full once warm) plus the KV cache at n_ctx."""
+    kv_bytes = kv_cache_bytes_per_token(info.get("kv_bytes_per_token", 0), type_k, type_v)
+    return info.get("file_bytes", 0) + kv_bytes * n_ctx
+
+
+class GgufIndex:
+    """describe() results per model file, keyed by real path, mtime and size.
+
+    Entries are persisted to a JSON file, so after a restart unchanged files are
+    not parsed again. Files that cannot be parsed are cached with their error.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.index_path = os.path.join(cache_dir, INDEX_FILENAME) if cache_dir else None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        # Stats
+        self.hits = 0
+        self.parses = 0
+        self.failures = 0
+
+        self._load()
+
+    def _load(self):
+        if not self.index_path:
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable GGUF index {self.index_path}: {e}")
+
+    def _save(self):
+        if not self.index_path or not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+        except OSError as e:
+            logger.warning(f"Could not write GGUF index {self.index_path}: {e}")
+
+    def get(self, path: str) -> Dict[str, Any]:
+        """Info for one file; parses the header only if the file changed."""
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        with self._lock:
+            entry = self._entries.get(real_path)
+            if (
+                entry is not None
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["info"].get("file_bytes") == stat.st_size
+            ):
+                self.hits += 1
+                return entry["info"]
+
+        try:
+            info = describe(real_path)
+            self.parses += 1
+        except (OSError, GgufFormatError) as e:
+            logger.warning(f"Could not read GGUF header of {path}: {e}")
+            self.failures += 1
+            info = {"error": str(e)}
+        info["file_bytes"] = stat.st_size
+
+        with self._lock:
+            self._entries[real_path] = {"mtime_ns": stat.st_mtime_ns, "info": info}
+            self._dirty = True
+        return info
+
+    def describe_dir(self, models_dir: str, names) -> Dict[str, Dict[str, Any]]:
+        """Info for each model file name in models_dir; the index is saved once."""
+        infos = {}
+        for name in names:
+            try:
+                infos[name] = self.get(os.path.join(models_dir, name))
+            except OSError as e:
+                # Removed between listing and stat
+                infos[name] = {"error": str(e)}
+        with self._lock:
+            # Forget files that are gone
+            present = {os.path.realpath(os.path.join(models_dir, name)) for name in names}
+            for path in [p for p in self._entries if p not in present]:
+                if os.path.dirname(path) == os.path.realpath(models_dir):
+                    del self._entries[path]
+                    self._dirty = True
+            self._save()
+        return infos
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "parses": self.parses,
+                "failures": self.failures,
+            }
@@ -0,0 +1,77 @@
+"""
+KV Fork - Shares one evaluated prompt prefix between several completions. The
+prefix common to every branch's prompt is evaluated once and its llama state
+saved; each branch loads that state (on whichever inference slot it runs on)
+and evaluates only its own suffix before generating.
+"""
+import logging
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama import LlamaState
+
+from distiller_cm5_python.llm_server.prefix_cache import (
+    PrefixStateCache,
+    common_prefix_length,
+    compact_state,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def shared_prefix_length(prompts: Sequence[Sequence[int]]) -> int:
+    """Tokens every prompt starts with, leaving each at least one token to
+    evaluate, since sampling needs the logits of a prompt's last token."""
+    if not prompts:
+        return 0
+    first = np.asarray(prompts[0], dtype=np.intc)
+    shared = len(first)
+    for prompt in prompts[1:]:
+        shared = min(shared, common_prefix_length(first, np.asarray(prompt, dtype=np.intc)))
+    return max(min(shared, min(len(p) for p in prompts) - 1), 0)
+
+
+def _kv_prefix_length(model: Llama, tokens: Sequence[int]) -> int:
+    """Leading tokens of tokens that the model's KV cache already holds."""
+    return common_prefix_length(
+        model.input_ids[: model.n_tokens], np.asarray(tokens, dtype=np.intc)
+    )
+
+
+def evaluate_prefix(model: Llama, tokens: List[int]) -> Tuple[LlamaState, int]:
+    """Evaluate tokens on model and return its state and how many tokens were reused.
+
+    What the KV cache (or, if longer, the model's prefix cache) already holds
+    of tokens is kept; only the rest is evaluated. The state is also offered
+    to the prefix cache, so later requests with this prefix skip it too.
+    """
+    reused = _kv_prefix_length(model, tokens)
+    if isinstance(model.cache, PrefixStateCache):
+        cached, state = model.cache.lookup(tokens)
+        if state is not None and cached > reused:
+            model.load_state(state)
+            reused = cached
+    if reused < len(tokens):
+        if reused == 0:
+            model.reset()
+        else:
+            # Drop what follows the shared part; eval() clears those KV cells
+            model.n_tokens = reused
+        model.eval(tokens[reused:])
+    else:
+        model.n_tokens = len(tokens)
+    state = compact_state(model.save_state())
+    if isinstance(model.cache, PrefixStateCache):
+        model.cache[tokens] = state
+    return state, reused
+
+
+def fork(model: Llama, state: LlamaState, prompt_tokens: Sequence[int]) -> bool:
+    """Put the forked prefix state into model's KV cache for prompt_tokens, unless
+    it already holds at least that much of the prompt (the slot that evaluated
+    the prefix). Returns whether the state was loaded."""
+    if _kv_prefix_length(model, prompt_tokens) >= state.n_tokens:
+        return False
+    model.load_state(state)
+    return True
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Load Generator - Replays recorded /chat/completions bodies against a running
+server at a fixed concurrency and reports TTFT and total latency percentiles.
+
+Bodies come from a JSONL file such as the one written by server.py
+--record_requests; without one a single synthetic request is repeated. Paired
+with --backend fake this measures the server itself (queueing, prompt building,
+SSE) without model hardware.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from distiller_cm5_python.utils.logger import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BODY = {
+    "model": "fake.gguf",
+    "messages": [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "Say something short."},
+    ],
+    # The same keys LLMClient sends
+    "inference_configs": {
+        "temperature": 0.7,
+        "top_p": 0.8,
+        "top_k": 20,
+        "min_p": 0.0,
+        "repetition_penalty": 1.0,
+        "max_tokens": 64,
+        "stop": ["<|im_end|>"],
+    },
+}
+
+
+def load_bodies(path: Optional[str]) -> List[Dict[str, Any]]:
+    if not path:
+        return [DEFAULT_BODY]
+    bodies = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                bodies.append(json.loads(line))
+    if not bodies:
+        raise ValueError(f"No request bodies in {path}")
+    return bodies
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of values (0 < q <= 100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(-(-q * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+
+class RequestResult:
+    def __init__(self):
+        self.ok = False
+        self.status: Optional[int] = None
+        self.ttft_s: Optional[float] = None
+        self.total_s: Optional[float] = None
+        self.completion_tokens = 0
+        self.error: Optional[str] = None
+
+
+async def _send(
+    session: aiohttp.ClientSession, url: str, body: Dict[str, Any], stream: Optional[bool]
+) -> RequestResult:
+    result = RequestResult()
+    if stream is not None:
+        body = {**body, "stream": stream}
+    started = time.monotonic()
+    try:
+        async with session.post(url, json=body) as response:
+            result.status = response.status
+            if response.status != 200:
+                result.error = (await response.text())[:200]
+                return result
+            if body.get("stream"):
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:") :].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
+                    if delta.get("content") or delta.get("tool_calls"):
+                        if result.ttft_s is None:
+                            result.ttft_s = time.monotonic() - started
+                        result.completion_tokens += 1
+                    if chunk.get("usage"):
+                        result.completion_tokens = chunk["usage"].get(
+                            "completion_tokens", result.completion_tokens
+                        )
+            else:
+                completion = await response.json()
+                # A non-streamed response arrives all at once
+                result.ttft_s = time.monotonic() - started
+                result.completion_tokens = (completion.get("usage") or {}).get(
+                    "completion_tokens", 0
+                )
+        result.total_s = time.monotonic() - started
+        result.ok = True
+    except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+        result.error = str(e) or type(e).__name__
+    return result
+
+
+async def run(
+    url: str,
+    bodies: List[Dict[str, Any]],
+    concurrency: int,
+    requests: int,
+    stream: Optional[bool] = None,
+    timeout_s: float = 600.0,
+) -> Dict[str, Any]:
+    """Send requests bodies (cycling through them) with concurrency in flight."""
+    results: List[RequestResult] = []
+    next_index = 0
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal next_index
+        while next_index < requests:
+            body = bodies[next_index % len(bodies)]
+            next_index += 1
+            result = await _send(session, url, body, stream)
+            if not result.ok:
+                logger.warning(f"Request failed ({result.status}): {result.error}")
+            results.append(result)
+
+    started = time.monotonic()
+    timeout = aiohttp.ClientTimeout(total=timeout_s)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return summarize(results, time.monotonic() - started, concurrency)
+
+
+def summarize(results: List[RequestResult], wall_s: float, concurrency: int) -> Dict[str, Any]:
+    ok = [r for r in results if r.ok]
+    ttft = [r.ttft_s for r in ok if r.ttft_s is not None]
+    total = [r.total_s for r in ok]
+    tokens = sum(r.completion_tokens for r in ok)
+
+    def latency(values: List[float]) -> Dict[str, Optional[float]]:
+        return {
+            name: round(value, 4) if value is not None else None
+            for name, value in (
+                ("p50", percentile(values, 50)),
+                ("p95", percentile(values, 95)),
+                ("p99", percentile(values, 99)),
+                ("max", max(values) if values else None),
+            )
+        }
+
+    statuses: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            key = str(r.status) if r.status is not None else "error"
+            statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": statuses,
+        "wall_s": round(wall_s, 3),
+        "requests_per_s": round(len(ok) / wall_s, 3) if wall_s > 0 else 0.0,
+        "completion_tokens_per_s": round(tokens / wall_s, 3) if wall_s > 0 else 0.0,
+        "ttft_s": latency(ttft),
+        "total_s": latency(total),
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    def row(name: str, values: Dict[str, Optional[float]]) -> str:
+        cells = "  ".join(
+            f"{key}={value * 1000:8.1f}ms" if value is not None else f"{key}=       -"
+            for key, value in values.items()
+        )
+        return f"{name:<6} {cells}"
+
+    return "\n".join(
+        [
+            f"requests: {report['succeeded']}/{report['requests']} ok at concurrency "
+            f"{report['concurrency']} in {report['wall_s']}s "
+            f"({report['requests_per_s']} req/s, {report['completion_tokens_per_s']} tok/s)",
+            f"failed: {report['failed']}" if report["failed"] else "failed: none",
+            row("ttft", report["ttft_s"]),
+            row("total", report["total_s"]),
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM Server load generator")
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="http://127.0.0.1:8000/chat/completions",
+        help="Chat completions endpoint to load",
+    )
+    parser.add_argument(
+        "--bodies",
+        type=str,
+        default=None,
+        help="JSONL file of request bodies (e.g. from server.py --record_requests)",
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight")
+    parser.add_argument("--requests", type=int, default=32, help="Total requests to send")
+    parser.add_argument(
+        "--stream",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Force streaming on or off (default: as recorded)",
+    )
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per-request timeout in s")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        default="warning",
+        choices=["debug", "info", "warning", "error", "critical"],
+        help="Log level",
+    )
+    args = parser.parse_args()
+    setup_logging(log_level=getattr(logging, args.log_level.upper(), logging.WARNING))
+
+    try:
+        bodies = load_bodies(args.bodies)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+    report = asyncio.run(
+        run(args.url, bodies, args.concurrency, args.requests, args.stream, args.timeout)
+    )
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Memory Budget - Sizes n_ctx to the RAM that is actually free: the largest
+context whose KV cache, for every inference slot, fits next to the model's
+weights in MemAvailable after a reserve for the OS, the client and llama.cpp's
+compute buffers.
+"""
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Fitted contexts are rounded down to a multiple of this
+N_CTX_ALIGN = 256
+# Never fit below this; a smaller context is not useful for chat with tools
+MIN_N_CTX = 512
+
+
+def available_ram_bytes() -> int:
+    """MemAvailable from /proc/meminfo (free plus reclaimable page cache); 0 if unknown."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) << 10
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def fit_n_ctx(
+    requested_n_ctx: int,
+    weights_bytes: int,
+    kv_bytes_per_token: int,
+    available_bytes: int,
+    reserve_bytes: int,
+    n_contexts: int = 1,
+    trained_n_ctx: Optional[int] = None,
+) -> Tuple[int, Dict[str, Any]]:
+    """The largest safe n_ctx up to the requested one, and how it was decided.
+
+    The weights are mmap'd and count against available_bytes whether or not
+    they are already in the page cache, since they must stay resident to run.
+    Each of n_contexts (inference slots) has its own KV cache. The model's
+    trained context length caps the result too. Without a KV estimate or a
+    free RAM figure the requested n_ctx is kept.
+    """
+    n_ctx, limited_by = requested_n_ctx, "requested"
+    if trained_n_ctx and trained_n_ctx < n_ctx:
+        n_ctx, limited_by = trained_n_ctx, "trained_context_length"
+    report: Dict[str, Any] = {
+        "requested_n_ctx": requested_n_ctx,
+        "available_bytes": available_bytes,
+        "reserve_bytes": reserve_bytes,
+        "weights_bytes": weights_bytes,
+        "kv_bytes_per_token": kv_bytes_per_token,
+        "contexts": n_contexts,
+    }
+    if kv_bytes_per_token <= 0 or available_bytes <= 0:
+        limited_by = "unknown_memory"
+    else:
+        budget = available_bytes - reserve_bytes - weights_bytes
+        largest = max(budget, 0) // (kv_bytes_per_token * max(n_contexts, 1))
+        largest = largest // N_CTX_ALIGN * N_CTX_ALIGN
+        report["largest_safe_n_ctx"] = largest
+        if largest < n_ctx:
+            n_ctx, limited_by = max(largest, MIN_N_CTX), "memory"
+            if largest < MIN_N_CTX:
+                logger.warning(
+                    f"Only {max(budget, 0) >> 20} MB left for the KV cache; "
+                    f"using the minimum n_ctx {MIN_N_CTX}, which may swap"
+                )
+    report["n_ctx"] = n_ctx
+    report["limited_by"] = limited_by
+    return n_ctx, report
@@ -0,0 +1,229 @@
+"""
+Metrics - Per-request phase timings and server counters, exported in the
+Prometheus text format by GET /metrics.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans sub-millisecond template renders up to multi-minute generations
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+LOAD_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKENS_PER_SECOND_BUCKETS = (0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 50.0, 100.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, Any], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by a single label."""
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float], label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.label = label
+        # label value -> [bucket counts..., +Inf count], sum
+        self._counts: Dict[Optional[str], List[int]] = {}
+        self._sums: Dict[Optional[str], float] = {}
+
+    def observe(self, value: float, label_value: Optional[str] = None):
+        counts = self._counts.get(label_value)
+        if counts is None:
+            counts = self._counts[label_value] = [0] * (len(self.buckets) + 1)
+            self._sums[label_value] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[label_value] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, counts in sorted(self._counts.items(), key=lambda kv: str(kv[0])):
+            base = ((self.label, label_value),) if self.label else ()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(base + (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            total = _format_value(self._sums[label_value])
+            lines.append(f"{self.name}_sum{_format_labels(base)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, optionally split by a single label."""
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: Dict[Optional[str], float] = {}
+
+    def inc(self, amount: float = 1, label_value: Optional[str] = None):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self._values.items(), key=lambda kv: str(kv[0])):
+            labels = _format_labels(((self.label, label_value),) if self.label else ())
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+def render_sample(
+    name: str, help: str, kind: str, value: float, labels: Optional[Dict[str, Any]] = None
+) -> List[str]:
+    """Text lines for a single gauge or counter read from a stats() snapshot at scrape time."""
+    return [
+        f"# HELP {name} {help}",
+        f"# TYPE {name} {kind}",
+        f"{name}{_format_labels(tuple((labels or {}).items()))} {_format_value(value)}",
+    ]
+
+
+class RequestTimer:
+    """Phase timestamps of one chat completion.
+
+    Like CancelToken, instances are callable with llama's StoppingCriteria
+    signature; llama calls them once per sampled token, which marks the first
+    and last token times.
+    """
+
+    def __init__(self, stream: bool):
+        self.stream = stream
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.generation_started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.render_s = 0.0
+        self.tokenize_s = 0.0
+        self.sse_write_s = 0.0
+
+    def start(self):
+        """Called on the inference worker when the request leaves the queue."""
+        self.started_at = time.monotonic()
+
+    def start_generation(self, prompt_tokens: int = 0):
+        self.generation_started_at = time.monotonic()
+        self.prompt_tokens = prompt_tokens
+
+    def __call__(self, input_ids, logits) -> bool:
+        now = time.monotonic()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.last_token_at = now
+        self.tokens += 1
+        return False
+
+    def phases(self) -> Dict[str, float]:
+        """Durations in seconds of the phases this request went through."""
+        phases = {}
+        if self.started_at is not None:
+            phases["queue_wait"] = self.started_at - self.created_at
+        if self.generation_started_at is not None:
+            phases["template_render"] = self.render_s
+            phases["tokenize"] = self.tokenize_s
+        if self.first_token_at is not None:
+            phases["prompt_eval"] = self.first_token_at - self.generation_started_at
+            phases["decode"] = self.last_token_at - self.first_token_at
+        if self.stream:
+            phases["sse_write"] = self.sse_write_s
+        return phases
+
+
+class ServerMetrics:
+    """Histograms and counters filled in by the request path."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phase_seconds = Histogram(
+            "llm_request_phase_seconds",
+            "Time spent per chat completion phase",
+            LATENCY_BUCKETS,
+            label="phase",
+        )
+        self.ttft_seconds = Histogram(
+            "llm_time_to_first_token_seconds",
+            "Time from request arrival to the first generated token",
+            LATENCY_BUCKETS,
+            label="stream",
+        )
+        self.request_seconds = Histogram(
+            "llm_request_duration_seconds",
+            "Total chat completion time",
+            LATENCY_BUCKETS,
+            label="stream",
+        )
+        self.decode_rate = Histogram(
+            "llm_decode_tokens_per_second",
+            "Decode speed after the first token",
+            TOKENS_PER_SECOND_BUCKETS,
+        )
+        self.model_load_seconds = Histogram(
+            "llm_model_load_seconds", "Model construction time", LOAD_BUCKETS, label="model"
+        )
+        self.requests = Counter("llm_requests_total", "Chat completions by outcome", label="outcome")
+        self.prompt_tokens = Counter("llm_prompt_tokens_total", "Prompt tokens submitted for evaluation")
+        self.generated_tokens = Counter("llm_generated_tokens_total", "Tokens generated")
+
+    def observe_request(self, timer: RequestTimer, outcome: str = "ok"):
+        finished_at = time.monotonic()
+        stream = "true" if timer.stream else "false"
+        with self._lock:
+            self.requests.inc(label_value=outcome)
+            self.request_seconds.observe(finished_at - timer.created_at, stream)
+            for phase, seconds in timer.phases().items():
+                self.phase_seconds.observe(seconds, phase)
+            self.prompt_tokens.inc(timer.prompt_tokens)
+            self.generated_tokens.inc(timer.tokens)
+            if timer.first_token_at is not None:
+                self.ttft_seconds.observe(timer.first_token_at - timer.created_at, stream)
+                if timer.tokens > 1 and timer.last_token_at > timer.first_token_at:
+                    self.decode_rate.observe(
+                        (timer.tokens - 1) / (timer.last_token_at - timer.first_token_at)
+                    )
+
+    def observe_model_load(self, model_name: str, seconds: float):
+        with self._lock:
+            self.model_load_seconds.observe(seconds, model_name)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            lines = []
+            for metric in (
+                self.requests,
+                self.request_seconds,
+                self.phase_seconds,
+                self.ttft_seconds,
+                self.decode_rate,
+                self.prompt_tokens,
+                self.generated_tokens,
+                self.model_load_seconds,
+            ):
+                lines.extend(metric.render())
+            return lines
@@ -0,0 +1,175 @@
+"""
+Model Loader - Constructs models on a background thread while the inference
+worker keeps serving the active model, then swaps the new one in between jobs.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from distiller_cm5_python.llm_server.model_pool import ModelPool, ResidentModel, model_file_bytes
+from distiller_cm5_python.llm_server.scheduler import PRIORITY_HIGH, InferenceScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def file_mapping_bytes(path: str) -> Dict[str, int]:
+    """Bytes of path mapped into this process and how many of them are resident
+    (and locked, for mlock()ed mappings).
+
+    Read from /proc/self/smaps; returns zeros where that is unavailable.
+    """
+    target = os.path.realpath(path)
+    mapped = resident = locked = 0
+    in_target = False
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                if not fields[0].endswith(":"):
+                    # Mapping header: "start-end perms offset dev inode [pathname]"
+                    in_target = len(fields) >= 6 and fields[5] == target
+                elif in_target and fields[0] == "Size:":
+                    mapped += int(fields[1]) << 10
+                elif in_target and fields[0] == "Rss:":
+                    resident += int(fields[1]) << 10
+                elif in_target and fields[0] == "Locked:":
+                    locked += int(fields[1]) << 10
+    except OSError:
+        pass
+    return {"mapped_bytes": mapped, "resident_bytes": resident, "locked_bytes": locked}
+
+
+class ModelLoadTask:
+    """Progress of one background model load."""
+
+    def __init__(self, name: str, model_path: str, load_model_configs: Dict[str, Any]):
+        self.name = name
+        self.model_path = model_path
+        self.load_model_configs = dict(load_model_configs)
+        self.file_bytes = model_file_bytes(model_path)
+        self.state = "pending"  # pending -> loading -> ready | failed
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    def matches(self, name: str, load_model_configs: Dict[str, Any]) -> bool:
+        """True if this task loads name with every requested load option."""
+        return self.name == name and all(
+            self.load_model_configs.get(key) == value
+            for key, value in (load_model_configs or {}).items()
+        )
+
+    def progress(self) -> Dict[str, Any]:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        status = {
+            "model": self.name,
+            "state": self.state,
+            "elapsed_s": round(end - self.created_at, 3),
+            "file_bytes": self.file_bytes,
+        }
+        if self.state == "loading":
+            status.update(file_mapping_bytes(self.model_path))
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class ModelLoader:
+    """Background loads into a ModelPool.
+
+    Room is made and the new model is activated on the inference worker (the only
+    thread that touches loaded models), while the slow Llama construction runs on
+    a separate loader thread. Until the swap job runs, the previously active model
+    keeps serving requests. Loads are serialized; asking for a model that is
+    already loading with the same load options returns the existing task, while
+    other options queue a load of their own.
+    """
+
+    def __init__(
+        self,
+        scheduler: InferenceScheduler,
+        pool: ModelPool,
+        activate: Callable[[str, Dict[str, Any]], Any],
+        exists: Callable[[str], bool] = os.path.exists,
+    ):
+        self.scheduler = scheduler
+        self.pool = pool
+        # Runs on the inference worker once the model is in the pool
+        self.activate = activate
+        # Whether a model path can be loaded by the active backend
+        self.exists = exists
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-loader")
+        # Loads not yet finished, oldest first
+        self._tasks: List[ModelLoadTask] = []
+        self.last_task: Optional[ModelLoadTask] = None
+
+    def start(self, name: str, model_path: str, load_model_configs: Dict[str, Any]) -> ModelLoadTask:
+        """Start loading name in the background (or join a running load of name
+        with the same load options)."""
+        if not self.exists(model_path):
+            raise ValueError(f"Model '{name}' not found in models directory")
+        self._tasks = [task for task in self._tasks if not task.done]
+        for task in self._tasks:
+            if task.matches(name, load_model_configs):
+                return task
+        task = ModelLoadTask(name, model_path, load_model_configs)
+        self._tasks.append(task)
+        self.last_task = task
+        asyncio.create_task(self._run(task))
+        return task
+
+    async def _run(self, task: ModelLoadTask):
+        loop = asyncio.get_running_loop()
+        try:
+            resident = self.pool.get(task.name)
+            if resident is None or not resident.matches(task.load_model_configs):
+                await self.scheduler.submit(
+                    self.pool.make_room, task.file_bytes, priority=PRIORITY_HIGH
+                )
+                task.state = "loading"
+                task.started_at = time.monotonic()
+                resident = await loop.run_in_executor(self._executor, self._construct, task)
+                await self.scheduler.submit(self.pool.add, resident, priority=PRIORITY_HIGH)
+            await self.scheduler.submit(
+                self.activate, task.name, task.load_model_configs, priority=PRIORITY_HIGH
+            )
+            task.state = "ready"
+            task.future.set_result(True)
+        except Exception as e:
+            logger.error(f"Background load of model {task.name} failed: {e}")
+            task.state = "failed"
+            task.error = str(e)
+            task.future.set_exception(e)
+            # Nobody may be awaiting this task
+            task.future.exception()
+        finally:
+            task.finished_at = time.monotonic()
+
+    def _construct(self, task: ModelLoadTask) -> ResidentModel:
+        """Executed on the loader thread."""
+        logger.info(f"Loading model {task.name} in the background")
+        model = self.pool.loader(task.model_path, task.load_model_configs)
+        return ResidentModel(
+            task.name, model, task.load_model_configs, time.monotonic() - task.started_at
+        )
+
+    def loading(self) -> Optional[Dict[str, Any]]:
+        """Progress of the load in flight, if any."""
+        for task in self._tasks:
+            if not task.done:
+                return task.progress()
+        return None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
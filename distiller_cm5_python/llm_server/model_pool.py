@@ -0,0 +1,255 @@
+"""
+Model Pool - Keeps several loaded models resident within a count and RAM budget,
+unloading the least recently used one when a new model needs room.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from llama_cpp import Llama
+
+from distiller_cm5_python.llm_server.chat_template import ChatPromptBuilder
+from distiller_cm5_python.llm_server.gguf_index import kv_bytes_per_token, kv_cache_type
+
+logger = logging.getLogger(__name__)
+
+
+def model_file_bytes(model_path: str) -> int:
+    """Size of a model file; 0 for models that have no file (the fake backend)."""
+    return os.path.getsize(model_path) if os.path.exists(model_path) else 0
+
+
+def kv_bytes_per_context_token(model: Llama) -> int:
+    """KV cache bytes per token with the model's cache types, from its GGUF metadata
+    (0 if unknown)."""
+    types = ["f16", "f16"]
+    params = getattr(model, "context_params", None)
+    if params is not None:
+        try:
+            types = [kv_cache_type(params.type_k), kv_cache_type(params.type_v)]
+        except ValueError:
+            pass
+    return kv_bytes_per_token(model.metadata or {}, *types)
+
+
+def estimate_kv_bytes(model: Llama) -> int:
+    """KV cache size for the model's n_ctx and cache types, derived from its GGUF metadata."""
+    return kv_bytes_per_context_token(model) * model.n_ctx()
+
+
+class ResidentModel:
+    """A loaded model together with the per-model state built on top of it."""
+
+    def __init__(
+        self,
+        name: str,
+        model: Llama,
+        load_model_configs: Dict[str, Any],
+        load_seconds: float,
+    ):
+        self.name = name
+        self.model = model
+        self.load_model_configs = dict(load_model_configs)
+        self.prompt_builder = ChatPromptBuilder(model)
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.uses = 0
+        self.weights_bytes = model_file_bytes(model.model_path)
+        self.kv_bytes = estimate_kv_bytes(model)
+        # One context per inference slot; the first is model itself
+        self.contexts: List[Llama] = [model]
+
+    @property
+    def estimated_bytes(self) -> int:
+        # Forked contexts share the weights but each has its own KV cache
+        return self.weights_bytes + self.kv_bytes * len(self.contexts)
+
+    def ensure_contexts(self, n_contexts: int, fork: Callable[[Llama], Llama]):
+        """Fork the model until there is one context per inference slot."""
+        while len(self.contexts) < n_contexts:
+            self.contexts.append(fork(self.model))
+            logger.info(f"Forked context {len(self.contexts)} of model {self.name}")
+
+    def matches(self, load_model_configs: Dict[str, Any]) -> bool:
+        """True if every requested load option equals the one this model was loaded with."""
+        return all(
+            self.load_model_configs.get(key) == value
+            for key, value in (load_model_configs or {}).items()
+        )
+
+    def close(self):
+        # Forks use the model's weights, so they go first
+        for context in reversed(self.contexts[1:]):
+            context.close()
+        self.model.close()
+
+    def info(self) -> Dict[str, Any]:
+        info = {
+            "n_ctx": self.model.n_ctx(),
+            "load_model_configs": self.load_model_configs,
+            "load_seconds": round(self.load_seconds, 3),
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "uses": self.uses,
+            "weights_bytes": self.weights_bytes,
+            "kv_bytes": self.kv_bytes,
+            "contexts": len(self.contexts),
+            "estimated_bytes": self.estimated_bytes,
+        }
+        if hasattr(self.model, "speculative_stats"):
+            info["speculative"] = self.model.speculative_stats()
+            for context in self.contexts[1:]:
+                # Counters add up across slots
+                for key, value in context.speculative_stats().items():
+                    if key.endswith("_tokens") or key == "verify_steps":
+                        info["speculative"][key] += value
+            drafted = info["speculative"]["drafted_tokens"]
+            info["speculative"]["acceptance_rate"] = (
+                round(info["speculative"]["accepted_tokens"] / drafted, 3) if drafted else 0.0
+            )
+        return info
+
+
+class ModelPool:
+    """LRU pool of resident models.
+
+    Weights are memory-mapped by llama.cpp, so a model that was recently evicted
+    usually reloads from the page cache, and the same file is never loaded twice
+    while it is resident. The RAM budget covers weights plus the estimated KV
+    cache; the most recently requested model is always kept, even if it alone
+    exceeds the budget.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str, Dict[str, Any]], Llama],
+        max_models: int = 2,
+        ram_budget_bytes: int = 0,
+    ):
+        self.loader = loader
+        self.max_models = max_models
+        # 0 means no RAM limit beyond max_models
+        self.ram_budget_bytes = ram_budget_bytes
+        self._models: "OrderedDict[str, ResidentModel]" = OrderedDict()
+        self.active: Optional[str] = None
+        self._lock = threading.RLock()
+
+        # Stats
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(m.estimated_bytes for m in self._models.values())
+
+    def get(self, name: str) -> Optional[ResidentModel]:
+        with self._lock:
+            return self._models.get(name)
+
+    def acquire(self, name: str, model_path: str, load_model_configs: Dict[str, Any]) -> ResidentModel:
+        """Return the resident model for name, loading it (and evicting others) if needed.
+
+        Makes name the active model and unloads the previously active one if the
+        pool is over its limits. Must run on the inference worker.
+        """
+        with self._lock:
+            resident = self._models.get(name)
+            if resident is not None and resident.matches(load_model_configs):
+                self._models.move_to_end(name)
+                self.hits += 1
+                self._activate(resident)
+                # A background load kept the old active model; it may go now
+                self._evict(keep=name)
+                return resident
+
+        self.make_room(model_file_bytes(model_path))
+        start = time.monotonic()
+        model = self.loader(model_path, load_model_configs)
+        resident = ResidentModel(name, model, load_model_configs, time.monotonic() - start)
+        self.add(resident)
+        with self._lock:
+            self._activate(resident)
+            self._evict(keep=name)
+        return resident
+
+    def _activate(self, resident: ResidentModel):
+        self.active = resident.name
+        resident.last_used = time.time()
+        resident.uses += 1
+
+    def add(self, resident: ResidentModel):
+        """Insert a freshly loaded model, replacing one loaded under the same name
+        with other load options, then evict down to the pool limits."""
+        with self._lock:
+            if resident.name in self._models:
+                # Same file with different load options: replace it
+                logger.info(f"Replacing resident model {resident.name} (new load configs)")
+                self._unload(resident.name)
+            self._models[resident.name] = resident
+            self.loads += 1
+            logger.info(
+                f"Loaded model {resident.name} in {resident.load_seconds:.2f}s "
+                f"(~{resident.estimated_bytes >> 20} MB, {len(self._models)} resident)"
+            )
+            self._evict(keep=resident.name)
+
+    def make_room(self, incoming_bytes: int):
+        """Evict LRU models so one more model of incoming_bytes fits."""
+        with self._lock:
+            self._evict(incoming_bytes=incoming_bytes)
+
+    def _evict(self, incoming_bytes: int = 0, keep: Optional[str] = None):
+        """Evict LRU models until an incoming model fits, or until the pool is back
+        within its limits after keep was added. keep and the active model (which may
+        still be serving while another loads) are never evicted."""
+        max_resident = self.max_models if keep is not None else self.max_models - 1
+        for name in list(self._models):
+            over_count = len(self._models) > max(max_resident, 0)
+            over_budget = (
+                self.ram_budget_bytes > 0
+                and self.resident_bytes + incoming_bytes > self.ram_budget_bytes
+            )
+            if not over_count and not over_budget:
+                break
+            if name in (keep, self.active):
+                continue
+            self._unload(name)
+            self.evictions += 1
+
+    def _unload(self, name: str):
+        resident = self._models.pop(name)
+        if self.active == name:
+            self.active = None
+        try:
+            resident.close()
+        except Exception as e:
+            logger.warning(f"Error closing model {name}: {e}")
+        logger.info(f"Unloaded model {name} (idle {time.time() - resident.last_used:.0f}s)")
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._models):
+                self._unload(name)
+
+    def resident(self) -> Dict[str, Dict[str, Any]]:
+        """Per-model residency info, least recently used first."""
+        with self._lock:
+            return {name: m.info() for name, m in self._models.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resident_models": list(self._models),
+                "active": self.active,
+                "max_models": self.max_models,
+                "resident_bytes": self.resident_bytes,
+                "ram_budget_bytes": self.ram_budget_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
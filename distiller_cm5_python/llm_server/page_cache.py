@@ -0,0 +1,212 @@
+"""
+Page Cache - Warms model files before they are loaded. A prefetch reads a GGUF
+file sequentially on a background thread, so the pages llama.cpp maps are
+already in the page cache instead of being faulted in from SD/eMMC one at a
+time during load and the first tokens. Also reports how much of a file the
+page cache holds. Only uses the standard library, so the client can start a
+prefetch before the server process is up.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Large sequential reads let the kernel's readahead keep the device busy
+CHUNK_BYTES = 4 << 20
+
+_PROT_READ = 0x1
+_MAP_SHARED = 0x01
+# Keeps only the low bit of each mincore() byte, which says whether the page is resident
+_RESIDENT_BIT = bytes(b & 1 for b in range(256))
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_size_t,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_long,
+        ]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+        _libc = libc
+    return _libc
+
+
+def page_cache_bytes(path: str) -> Optional[int]:
+    """Bytes of path held in the page cache, whether or not anything maps it.
+
+    Asks mincore() about a fresh mapping of the file, which does not fault any
+    page in. None where that is unavailable; 0 for a missing file.
+    """
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    try:
+        libc = _load_libc()
+        fd = os.open(path, os.O_RDONLY)
+    except (OSError, AttributeError, TypeError):
+        return None
+    try:
+        addr = libc.mmap(None, size, _PROT_READ, _MAP_SHARED, fd, 0)
+        if addr is None or addr == ctypes.c_void_p(-1).value:
+            return None
+        try:
+            page = os.sysconf("SC_PAGE_SIZE")
+            pages = (size + page - 1) // page
+            vec = (ctypes.c_ubyte * pages)()
+            if libc.mincore(addr, size, vec) != 0:
+                return None
+            resident = bytes(vec).translate(_RESIDENT_BIT).count(1)
+            return min(resident * page, size)
+        finally:
+            libc.munmap(addr, size)
+    finally:
+        os.close(fd)
+
+
+def mlock_limit_bytes() -> Optional[int]:
+    """This process's RLIMIT_MEMLOCK soft limit; None if unlimited or unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+class PrefetchTask:
+    """Progress of one file being read into the page cache."""
+
+    def __init__(self, path: str, chunk_bytes: int = CHUNK_BYTES):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.file_bytes = os.path.getsize(path)
+        self.state = "pending"  # pending -> reading -> done | failed | cancelled
+        self.prefetched_bytes = 0
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="llm-prefetch", daemon=True)
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        self._thread.join(timeout)
+        return self.done
+
+    def _run(self):
+        self.state = "reading"
+        buffer = bytearray(self.chunk_bytes)
+        try:
+            with open(self.path, "rb", buffering=0) as f:
+                if hasattr(os, "posix_fadvise"):
+                    # Doubles the kernel's readahead window for this file
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                while not self._cancel.is_set():
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    self.prefetched_bytes += n
+            self.state = "cancelled" if self._cancel.is_set() else "done"
+        except OSError as e:
+            logger.warning(f"Prefetch of {os.path.basename(self.path)} failed: {e}")
+            self.state = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.monotonic()
+        if self.state == "done":
+            elapsed = self.finished_at - self.created_at
+            logger.info(
+                f"Prefetched {os.path.basename(self.path)} "
+                f"({self.file_bytes >> 20} MB) in {elapsed:.1f}s"
+            )
+
+    def progress(self) -> Dict[str, Any]:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        elapsed = end - self.created_at
+        status = {
+            "model": os.path.basename(self.path),
+            "state": self.state,
+            "elapsed_s": round(elapsed, 3),
+            "file_bytes": self.file_bytes,
+            "prefetched_bytes": self.prefetched_bytes,
+            "mb_per_s": round((self.prefetched_bytes >> 20) / elapsed, 1) if elapsed else 0.0,
+        }
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class Prefetcher:
+    """Background prefetches by file; asking for a file that is already being
+    read returns the running task."""
+
+    def __init__(self, chunk_bytes: int = CHUNK_BYTES):
+        self.chunk_bytes = chunk_bytes
+        self._tasks: Dict[str, PrefetchTask] = {}
+        self._lock = threading.Lock()
+
+        # Stats
+        self.prefetches = 0
+
+    def start(self, path: str) -> PrefetchTask:
+        """Start reading path into the page cache (or join a prefetch running)."""
+        path = os.path.realpath(path)
+        with self._lock:
+            task = self._tasks.get(path)
+            if task is not None and not task.done:
+                return task
+            task = PrefetchTask(path, self.chunk_bytes)
+            self._tasks[path] = task
+            self.prefetches += 1
+        task.start()
+        return task
+
+    def get(self, path: str) -> Optional[PrefetchTask]:
+        with self._lock:
+            return self._tasks.get(os.path.realpath(path))
+
+    def cancel_all(self):
+        with self._lock:
+            tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = list(self._tasks.values())
+        return {
+            "prefetches": self.prefetches,
+            "tasks": [task.progress() for task in tasks],
+        }
+
+
+def prefetch_file(path: str, chunk_bytes: int = CHUNK_BYTES) -> PrefetchTask:
+    """Start a one-off background prefetch of path."""
+    task = PrefetchTask(path, chunk_bytes)
+    task.start()
+    return task
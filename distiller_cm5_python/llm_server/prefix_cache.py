@@ -0,0 +1,237 @@
+"""
+Prefix State Cache - Keeps recently evaluated token sequences and their llama
+states in memory so a new prompt only has to evaluate the suffix that differs.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama import LlamaState
+from llama_cpp.llama_cache import BaseLlamaCache
+
+from distiller_cm5_python.llm_server.state_cache import state_nbytes
+
+logger = logging.getLogger(__name__)
+
+
+def common_prefix_length(a: np.ndarray, b: np.ndarray) -> int:
+    """Number of leading tokens shared by two token arrays."""
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    mismatch = np.flatnonzero(a[:n] != b[:n])
+    return int(mismatch[0]) if len(mismatch) else n
+
+
+def compact_state(state: LlamaState) -> LlamaState:
+    """Drop the per-token logits copied by Llama.save_state.
+
+    Sampling happens inside llama.cpp, so the scores are only needed for
+    logprobs, which this server never requests. Keeping a single zero row
+    (broadcast back on load_state) saves n_batch * n_vocab floats per entry.
+    """
+    if state.scores.ndim == 2 and state.scores.shape[0] > 1:
+        state.scores = np.zeros((1, state.scores.shape[1]), dtype=state.scores.dtype)
+    return state
+
+
+class PrefixStateCache(BaseLlamaCache):
+    """Longest-prefix index of saved llama states.
+
+    Installed on the model with Llama.set_cache, so llama-cpp-python looks up the
+    longest cached prefix before each completion (loading it only when it beats
+    what is already in the KV cache) and stores the final state afterwards.
+    Entries are evicted least recently used first once either max_entries or
+    capacity_bytes is exceeded; a state larger than the whole budget is not kept.
+    With state_bytes_per_token set, fits() tells callers beforehand whether a
+    state of some length could be kept at all, so they can skip saving it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 4,
+        capacity_bytes: int = 256 << 20,
+        min_prefix_tokens: int = 16,
+        state_bytes_per_token: int = 0,
+    ):
+        super().__init__(capacity_bytes=capacity_bytes)
+        self.max_entries = max_entries
+        self.min_prefix_tokens = min_prefix_tokens
+        # Estimated saved state size per evaluated token (0: unknown)
+        self.state_bytes_per_token = state_bytes_per_token
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[np.ndarray, LlamaState]]" = (
+            OrderedDict()
+        )
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        self.reused_tokens = 0
+        self.evictions = 0
+        self.oversized = 0
+        self.skipped_saves = 0
+
+    @property
+    def cache_size(self) -> int:
+        return self._bytes
+
+    def _pop_entry(self, key: Tuple[int, ...]):
+        _, state = self._entries.pop(key)
+        self._bytes -= state_nbytes(state)
+
+    def _find_longest_prefix(
+        self, tokens: np.ndarray
+    ) -> Tuple[Optional[Tuple[int, ...]], int]:
+        best_key, best_len = None, 0
+        for key, (entry_tokens, _) in self._entries.items():
+            prefix_len = common_prefix_length(entry_tokens, tokens)
+            if prefix_len > best_len:
+                best_key, best_len = key, prefix_len
+        return best_key, best_len
+
+    def lookup(self, key: Sequence[int]) -> Tuple[int, Optional[LlamaState]]:
+        """Return (matched prefix length, state) for the longest cached prefix of key."""
+        tokens = np.asarray(key, dtype=np.intc)
+        with self._lock:
+            best_key, best_len = self._find_longest_prefix(tokens)
+            if best_key is None or best_len < self.min_prefix_tokens:
+                self.misses += 1
+                return 0, None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            self.reused_tokens += best_len
+            return best_len, self._entries[best_key][1]
+
+    def fits(self, n_tokens: int) -> bool:
+        """Whether the state of n_tokens evaluated tokens is estimated to fit the budget."""
+        return n_tokens * self.state_bytes_per_token <= self.capacity_bytes
+
+    def restore(self, model: Llama, tokens: Sequence[int]) -> int:
+        """Load the longest cached prefix of tokens into model if it covers more of
+        them than the model's KV cache already does, as llama-cpp-python does
+        before a completion. Returns the cached prefix length (0 on a miss)."""
+        prefix_len, state = self.lookup(tokens)
+        if state is None:
+            return 0
+        evaluated = common_prefix_length(
+            model.input_ids[: model.n_tokens], np.asarray(tokens, dtype=np.intc)
+        )
+        if prefix_len > evaluated:
+            model.load_state(state)
+        return prefix_len
+
+    def detach(self, model: Llama, tokens: Sequence[int]):
+        """Restore the longest cached prefix of tokens and take the cache off model,
+        so the completion that follows does not save a state this cache would drop."""
+        self.restore(model, tokens)
+        model.cache = None
+        with self._lock:
+            self.skipped_saves += 1
+
+    def __getitem__(self, key: Sequence[int]) -> LlamaState:
+        prefix_len, state = self.lookup(key)
+        if state is None:
+            raise KeyError("No cached prefix")
+        logger.debug(
+            f"Prefix cache hit: {prefix_len}/{len(key)} prompt tokens already evaluated"
+        )
+        return state
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        tokens = np.asarray(key, dtype=np.intc)
+        with self._lock:
+            _, best_len = self._find_longest_prefix(tokens)
+        return best_len >= self.min_prefix_tokens
+
+    def __setitem__(self, key: Sequence[int], value: LlamaState) -> None:
+        key = tuple(int(t) for t in key)
+        if len(key) < self.min_prefix_tokens or self.max_entries <= 0:
+            return
+        tokens = np.asarray(key, dtype=np.intc)
+        value = compact_state(value)
+        size = state_nbytes(value)
+        with self._lock:
+            if size > self.capacity_bytes:
+                self.oversized += 1
+                logger.debug(f"Prefix cache skipped a {size} byte state over its budget")
+                return
+            # An entry that is a prefix of the new sequence is fully covered by it
+            covered = [
+                k
+                for k, (entry_tokens, _) in self._entries.items()
+                if len(entry_tokens) <= len(tokens)
+                and common_prefix_length(entry_tokens, tokens) == len(entry_tokens)
+            ]
+            for k in covered:
+                self._pop_entry(k)
+            self._entries[key] = (tokens, value)
+            self._bytes += size
+            self.saves += 1
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.capacity_bytes
+            ):
+                evicted = next(iter(self._entries))
+                self._pop_entry(evicted)
+                self.evictions += 1
+                logger.debug(f"Prefix cache evicted entry of {len(evicted)} tokens")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "entry_tokens": [len(k) for k in self._entries.keys()],
+                "state_bytes": self._bytes,
+                "capacity_bytes": self.capacity_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "saves": self.saves,
+                "reused_tokens": self.reused_tokens,
+                "evictions": self.evictions,
+                "oversized": self.oversized,
+                "skipped_saves": self.skipped_saves,
+            }
+
+
+def create_completion_within_budget(
+    llama: Llama, prompt_tokens: List[int], stream: bool = False, **kwargs
+):
+    """llama.create_completion, without the prefix cache store at its end when
+    the prompt's state alone is estimated to exceed the cache's byte budget.
+
+    llama-cpp-python saves the final state whenever a cache is set, so the cache
+    is looked up here instead and detached for the completion, like
+    constrained_tool_completion does for its later segments.
+    """
+    cache = llama.cache
+    if not isinstance(cache, PrefixStateCache) or cache.fits(len(prompt_tokens)):
+        return llama.create_completion(prompt=prompt_tokens, stream=stream, **kwargs)
+    cache.detach(llama, prompt_tokens)
+    if not stream:
+        try:
+            return llama.create_completion(prompt=prompt_tokens, stream=False, **kwargs)
+        finally:
+            llama.cache = cache
+    return _reattach_cache(
+        llama, cache, llama.create_completion(prompt=prompt_tokens, stream=True, **kwargs)
+    )
+
+
+def _reattach_cache(llama: Llama, cache: PrefixStateCache, chunks: Iterator[Dict[str, Any]]):
+    try:
+        yield from chunks
+    finally:
+        llama.cache = cache
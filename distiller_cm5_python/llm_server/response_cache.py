@@ -0,0 +1,100 @@
+"""
+Response Cache - Finished responses of deterministic (temperature 0) chat
+completions, keyed by a canonical hash of everything that decides them: model,
+load configs, messages, tools and inference configs. A repeated request is
+answered without running the model. Streamed responses are kept as the SSE
+frames that were sent and replayed as they are.
+"""
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def response_key(**parts: Any) -> str:
+    """Hash of the parts as canonical JSON (sorted keys, no whitespace)."""
+    canonical = json.dumps(
+        parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU of responses with a time to live.
+
+    A value is a completion dict or a list of SSE frames. max_entries 0
+    disables the cache.
+    """
+
+    def __init__(self, max_entries: int = 0, ttl_s: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        # key -> (stored_at, value)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_s:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        # Frames are bytes; a completion dict is copied so callers may change it
+        return list(value) if isinstance(value, list) else copy.deepcopy(value)
+
+    def put(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> int:
+        with self._lock:
+            cleared = len(self._entries)
+            self._entries.clear()
+            return cleared
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
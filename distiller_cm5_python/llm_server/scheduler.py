@@ -0,0 +1,615 @@
+"""
+Inference Scheduler - Runs blocking llama calls on dedicated worker threads
+so the FastAPI event loop stays responsive (health checks, model listing).
+Generation jobs run in parallel on inference slots; everything else runs alone.
+Jobs of equal priority are shared fairly between the clients that submitted them.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Lower value is served first; jobs with equal priority are served round-robin
+# across clients, FIFO within a client
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+_STREAM_END = object()
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the scheduler queue (or the client's
+    or priority's share of it) is at capacity. retry_after_s estimates when a
+    slot in the queue frees up."""
+
+    def __init__(self, message, retry_after_s: float = 0.0):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+def common_prefix_length(a: Sequence[Any], b: Sequence[Any]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class InferenceSlot:
+    """One llama context that slot jobs run on.
+
+    model is assigned by the server whenever the active model changes. The
+    prefix key describes what the slot last evaluated (hashes of the tools and
+    of each message), so requests can be sent where their prompt prefix
+    is most likely still in the KV cache. A slot pinned to a session is kept
+    for that session's turns while other slots are free.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.model: Any = None
+        self.prefix_key: List[str] = []
+        self.job: Optional["_Job"] = None
+        self.last_used = 0.0
+        self.pinned_by: Optional[str] = None
+
+        # Stats
+        self.jobs = 0
+        self.prefix_matches = 0
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "busy": self.job is not None,
+            "job": self.job.fn.__name__ if self.job is not None else None,
+            "pinned_by": self.pinned_by,
+            "jobs": self.jobs,
+            "prefix_matches": self.prefix_matches,
+        }
+
+
+class _Job:
+    """A unit of work waiting for (or running on) the inference worker."""
+
+    def __init__(
+        self,
+        fn: Callable,
+        args: tuple,
+        kwargs: dict,
+        priority: int,
+        slot_key: Optional[List[str]] = None,
+        exclusive: Optional[Callable[[], bool]] = None,
+        pin: Optional[str] = None,
+        client: Optional[str] = None,
+        job_id: Optional[str] = None,
+    ):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        # Slot jobs get slot= and may run next to each other; other jobs run alone
+        self.slot_key = slot_key
+        # Checked at dispatch: True makes a slot job wait until it is alone
+        self.exclusive = exclusive
+        # Slot jobs with a pin return to the slot pinned to it
+        self.pin = pin
+        # Who submitted the job, for fair sharing; internal jobs have none
+        self.client = client
+        # Looked up by queue_info(); the request id for chat completions
+        self.job_id = job_id
+        # Fair-queuing tag: the client's round at its priority
+        self.tag = 0
+        self.sequence = 0
+        self.slot: Optional[InferenceSlot] = None
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.loop = asyncio.get_running_loop()
+        self.future: asyncio.Future = self.loop.create_future()
+
+    @property
+    def sort_key(self):
+        return (self.priority, self.tag, self.sequence)
+
+    @property
+    def runs_alone(self) -> bool:
+        return self.slot_key is None or (self.exclusive is not None and self.exclusive())
+
+    def _call(self):
+        if self.slot_key is not None:
+            return self.fn(*self.args, slot=self.slot, **self.kwargs)
+        return self.fn(*self.args, **self.kwargs)
+
+    def run(self):
+        """Executed on a worker thread."""
+        return self._call()
+
+    def fail(self, error: Exception):
+        """Fail a job that has not started; the worker skips it when dequeued."""
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class _StreamJob(_Job):
+    """A job whose function returns an iterator; items are relayed to the event loop."""
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, priority: int, **options):
+        super().__init__(fn, args, kwargs, priority, **options)
+        self.items: asyncio.Queue = asyncio.Queue()
+
+    def _put(self, item):
+        self.loop.call_soon_threadsafe(self.items.put_nowait, item)
+
+    def run(self):
+        """Executed on a worker thread."""
+        try:
+            for item in self._call():
+                self._put(item)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(_STREAM_END)
+
+    def fail(self, error: Exception):
+        """Fail a job that has not started; its relay raises error."""
+        if not self.future.done():
+            self.items.put_nowait(error)
+            self.future.cancel()
+
+
+class InferenceScheduler:
+    """Bounded priority queue in front of the llama worker threads.
+
+    Llama contexts are not thread-safe, so every call that touches a model goes
+    through this queue. Slot jobs (submitted with a slot_key) run on one of
+    n_slots inference slots, each with its own context, next to each other;
+    the free slot whose last prefix key shares the most leading entries with
+    the job's is chosen. Jobs submitted with a pin (a session id) go to the
+    slot pinned to it, and pin the slot they run on; jobs without one avoid
+    pinned slots while unpinned ones are free. All other jobs (model loads, cache building) wait
+    until every slot is idle and run alone. Endpoints await their turn instead
+    of blocking the event loop.
+
+    Within a priority, jobs are ordered by a per-client round number (start-time
+    fair queuing with unit cost): a client's k-th waiting job is served after
+    every other client's (k-1)-th, so one client queueing many jobs cannot starve
+    the others. Besides max_queue_size, max_queued_per_client and
+    max_queued_by_priority ({priority: limit}) bound what one client or one
+    priority may hold of the queue.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 16,
+        wait_sample_size: int = 200,
+        n_slots: int = 1,
+        max_queued_per_client: int = 0,
+        max_queued_by_priority: Optional[Dict[int, int]] = None,
+    ):
+        self.max_queue_size = max_queue_size
+        # 0 means no limit beyond max_queue_size
+        self.max_queued_per_client = max_queued_per_client
+        self.max_queued_by_priority: Dict[int, int] = dict(max_queued_by_priority or {})
+        self.slots: List[InferenceSlot] = [InferenceSlot(i) for i in range(n_slots)]
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._sequence = itertools.count()
+        self._slot_released: Optional[asyncio.Condition] = None
+        self._running: set = set()
+        # Queued jobs, and how many of them each client and priority holds
+        self._waiting: set = set()
+        self._queued_by_client: Dict[Optional[str], int] = {}
+        self._queued_by_priority: Dict[int, int] = {}
+        # Fair queuing: last tag per (priority, client), and the tag of the
+        # last dispatched job per priority
+        self._client_tags: Dict[tuple, int] = {}
+        self._virtual_time: Dict[int, int] = {}
+
+        # Stats
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+        self.rejected_jobs = 0
+        self._wait_samples = deque(maxlen=wait_sample_size)
+        self._run_samples = deque(maxlen=wait_sample_size)
+
+    async def start(self):
+        """Start the worker coroutine on the running event loop."""
+        if self._worker_task is not None and not self._worker_task.done():
+            return
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.n_slots, thread_name_prefix="llm-inference"
+        )
+        self._queue = asyncio.PriorityQueue()
+        self._slot_released = asyncio.Condition()
+        self._worker_task = asyncio.create_task(self._worker())
+        logger.info(
+            f"Inference scheduler started (max_queue_size={self.max_queue_size}, "
+            f"slots={self.n_slots})"
+        )
+
+    async def stop(self):
+        """Stop the worker and fail any jobs still waiting in the queue."""
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        while self._queue is not None and not self._queue.empty():
+            _, job = self._queue.get_nowait()
+            self._dequeued(job)
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("Inference scheduler stopped"))
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        logger.info("Inference scheduler stopped")
+
+    @property
+    def queue_depth(self) -> int:
+        # Jobs dropped while queued stay in _queue until the worker skips them
+        return len(self._waiting)
+
+    def admission_error(
+        self, priority: int = PRIORITY_NORMAL, client: Optional[str] = None
+    ) -> Optional[str]:
+        """Why a job of this priority and client would be rejected now, or None."""
+        if self.queue_depth >= self.max_queue_size:
+            return f"Inference queue is full ({self.queue_depth}/{self.max_queue_size} waiting)"
+        if client is not None and self.max_queued_per_client > 0:
+            queued = self._queued_by_client.get(client, 0)
+            if queued >= self.max_queued_per_client:
+                return (
+                    f"Client '{client}' already has {queued}/{self.max_queued_per_client} "
+                    f"requests waiting"
+                )
+        limit = self.max_queued_by_priority.get(priority, 0)
+        if limit > 0:
+            queued = self._queued_by_priority.get(priority, 0)
+            if queued >= limit:
+                return f"Queue share for priority {priority} is full ({queued}/{limit} waiting)"
+        return None
+
+    def check_admission(self, priority: int = PRIORITY_NORMAL, client: Optional[str] = None):
+        """Raise QueueFullError if a job of this priority and client would be rejected,
+        so callers can fail fast before doing any work for the request."""
+        error = self.admission_error(priority, client)
+        if error is not None:
+            self.rejected_jobs += 1
+            raise QueueFullError(error, self.estimate_wait_s(self.queue_depth))
+
+    def _enqueue(self, job: _Job):
+        if self._queue is None:
+            raise RuntimeError("Inference scheduler is not running")
+        self.check_admission(job.priority, job.client)
+        fair_key = (job.priority, job.client)
+        job.tag = max(
+            self._virtual_time.get(job.priority, 0), self._client_tags.get(fair_key, 0)
+        ) + 1
+        self._client_tags[fair_key] = job.tag
+        job.sequence = next(self._sequence)
+        self._waiting.add(job)
+        self._queued_by_client[job.client] = self._queued_by_client.get(job.client, 0) + 1
+        self._queued_by_priority[job.priority] = self._queued_by_priority.get(job.priority, 0) + 1
+        self._queue.put_nowait((job.sort_key, job))
+        # A job whose caller went away stops counting toward the limits at once
+        job.future.add_done_callback(lambda _: self._unqueue(job))
+        logger.debug(
+            f"Queued inference job {job.fn.__name__} (priority={job.priority}, "
+            f"client={job.client}, tag={job.tag}, depth={self.queue_depth})"
+        )
+
+    def _unqueue(self, job: _Job):
+        """Stop counting job as waiting; a no-op once it has been."""
+        if job not in self._waiting:
+            return
+        self._waiting.discard(job)
+        for counts, key in (
+            (self._queued_by_client, job.client),
+            (self._queued_by_priority, job.priority),
+        ):
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
+
+    def _dequeued(self, job: _Job):
+        self._unqueue(job)
+        self._virtual_time[job.priority] = max(self._virtual_time.get(job.priority, 0), job.tag)
+        fair_key = (job.priority, job.client)
+        if self._client_tags.get(fair_key, 0) <= self._virtual_time[job.priority]:
+            # The client has no later round queued; its next job starts at the current one
+            self._client_tags.pop(fair_key, None)
+
+    def estimate_wait_s(self, ahead: int) -> float:
+        """Rough wait for a job with `ahead` queued jobs before it: those jobs
+        plus half of the running ones, at the median run time, over the slots."""
+        run_s = self._percentile(self._run_samples, 50)
+        running = 0 if self._free_slots() else len(self.slots)
+        return round(run_s * (ahead + 0.5 * running) / self.n_slots, 3)
+
+    def queue_info(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Where the job with job_id is: running, or queued with its position
+        (jobs that start before it) and estimated wait. None if unknown."""
+        for slot in self.slots:
+            if slot.job is not None and slot.job.job_id == job_id:
+                return {
+                    "state": "running",
+                    "slot": slot.index,
+                    "running_s": round(time.monotonic() - (slot.job.started_at or 0.0), 3),
+                }
+        job = next((j for j in self._waiting if j.job_id == job_id), None)
+        if job is None or job.future.done():
+            return None
+        ahead = sum(
+            1 for j in self._waiting if j.sort_key < job.sort_key and not j.future.done()
+        )
+        return {
+            "state": "queued",
+            "position": ahead,
+            "queue_depth": self.queue_depth,
+            "queued_s": round(time.monotonic() - job.enqueued_at, 3),
+            "estimated_wait_s": self.estimate_wait_s(ahead),
+        }
+
+    def drop_queued(self, job_id: str, error: Exception) -> int:
+        """Fail the queued jobs with job_id (e.g. of a cancelled request) with
+        error, so they stop counting toward the admission limits right away.
+        Returns how many were dropped; running jobs are left alone."""
+        jobs = [j for j in self._waiting if j.job_id == job_id and not j.future.done()]
+        for job in jobs:
+            job.fail(error)
+            self._unqueue(job)
+        if jobs:
+            logger.debug(f"Dropped {len(jobs)} queued job(s) of {job_id}")
+        return len(jobs)
+
+    def preemption_pending(self, priority: int) -> bool:
+        """True if a job more urgent than priority is queued and no slot is free
+        for it. Called from worker threads at every generated token, so it only
+        reads a snapshot of the queued priorities."""
+        waiting = tuple(self._queued_by_priority)
+        return bool(waiting) and min(waiting) < priority and not self._free_slots()
+
+    async def submit(
+        self,
+        fn: Callable,
+        *args,
+        priority: int = PRIORITY_NORMAL,
+        slot_key: Optional[List[str]] = None,
+        exclusive: Optional[Callable[[], bool]] = None,
+        pin: Optional[str] = None,
+        client: Optional[str] = None,
+        job_id: Optional[str] = None,
+        **kwargs,
+    ) -> Any:
+        """Run fn(*args, **kwargs) on the inference worker and return its result.
+
+        With a slot_key the job runs on an inference slot and fn gets slot= as
+        well; exclusive() is checked at dispatch to make such a job run alone.
+        pin keeps the slot the job runs on for later jobs with the same pin.
+        client shares the queue fairly between submitters; job_id names the job
+        for queue_info().
+        """
+        job = _Job(
+            fn,
+            args,
+            kwargs,
+            priority,
+            slot_key=slot_key,
+            exclusive=exclusive,
+            pin=pin,
+            client=client,
+            job_id=job_id,
+        )
+        self._enqueue(job)
+        return await job.future
+
+    def submit_stream(
+        self,
+        fn: Callable[..., Iterator],
+        *args,
+        priority: int = PRIORITY_NORMAL,
+        slot_key: Optional[List[str]] = None,
+        exclusive: Optional[Callable[[], bool]] = None,
+        pin: Optional[str] = None,
+        client: Optional[str] = None,
+        job_id: Optional[str] = None,
+        **kwargs,
+    ) -> AsyncIterator:
+        """Queue a generator function and return an async iterator over its items.
+
+        The job is enqueued immediately (so QueueFullError is raised here, before
+        a streaming response has started), and items are relayed as the worker
+        produces them. slot_key, exclusive, pin, client and job_id work as in submit().
+        """
+        job = _StreamJob(
+            fn,
+            args,
+            kwargs,
+            priority,
+            slot_key=slot_key,
+            exclusive=exclusive,
+            pin=pin,
+            client=client,
+            job_id=job_id,
+        )
+        self._enqueue(job)
+        return self._relay(job)
+
+    async def _relay(self, job: _StreamJob) -> AsyncIterator:
+        try:
+            while True:
+                item = await job.items.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumer went away early: skip the job if it has not started yet
+            if not job.future.done():
+                job.future.cancel()
+
+    @property
+    def n_slots(self) -> int:
+        return len(self.slots)
+
+    def configure_slots(self, n_slots: int):
+        """Set the number of inference slots; only before start()."""
+        self.slots = [InferenceSlot(i) for i in range(max(n_slots, 1))]
+
+    def assign_models(self, models: Sequence[Any]):
+        """Give slot i the context models[i]; called while no slot job is running."""
+        for slot, model in zip(self.slots, models):
+            if slot.model is not model:
+                slot.model = model
+                slot.prefix_key = []
+
+    def _free_slots(self) -> List[InferenceSlot]:
+        return [slot for slot in self.slots if slot.job is None]
+
+    def _pick_slot(self, slot_key: List[str], pin: Optional[str] = None) -> InferenceSlot:
+        """Free slot pinned to pin, else an unpinned one, else any; among those the
+        longest matching prefix key, least recently used on ties."""
+
+        def ownership(slot: InferenceSlot) -> int:
+            if pin is not None and slot.pinned_by == pin:
+                return 2
+            return 1 if slot.pinned_by is None else 0
+
+        return max(
+            self._free_slots(),
+            key=lambda slot: (
+                ownership(slot),
+                common_prefix_length(slot.prefix_key, slot_key),
+                -slot.last_used,
+            ),
+        )
+
+    def _pin(self, slot: InferenceSlot, pin: str):
+        """Move pin to slot; a pin lives on one slot and a slot holds one pin."""
+        for other in self.slots:
+            if other.pinned_by == pin:
+                other.pinned_by = None
+        slot.pinned_by = pin
+
+    def unpin(self, pin: str):
+        """Release the slot pinned to pin (its KV cache stays until reused)."""
+        for slot in self.slots:
+            if slot.pinned_by == pin:
+                slot.pinned_by = None
+
+    def pinned_slot(self, pin: str) -> Optional[int]:
+        for slot in self.slots:
+            if slot.pinned_by == pin:
+                return slot.index
+        return None
+
+    async def _wait_for(self, predicate: Callable[[], bool]):
+        async with self._slot_released:
+            await self._slot_released.wait_for(predicate)
+
+    async def _worker(self):
+        while True:
+            # A queued job is only taken once it can start right away
+            await self._wait_for(lambda: bool(self._free_slots()))
+            _, job = await self._queue.get()
+            self._dequeued(job)
+            if job.future.done():
+                # Caller went away (e.g. request cancelled) while queued
+                continue
+            alone = job.runs_alone
+            if alone:
+                await self._wait_for(lambda: len(self._free_slots()) == len(self.slots))
+                job.slot = self.slots[0]
+            else:
+                job.slot = self._pick_slot(job.slot_key, job.pin)
+                if common_prefix_length(job.slot.prefix_key, job.slot_key) > 0:
+                    job.slot.prefix_matches += 1
+                if job.pin is not None:
+                    self._pin(job.slot, job.pin)
+            # Other jobs (cache building) may leave anything in slot 0's context
+            job.slot.prefix_key = job.slot_key if job.slot_key is not None else []
+            job.slot.job = job
+            if alone or len(self.slots) == 1:
+                await self._run(job)
+            else:
+                task = asyncio.create_task(self._run(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run(self, job: _Job):
+        loop = asyncio.get_running_loop()
+        slot = job.slot
+        job.started_at = time.monotonic()
+        self._wait_samples.append(job.started_at - job.enqueued_at)
+        try:
+            result = await loop.run_in_executor(self._executor, job.run)
+            if not job.future.done():
+                job.future.set_result(result)
+            self.completed_jobs += 1
+        except Exception as e:
+            self.failed_jobs += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._run_samples.append(time.monotonic() - job.started_at)
+            slot.job = None
+            slot.jobs += 1
+            slot.last_used = time.monotonic()
+            async with self._slot_released:
+                self._slot_released.notify_all()
+
+    @staticmethod
+    def _percentile(samples, pct: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and wait-time summary for monitoring endpoints."""
+        running = [slot.job for slot in self.slots if slot.job is not None]
+        # The longest-running job
+        active = min(running, key=lambda job: job.started_at or 0.0) if running else None
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_size": self.max_queue_size,
+            "max_queued_per_client": self.max_queued_per_client,
+            "max_queued_by_priority": dict(self.max_queued_by_priority),
+            "queued_by_client": {
+                client if client is not None else "internal": count
+                for client, count in self._queued_by_client.items()
+            },
+            "queued_by_priority": dict(self._queued_by_priority),
+            "busy": active is not None,
+            "busy_slots": len(running),
+            "pinned_slots": sum(1 for slot in self.slots if slot.pinned_by is not None),
+            "slots": [slot.info() for slot in self.slots],
+            "active_job": active.fn.__name__ if active is not None else None,
+            "active_job_running_s": (
+                round(time.monotonic() - active.started_at, 3)
+                if active is not None and active.started_at is not None
+                else 0.0
+            ),
+            "completed_jobs": self.completed_jobs,
+            "failed_jobs": self.failed_jobs,
+            "rejected_jobs": self.rejected_jobs,
+            "wait_s": {
+                "p50": round(self._percentile(self._wait_samples, 50), 3),
+                "p95": round(self._percentile(self._wait_samples, 95), 3),
+                "max": round(max(self._wait_samples, default=0.0), 3),
+            },
+            "run_s": {
+                "p50": round(self._percentile(self._run_samples, 50), 3),
+                "p95": round(self._percentile(self._run_samples, 95), 3),
+            },
+        }
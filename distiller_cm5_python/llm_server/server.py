@@ -3,24 +3,100 @@
 LLM Server - Provides LLM services over HTTP
 """
 import argparse
+import asyncio
+import copy
+import itertools
 import logging
 import json
+import math
 import os
+import stat
 import sys
-from typing import Dict, List, Any, Optional
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Any, Optional, Tuple, Union
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 import uvicorn
-from llama_cpp import Llama
+from llama_cpp import Llama, StoppingCriteriaList
 
-from llama_cpp.llama_cache import LlamaDiskCache
-from jinja2 import Template
-import re
 
 # Import the centralized logging setup
 from distiller_cm5_python.utils.logger import setup_logging
+from distiller_cm5_python.llm_server.scheduler import (
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    InferenceScheduler,
+    InferenceSlot,
+    QueueFullError,
+)
+from distiller_cm5_python.llm_server.autotune import (
+    TUNED_KEYS,
+    TuningStore,
+    autotune,
+    thread_candidates,
+)
+from distiller_cm5_python.llm_server.backends import BACKENDS, LlamaBackend, make_backend
+from distiller_cm5_python.llm_server.prefix_cache import (
+    PrefixStateCache,
+    compact_state,
+    create_completion_within_budget,
+)
+from distiller_cm5_python.llm_server.kv_fork import evaluate_prefix, fork, shared_prefix_length
+from distiller_cm5_python.llm_server.token_counts import TokenCounter
+from distiller_cm5_python.llm_server.state_cache import StateCache
+from distiller_cm5_python.llm_server.cancellation import (
+    PREEMPTED,
+    CancellationRegistry,
+    CancelToken,
+    RequestCancelledError,
+)
+from distiller_cm5_python.llm_server.chat_template import (
+    ChatPromptBuilder,
+    completion_chunks_to_chat,
+    completion_to_chat,
+    content_hash,
+)
+from distiller_cm5_python.llm_server.context_policy import POLICIES, ContextFitter
+from distiller_cm5_python.llm_server.gguf_index import (
+    KV_CACHE_TYPES,
+    GgufIndex,
+    estimate_ram_bytes,
+    kv_cache_bytes_per_token,
+    kv_cache_type,
+)
+from distiller_cm5_python.llm_server.memory_budget import available_ram_bytes, fit_n_ctx
+from distiller_cm5_python.llm_server.metrics import RequestTimer, ServerMetrics, render_sample
+from distiller_cm5_python.llm_server.model_loader import ModelLoader, file_mapping_bytes
+from distiller_cm5_python.llm_server.model_pool import (
+    ModelPool,
+    kv_bytes_per_context_token,
+    model_file_bytes,
+)
+from distiller_cm5_python.llm_server.page_cache import (
+    Prefetcher,
+    mlock_limit_bytes,
+    page_cache_bytes,
+)
+from distiller_cm5_python.llm_server.response_cache import ResponseCache, response_key
+from distiller_cm5_python.llm_server.sessions import Session, SessionError, SessionRegistry
+from distiller_cm5_python.llm_server.speculative import SpeculativeLlama, make_draft
+from distiller_cm5_python.llm_server.sse import (
+    DONE_FRAME,
+    coalesce_chunks,
+    encode_frame,
+    encode_frames,
+)
+from distiller_cm5_python.llm_server.tool_grammar import (
+    ToolGrammarCache,
+    collect_completion,
+    constrained_tool_completion,
+)
+from distiller_cm5_python.llm_server.warmup import load_warmup_spec
 
 # --- Logging setup will be done in main() after parsing args ---
 
@@ -28,14 +104,156 @@ from distiller_cm5_python.utils.logger import setup_logging
 # We get the logger instance here, but configuration (level, stream) happens in main()
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = None
+MODEL = None
+# Compiled chat template and static-prefix caches for MODEL
+PROMPT_BUILDER: Optional[ChatPromptBuilder] = None
+
+# Constructs models: llama.cpp, or the fake Llama for hardware-free load tests
+BACKEND = LlamaBackend()
+
+# Append every /chat/completions body to this JSONL file for loadgen.py replays
+RECORD_REQUESTS_PATH: Optional[str] = None
+# Keeps concurrent recordings from interleaving their lines
+RECORD_LOCK = asyncio.Lock()
+
+# Unix domain socket the server listens on instead of TCP (--uds)
+UDS_PATH: Optional[str] = None
+
+# All llama calls go through this scheduler so the event loop stays free;
+# chat completions run on its inference slots (--parallel)
+SCHEDULER = InferenceScheduler()
+
+# n_ctx used when a load request does not specify one
+DEFAULT_N_CTX = 4096
+
+# KV cache types for loads that do not set type_k/type_v (--cache_type_k/v)
+DEFAULT_TYPE_K = "f16"
+DEFAULT_TYPE_V = "f16"
+
+# Shrink n_ctx to what free RAM allows for loads that do not set "fit_n_ctx"
+# (see memory_budget.py), keeping RAM_RESERVE_BYTES free; how each model's
+# n_ctx was decided is kept for /health and /models
+FIT_N_CTX = False
+RAM_RESERVE_BYTES = 512 << 20
+N_CTX_FITS: Dict[str, Dict[str, Any]] = {}
+
+# How loads that do not set "use_mmap"/"use_mlock" map the model file
+# (--no_mmap, --mlock): mmap shares the page cache instead of copying the
+# weights, mlock pins them so they are never paged out again
+DEFAULT_USE_MMAP = True
+DEFAULT_USE_MLOCK = False
+
+# Background reads of model files into the page cache (see page_cache.py)
+PREFETCHER = Prefetcher()
+
+
+
+def _drop_queued_jobs(token: CancelToken):
+    SCHEDULER.drop_queued(
+        token.request_id,
+        RequestCancelledError(f"Request {token.request_id} was cancelled while queued"),
+    )
+
+
+# In-flight chat completions, cancellable by id or by client disconnect; the
+# jobs of a cancelled request that are still queued leave the queue right away
+CANCELLATIONS = CancellationRegistry(on_cancel=_drop_queued_jobs)
+
+# Request classes a chat completion may set in "request_class", and their
+# scheduler priorities. A request's token budget (inference_configs["token_budget"],
+# else its class default) is how many tokens it generates before it may be
+# preempted for more urgent queued work; 0 never preempts (--background_token_budget).
+# A preempted request is requeued and resumes after the text it had generated
+REQUEST_CLASSES = {"interactive": PRIORITY_NORMAL, "background": PRIORITY_LOW}
+TOKEN_BUDGETS = {"interactive": 0, "background": 256}
+
+# Conversations held server-side, so turns only upload their new messages
+# (--max_sessions, --session_ttl_s); closing one releases its pinned slot
+SESSIONS = SessionRegistry(on_close=SCHEDULER.unpin)
+
+# Responses of temperature-0 chat completions, replayed for identical requests
+# (--response_cache_entries, --response_cache_ttl_s; disabled by default)
+RESPONSE_CACHE = ResponseCache()
+
+# Per-request phase timings and counters exported by /metrics
+METRICS = ServerMetrics()
+
+# Number of evaluated token sequences kept for automatic prefix reuse (0 disables)
+# and the RAM their saved states may take in total
+PREFIX_CACHE_ENTRIES = 4
+PREFIX_CACHE_BYTES = 256 << 20
+
+# Per-model memory figures reported by /health and /models: (computed at, figures)
+MODEL_MEMORY: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+MODEL_MEMORY_TTL_S = 10.0
+
+# Byte budgets for the /restore_cache state store
+STATE_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+STATE_CACHE_RAM_BYTES = 512 << 20
+STATE_CACHE_DISK_BYTES = 2 << 30
+
+# Default SSE coalescing when a request has no stream_options: one frame per token
+STREAM_CHUNK_TOKENS = 1
+STREAM_INTERVAL_MS = 0
+
+# Speculative decoding for loads that do not set "speculative": False/"off",
+# True/"prompt_lookup" or the file name of a draft GGUF in the models directory
+DEFAULT_SPECULATIVE: Any = False
+
+# How prompts longer than n_ctx are cut (see context_policy.py), unless a
+# request sets inference_configs["context_policy"]; and the tokens kept free
+# for generation (at most max_tokens)
+CONTEXT_POLICY = "drop_oldest"
+CONTEXT_RESERVE_TOKENS = 512
+
+# Constrain tool calls to the request's tool schemas unless a request sets
+# inference_configs["tool_grammar"]
+TOOL_GRAMMAR = False
+TOOL_GRAMMARS = ToolGrammarCache()
+
+# GGUF header facts of the model files, so /models needs no trial loads
+GGUF_INDEX = GgufIndex(STATE_CACHE_DIR)
+
+# Fastest threads and batch sizes per model file and CPU (see autotune.py),
+# applied to every load unless load_model_configs sets "autotune": False
+TUNING = TuningStore(STATE_CACHE_DIR)
+
+# Per-message token counts for /count_tokens, by model and content hash
+# (--token_count_cache_entries)
+TOKEN_COUNTER = TokenCounter()
+
+# Branches one /chat/completions/batch request may fork its prefix into
+MAX_BATCH_BRANCHES = 8
+
+# Static prompt prefix evaluated at boot (see warmup.py); None disables
+WARMUP_SPEC_PATH: Optional[str] = None
+WARMUP_STATUS: Dict[str, Any] = {"state": "disabled"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await SCHEDULER.start()
+    if WARMUP_SPEC_PATH:
+        asyncio.create_task(_warmup_from_spec(WARMUP_SPEC_PATH))
+    yield
+    MODEL_LOADER.shutdown()
+    PREFETCHER.cancel_all()
+    await SCHEDULER.stop()
+    for store in Cache._stores.values():
+        store.flush()
+    # uvicorn re-raises SIGTERM after shutdown, so the socket is removed here
+    if UDS_PATH and os.path.exists(UDS_PATH):
+        os.unlink(UDS_PATH)
+
+
 # Create FastAPI app
 app = FastAPI(
-    title="LLM Server", description="A simple LLM server that provides LLM services"
+    title="LLM Server",
+    description="A simple LLM server that provides LLM services",
+    lifespan=lifespan,
 )
 
-MODEL_NAME = None
-MODEL = None
-
 
 # Define request and response models
 class Message(BaseModel):
@@ -47,6 +265,22 @@ class Message(BaseModel):
 class SetModel(BaseModel):
     model_name: str
     load_model_configs: Dict[str, Any] = dict()
+    # Block until the model is loaded instead of returning while it loads
+    wait: bool = False
+
+
+class PrefetchRequest(BaseModel):
+    # Defaults to the active model
+    model_name: Optional[str] = None
+
+
+class AutotuneRequest(BaseModel):
+    # Defaults to the active model
+    model_name: Optional[str] = None
+    # Benchmark again even if a result for this model and CPU is stored
+    force: bool = False
+    prompt_tokens: int = 256
+    decode_tokens: int = 32
 
 
 class ToolParameter(BaseModel):
@@ -72,6 +306,55 @@ class ChatCompletionRequest(BaseModel):
     stream: Optional[bool] = False
     inference_configs: Optional[Dict[str, Any]] = dict()
     load_model_configs: Optional[Dict[str, Any]] = dict()
+    # {"chunk_tokens": 4, "interval_ms": 30}: coalesce streamed tokens into frames
+    stream_options: Optional[Dict[str, Any]] = None
+    # Client-chosen id for /cancel/{request_id}; generated when omitted
+    request_id: Optional[str] = None
+    # "interactive" (default) or "background"; see REQUEST_CLASSES
+    request_class: Optional[str] = None
+    # Key for fair sharing of the queue; the X-Client-ID header, then the peer address
+    client_id: Optional[str] = None
+
+
+class BatchBranch(BaseModel):
+    # Appended to the batch's messages for this branch only
+    messages: List[Message] = Field(default_factory=list)
+    # Merged over the batch's inference_configs
+    inference_configs: Dict[str, Any] = Field(default_factory=dict)
+
+
+class BatchCompletionRequest(BaseModel):
+    model: str
+    # The conversation every branch continues
+    messages: List[Message]
+    branches: List[BatchBranch]
+    tools: Optional[List[Tool]] = None
+    inference_configs: Optional[Dict[str, Any]] = dict()
+    load_model_configs: Optional[Dict[str, Any]] = dict()
+    # Cancels every branch via /cancel/{request_id}
+    request_id: Optional[str] = None
+    request_class: Optional[str] = None
+    client_id: Optional[str] = None
+
+
+class OpenSessionRequest(BaseModel):
+    model: str
+    tools: Optional[List[Tool]] = None
+    # Initial history, e.g. the system prompt
+    messages: List[Message] = Field(default_factory=list)
+    load_model_configs: Optional[Dict[str, Any]] = dict()
+
+
+class SessionTurnRequest(BaseModel):
+    # Only the messages added since the session's first `base` messages
+    messages: List[Message]
+    base: int
+    stream: Optional[bool] = False
+    inference_configs: Optional[Dict[str, Any]] = dict()
+    stream_options: Optional[Dict[str, Any]] = None
+    request_id: Optional[str] = None
+    request_class: Optional[str] = None
+    client_id: Optional[str] = None
 
 
 class CompletionRequest(BaseModel):
@@ -94,6 +377,28 @@ class CompletionResponse(BaseModel):
     tool_calls: List[ToolCall] = Field(default_factory=list)
 
 
+class TokenizeRequest(BaseModel):
+    # Defaults to the active model
+    model: Optional[str] = None
+    # Raw text, or a conversation rendered with the model's chat template
+    text: Optional[str] = None
+    messages: Optional[List[Message]] = None
+    tools: Optional[List[Tool]] = None
+    add_generation_prompt: bool = True
+    # Raw text only: prepend the bos token
+    add_bos: bool = False
+
+
+class CountTokensRequest(BaseModel):
+    # Defaults to the active model
+    model: Optional[str] = None
+    messages: List[Message]
+    tools: Optional[List[Tool]] = None
+    add_generation_prompt: bool = True
+    # Also build the whole prompt and report its exact length
+    exact: bool = False
+
+
 class RestoreCacheRequest(BaseModel):
     messages: List[Message]
     tools: List[Tool]
@@ -101,50 +406,75 @@ class RestoreCacheRequest(BaseModel):
 
 
 class Cache:
+    # One StateCache per model cache directory, kept for the life of the process
+    _stores: Dict[str, StateCache] = {}
+
     def __init__(self, model: Llama):
         self.model = model
         self.cache_context = None
 
-    def get_cache_key(self, prompt: str):
+    def get_cache_key(self, prompt: Union[str, List[int]]):
+        if isinstance(prompt, list):
+            return prompt
         return self.model.tokenize(prompt.encode("utf-8"))
 
+    @staticmethod
+    def get_store(
+        cache_dir: str,
+        model_name: str,
+        capacity_bytes: int = 2 << 30,
+        ram_capacity_bytes: int = 512 << 20,
+    ) -> StateCache:
+        # Create a model-specific cache directory
+        model_specific_cache_dir = os.path.join(cache_dir, model_name)
+        store = Cache._stores.get(model_specific_cache_dir)
+        if store is None:
+            store = StateCache(
+                cache_dir=model_specific_cache_dir,
+                ram_capacity_bytes=ram_capacity_bytes,
+                disk_capacity_bytes=capacity_bytes,
+            )
+            Cache._stores[model_specific_cache_dir] = store
+        return store
+
     @staticmethod
     def build_cache(
         cache_dir: str,
-        prompts: str,
+        prompts: Union[str, List[int]],
         model: Llama,
         model_name: str,
         temperature: float = 0.0,
         capacity_bytes: int = 2 << 30,
         seed: Optional[int] = None,
+        ram_capacity_bytes: int = 512 << 20,
+        template_hash: str = "",
     ):
         cache = Cache(model)
         if seed:
             model.set_seed(seed)
-        
-        # Create a model-specific cache directory
-        model_specific_cache_dir = os.path.join(cache_dir, model_name)
-        os.makedirs(model_specific_cache_dir, exist_ok=True) # Ensure the directory exists
 
-        cache_context = LlamaDiskCache(cache_dir=model_specific_cache_dir)
-        model.set_cache(cache_context)
+        store = Cache.get_store(cache_dir, model_name, capacity_bytes, ram_capacity_bytes)
         prompt_tokens = cache.get_cache_key(prompts)
+        # States are only valid for the context size they were built with; the
+        # template hash keeps entries apart when a model's chat template changes
+        cache_key = StateCache.make_key(prompt_tokens, model.n_ctx(), template_hash)
 
-        try:
-            cached_state = cache_context[prompt_tokens]
+        cached_state = store.get(cache_key)
+        if cached_state is not None:
             return cached_state
-        except Exception as e:
-            # cache non exist
-            model.reset()
-            _ = model(
-                prompts,
-                max_tokens=1,  # Minimal tokens for cache creation
-                temperature=temperature,
-                echo=False,
-            )
-            # Save the state to cache
-            cache_context[prompt_tokens] = model.save_state()
-            return cache_context[prompt_tokens]
+
+        # cache non exist
+        model.reset()
+        _ = model(
+            prompts,
+            max_tokens=1,  # Minimal tokens for cache creation
+            temperature=temperature,
+            echo=False,
+        )
+        # Save the state to cache
+        state = compact_state(model.save_state())
+        store.put(cache_key, state)
+        return state
 
 
 @app.get("/")
@@ -154,7 +484,13 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    # A running load's progress walks /proc/self/smaps
+    loading = await asyncio.to_thread(MODEL_LOADER.loading)
     if MODEL is None:
+        if loading is not None:
+            raise HTTPException(
+                status_code=503, detail=f"LLM model {loading['model']} is loading"
+            )
         raise HTTPException(status_code=503, detail="LLM model not loaded")
     try:
         # Verify model is functioning properly
@@ -163,17 +499,148 @@ async def health_check():
                 "status": "warning",
                 "message": "LLM model loaded but no model name set",
             }
-        return {
+        status = {
             "status": "ok",
             "message": f"LLM Server is healthy, using model: {MODEL_NAME}",
+            "queue_depth": SCHEDULER.queue_depth,
+            # Effective context of the active model, which may be smaller than requested
+            "n_ctx": MODEL.n_ctx(),
         }
+        if MODEL_NAME in N_CTX_FITS:
+            status["n_ctx_fit"] = N_CTX_FITS[MODEL_NAME]
+        if loading is not None:
+            # The active model keeps serving until the new one is swapped in
+            status["loading"] = loading
+        status["warmup"] = WARMUP_STATUS
+        status["memory"] = await _cached_model_memory(MODEL_NAME)
+        return status
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail=f"Health check failed: {str(e)}")
 
 
+@app.get("/queue")
+async def queue_status():
+    return {**SCHEDULER.stats(), "cancellation": CANCELLATIONS.stats()}
+
+
+@app.get("/queue/{request_id}")
+async def queue_position(request_id: str):
+    """Whether a chat completion is running, or its queue position and estimated wait."""
+    info = SCHEDULER.queue_info(request_id)
+    if info is None:
+        raise HTTPException(
+            status_code=404, detail=f"Request '{request_id}' is not queued or running"
+        )
+    return {"request_id": request_id, **info}
+
+
+@app.post("/cancel/{request_id}")
+async def cancel_request(request_id: str):
+    if not CANCELLATIONS.cancel(request_id):
+        raise HTTPException(
+            status_code=404, detail=f"Request '{request_id}' is not in flight"
+        )
+    return {"status": "ok", "message": f"request {request_id} is cancelled"}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request phase histograms and server counters."""
+    pool = MODEL_POOL.stats()
+    prefix = (
+        MODEL.cache.stats()
+        if MODEL is not None and isinstance(MODEL.cache, PrefixStateCache)
+        else {"hits": 0, "misses": 0, "hit_rate": 0.0, "reused_tokens": 0}
+    )
+    # /restore_cache state stores, summed over models
+    ram_hits = disk_hits = misses = 0
+    for store in list(Cache._stores.values()):
+        store_stats = store.stats()
+        ram_hits += store_stats["ram_hits"]
+        disk_hits += store_stats["disk_hits"]
+        misses += store_stats["misses"]
+    lookups = ram_hits + disk_hits + misses
+    response_cache = RESPONSE_CACHE.stats()
+
+    samples = [
+        ("llm_active_n_ctx", "Context size of the active model", "gauge",
+         MODEL.n_ctx() if MODEL is not None else 0),
+        ("llm_queue_depth", "Inference jobs waiting for the worker", "gauge",
+         SCHEDULER.queue_depth),
+        ("llm_inference_slots", "Inference slots (contexts per model)", "gauge",
+         SCHEDULER.n_slots),
+        ("llm_busy_slots", "Inference slots running a job", "gauge",
+         SCHEDULER.stats()["busy_slots"]),
+        ("llm_open_sessions", "Sessions holding a conversation server-side", "gauge",
+         SESSIONS.stats()["open"]),
+        ("llm_rejected_jobs_total", "Jobs rejected because the queue was full", "counter",
+         SCHEDULER.rejected_jobs),
+        ("llm_resident_models", "Models loaded in the pool", "gauge",
+         len(pool["resident_models"])),
+        ("llm_resident_model_bytes", "Estimated RAM of resident models", "gauge",
+         pool["resident_bytes"]),
+        ("llm_cancelled_requests_total", "Requests cancelled by disconnect or /cancel", "counter",
+         CANCELLATIONS.stats()["cancelled_requests"]),
+        ("llm_prefix_cache_hits_total", "Prefix cache lookups that reused a state", "counter",
+         prefix["hits"]),
+        ("llm_prefix_cache_misses_total", "Prefix cache lookups without a usable state", "counter",
+         prefix["misses"]),
+        ("llm_prefix_cache_hit_rate", "Prefix cache hit rate on the active model", "gauge",
+         prefix["hit_rate"]),
+        ("llm_prefix_cache_reused_tokens_total", "Prompt tokens restored instead of evaluated",
+         "counter", prefix["reused_tokens"]),
+        ("llm_state_cache_misses_total", "restore_cache state store misses", "counter", misses),
+        ("llm_response_cache_hits_total", "Chat completions answered from the response cache",
+         "counter", response_cache["hits"]),
+        ("llm_response_cache_misses_total", "Cacheable chat completions that had to run",
+         "counter", response_cache["misses"]),
+        ("llm_response_cache_hit_rate", "Response cache hit rate", "gauge",
+         response_cache["hit_rate"]),
+        ("llm_state_cache_hit_rate", "restore_cache state store hit rate", "gauge",
+         round((ram_hits + disk_hits) / lookups, 3) if lookups else 0.0),
+    ]
+    lines = METRICS.render()
+    for name, help, kind, value in samples:
+        lines += render_sample(name, help, kind, value)
+    lines += [
+        "# HELP llm_state_cache_hits_total restore_cache state store hits by tier",
+        "# TYPE llm_state_cache_hits_total counter",
+        f'llm_state_cache_hits_total{{tier="ram"}} {ram_hits}',
+        f'llm_state_cache_hits_total{{tier="disk"}} {disk_hits}',
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache")
+async def cache_status():
+    status = {"prefix_cache": {"enabled": False}, "state_cache": {"enabled": False}}
+    if MODEL is not None and isinstance(MODEL.cache, PrefixStateCache):
+        status["prefix_cache"] = {"enabled": True, "model": MODEL_NAME, **MODEL.cache.stats()}
+    if PROMPT_BUILDER is not None:
+        status["prompt_builder"] = PROMPT_BUILDER.stats()
+    status["tool_grammars"] = TOOL_GRAMMARS.stats()
+    status["gguf_index"] = GGUF_INDEX.stats()
+    status["response_cache"] = RESPONSE_CACHE.stats()
+    status["token_counts"] = TOKEN_COUNTER.stats()
+    if MODEL_NAME is not None:
+        store = Cache._stores.get(os.path.join(STATE_CACHE_DIR, MODEL_NAME))
+        if store is not None:
+            status["state_cache"] = {"enabled": True, "model": MODEL_NAME, **store.stats()}
+    return status
+
+
+@app.delete("/cache/responses")
+async def clear_response_cache():
+    return {"status": "ok", "cleared": RESPONSE_CACHE.clear()}
+
+
 @app.get("/models")
-async def list_models():
+async def list_models(n_ctx: Optional[int] = None, kv_cache: str = "f16"):
+    try:
+        kv_cache = kv_cache_type(kv_cache)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         path = os.path.join(os.path.dirname(__file__), "models")
         model_names = [
@@ -181,101 +648,832 @@ async def list_models():
             for f in os.listdir(path)
             if os.path.isfile(os.path.join(path, f)) and f.endswith(".gguf")
         ]
-        return {"models": [m for m in model_names]}
+        # Header parsing only happens for new or changed files
+        infos = await asyncio.to_thread(GGUF_INDEX.describe_dir, path, model_names)
+        estimate_n_ctx = n_ctx or DEFAULT_N_CTX
+        details = {}
+        for name, info in infos.items():
+            details[name] = dict(info)
+            if "error" not in info:
+                details[name]["estimated_ram_bytes"] = estimate_ram_bytes(
+                    info, estimate_n_ctx, kv_cache, kv_cache
+                )
+        resident = {}
+        for name, info in MODEL_POOL.resident().items():
+            resident[name] = {
+                **info,
+                **({"n_ctx_fit": N_CTX_FITS[name]} if name in N_CTX_FITS else {}),
+                "memory": await _cached_model_memory(name),
+            }
+        return {
+            "models": [m for m in model_names],
+            "details": details,
+            "n_ctx": estimate_n_ctx,
+            "kv_cache": kv_cache,
+            "active": MODEL_NAME,
+            "resident": resident,
+            "pool": MODEL_POOL.stats(),
+        }
     except Exception as e:
         logger.error(f"Error listing models: {e}")
         raise HTTPException(status_code=500, detail=f"Error listing models: {str(e)}")
 
 
+@app.get("/prefetch")
+async def prefetch_status():
+    return PREFETCHER.stats()
+
+
+@app.post("/prefetch")
+async def prefetch_model(request: PrefetchRequest):
+    """Read a model file into the page cache in the background, e.g. the model a
+    /setModel is about to switch to, so its load does not wait on storage."""
+    model_name = request.model_name or MODEL_NAME
+    if model_name is None:
+        raise HTTPException(status_code=400, detail="No model_name given and no model loaded")
+    model_path = _model_path(model_name)
+    if not os.path.isfile(model_path):
+        raise HTTPException(
+            status_code=404, detail=f"Model '{model_name}' not found in models directory"
+        )
+    task = PREFETCHER.start(model_path)
+    memory = await asyncio.to_thread(_model_memory, model_name)
+    MODEL_MEMORY[model_name] = (time.monotonic(), memory)
+    return {"status": "ok", "prefetch": task.progress(), "memory": memory}
+
+
 @app.post("/setModel")
 async def set_model(request: SetModel):
     try:
-        load_model(request.model_name, request.load_model_configs)
-        return {"status": "ok", "message": "model is change to " + request.model_name}
+        resident = MODEL_POOL.get(request.model_name)
+        if (
+            request.model_name == MODEL_NAME
+            and resident is not None
+            and resident.matches(request.load_model_configs)
+        ):
+            return {
+                "status": "ok",
+                "message": "model is change to " + request.model_name,
+                "n_ctx": MODEL.n_ctx(),
+            }
+        task = MODEL_LOADER.start(
+            request.model_name, _model_path(request.model_name), request.load_model_configs
+        )
+        if request.wait:
+            await asyncio.shield(task.future)
+            return {
+                "status": "ok",
+                "message": "model is change to " + request.model_name,
+                "n_ctx": MODEL.n_ctx(),
+            }
+        return {
+            "status": "loading",
+            "message": f"loading {request.model_name}, {MODEL_NAME} serves requests until it is ready",
+            "loading": task.progress(),
+        }
+    except QueueFullError as e:
+        logger.warning(f"Rejected setModel request: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        logger.error(f"Error setting model: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.error(f"Error setting model: {e}")
         raise HTTPException(status_code=500, detail=f"Error set models: {str(e)}")
 
 
+def _fit_n_ctx(model_path: str, n_ctx: int, type_k: str, type_v: str) -> int:
+    """The largest n_ctx up to the requested one whose KV cache fits in free RAM."""
+    if not os.path.exists(model_path):
+        # The fake backend has no file to size
+        return n_ctx
+    info = GGUF_INDEX.get(model_path)
+    fitted, report = fit_n_ctx(
+        n_ctx,
+        info.get("file_bytes", 0),
+        kv_cache_bytes_per_token(info.get("kv_bytes_per_token", 0), type_k, type_v),
+        available_ram_bytes(),
+        RAM_RESERVE_BYTES,
+        n_contexts=SCHEDULER.n_slots,
+        trained_n_ctx=info.get("context_length"),
+    )
+    report.update(type_k=type_k, type_v=type_v)
+    N_CTX_FITS[os.path.basename(model_path)] = report
+    if fitted != n_ctx:
+        logger.info(
+            f"n_ctx {n_ctx} -> {fitted} for {os.path.basename(model_path)} "
+            f"(limited by {report['limited_by']}, {report['available_bytes'] >> 20} MB available)"
+        )
+    return fitted
+
+
+def _construct_model(model_path: str, load_model_configs: dict[str, Any]) -> Llama:
+    """Create a Llama instance; called by MODEL_POOL when a model is not resident."""
+    started = time.monotonic()
+    n_ctx = load_model_configs.get("n_ctx", DEFAULT_N_CTX)
+    type_k = kv_cache_type(load_model_configs.get("type_k", DEFAULT_TYPE_K))
+    type_v = kv_cache_type(load_model_configs.get("type_v", DEFAULT_TYPE_V))
+    if load_model_configs.get("fit_n_ctx", FIT_N_CTX):
+        n_ctx = _fit_n_ctx(str(model_path), n_ctx, type_k, type_v)
+    draft = make_draft(
+        load_model_configs.get("speculative", DEFAULT_SPECULATIVE),
+        os.path.dirname(str(model_path)),
+        n_ctx,
+    )
+    options = {}
+    if load_model_configs.get("autotune", True):
+        options = TUNING.options(str(model_path))
+    # Explicit load configs override the tuned values
+    options.update({key: load_model_configs[key] for key in TUNED_KEYS if key in load_model_configs})
+    use_mmap = load_model_configs.get("use_mmap", DEFAULT_USE_MMAP)
+    use_mlock = load_model_configs.get("use_mlock", DEFAULT_USE_MLOCK)
+    if not use_mmap:
+        options["use_mmap"] = False
+    if use_mlock:
+        options["use_mlock"] = True
+        limit = mlock_limit_bytes()
+        if limit is not None and limit < model_file_bytes(str(model_path)):
+            # llama.cpp then only warns and leaves the weights pageable
+            logger.warning(
+                f"RLIMIT_MEMLOCK is {limit >> 20} MB, too small to lock "
+                f"{os.path.basename(str(model_path))}; raise it with ulimit -l"
+            )
+    if type_k != "f16":
+        options["type_k"] = KV_CACHE_TYPES[type_k][0]
+    if type_v != "f16":
+        options["type_v"] = KV_CACHE_TYPES[type_v][0]
+        # llama.cpp only quantizes the V cache with flash attention
+        options["flash_attn"] = True
+    if options:
+        logger.info(f"Loading {os.path.basename(str(model_path))} with {options}")
+    model = BACKEND.load(str(model_path), n_ctx, draft=draft, **options)
+    if PREFIX_CACHE_ENTRIES > 0 and PREFIX_CACHE_BYTES > 0:
+        # llama-cpp-python consults this before every completion and stores the
+        # final state after it, so later turns only evaluate their new suffix
+        # The fake backend has no KV metadata but simulates a state size per token
+        state_bytes_per_token = kv_bytes_per_context_token(model) or getattr(
+            model, "state_bytes_per_token", 0
+        )
+        model.set_cache(
+            PrefixStateCache(
+                max_entries=PREFIX_CACHE_ENTRIES,
+                capacity_bytes=PREFIX_CACHE_BYTES,
+                state_bytes_per_token=state_bytes_per_token,
+            )
+        )
+    METRICS.observe_model_load(os.path.basename(str(model_path)), time.monotonic() - started)
+    return model
+
+
+def _tune_model(model_path: str, prompt_tokens: int, decode_tokens: int) -> Dict[str, Any]:
+    """Benchmark the model over the thread and batch size grid and store the fastest
+    choice. Loads one plain context at a time next to the resident models."""
+    n_ctx = prompt_tokens + decode_tokens + 64
+    logger.info(f"Auto-tuning {os.path.basename(model_path)} on {TUNING.cpu['model']}")
+    started = time.monotonic()
+    result = autotune(
+        lambda options: BACKEND.load(model_path, n_ctx, **options),
+        thread_candidates(TUNING.cpu["usable_cpus"]),
+        prompt_tokens=prompt_tokens,
+        decode_tokens=decode_tokens,
+    )
+    result["elapsed_s"] = round(time.monotonic() - started, 3)
+    logger.info(
+        f"Auto-tuned {os.path.basename(model_path)} in {result['elapsed_s']:.1f}s: "
+        f"{result['options']} ({result['prompt_tokens_per_s']} prompt tokens/s, "
+        f"{result['decode_tokens_per_s']} decode tokens/s)"
+    )
+    return TUNING.put(model_path, result)
+
+
+# Loaded models kept resident for fast switching; MODEL points at the active one
+MODEL_POOL = ModelPool(_construct_model)
+
+
+def _model_path(model_name: str) -> str:
+    return os.path.join(os.path.dirname(__file__), "models", model_name)
+
+
+def _model_memory(model_name: str) -> Dict[str, Any]:
+    """How much of a model's file this process maps and has resident, and how
+    much of it the page cache holds (what a load or page fault would not read).
+    Walks /proc/self/smaps and mincore()s the whole file, so never call it on
+    the event loop."""
+    model_path = _model_path(model_name)
+    memory = {"file_bytes": model_file_bytes(model_path), **file_mapping_bytes(model_path)}
+    memory["page_cache_bytes"] = page_cache_bytes(model_path)
+    return memory
+
+
+async def _cached_model_memory(model_name: str) -> Dict[str, Any]:
+    """_model_memory() for /health and /models, recomputed on a worker thread at
+    most every MODEL_MEMORY_TTL_S so frequent polls stay cheap."""
+    cached = MODEL_MEMORY.get(model_name)
+    if cached is not None and time.monotonic() - cached[0] < MODEL_MEMORY_TTL_S:
+        return cached[1]
+    memory = await asyncio.to_thread(_model_memory, model_name)
+    MODEL_MEMORY[model_name] = (time.monotonic(), memory)
+    return memory
+
+
 def load_model(model_name, load_model_configs: dict[str, Any]):
     global MODEL
     global MODEL_NAME
-    model_path = os.path.join(os.path.dirname(__file__), "models", model_name)
-    if not os.path.exists(model_path):
+    global PROMPT_BUILDER
+    model_path = _model_path(model_name)
+    if not BACKEND.model_exists(model_path):
         raise ValueError(f"Model '{model_name}' not found in models directory")
 
-    MODEL = Llama(
-        model_path=str(model_path),
-        verbose=False,
-        n_gpu_layers=0,
-        n_ctx=load_model_configs["n_ctx"],
-    )
+    resident = MODEL_POOL.acquire(model_name, model_path, load_model_configs)
+    resident.ensure_contexts(SCHEDULER.n_slots, BACKEND.fork)
+    SCHEDULER.assign_models(resident.contexts)
+    MODEL = resident.model
+    PROMPT_BUILDER = resident.prompt_builder
 
     MODEL_NAME = model_name
-    logger.info(f"Loaded model: {model_name}")
+    logger.info(f"Active model: {model_name}")
     return True
 
 
-def _chat_completion(messages, tools, inference_configs):
-    """Non-streaming version"""
-    logger.debug("Generating non-streaming chat completion...")
-    response = MODEL.create_chat_completion(
-        messages=messages,
-        tools=tools,
+# Background loads for /setModel and model switches in /chat/completions
+MODEL_LOADER = ModelLoader(
+    SCHEDULER, MODEL_POOL, activate=load_model, exists=lambda path: BACKEND.model_exists(path)
+)
+
+
+def _ensure_model(model_name, load_model_configs: dict[str, Any]):
+    """Make model_name the active model unless it already is. Runs on the inference
+    worker, so concurrent requests for the same model only trigger one load."""
+    if model_name is None or (model_name == MODEL_NAME and MODEL is not None):
+        return False
+    return load_model(model_name, load_model_configs)
+
+
+def _create_chat_completion(
+    model_name,
+    load_model_configs,
+    messages,
+    tools,
+    inference_configs,
+    stream,
+    cancel_token: Optional[CancelToken] = None,
+    timer: Optional[RequestTimer] = None,
+    slot: Optional[InferenceSlot] = None,
+    session: Optional[Session] = None,
+    resume: Optional[Dict[str, Any]] = None,
+):
+    """Run a chat completion on prompt tokens from PROMPT_BUILDER, so the cached
+    system/tools prefix is not re-rendered or re-tokenized on every request.
+    Generation uses the slot's context of the active model.
+
+    With a session, messages are the turn's new messages: they are appended to
+    the session's history and only they are tokenized.
+
+    Only completions given a resume dict can be preempted: their prompt tokens
+    are kept in it, and once the caller adds the generated "text" the same call
+    continues the completion (see _resume_completion())."""
+    if resume is not None and "text" in resume:
+        return _resume_completion(
+            model_name,
+            load_model_configs,
+            resume,
+            inference_configs,
+            stream,
+            cancel_token,
+            timer,
+            slot,
+        )
+    if timer is not None:
+        timer.start()
+    if cancel_token is not None and cancel_token.cancelled:
+        raise RequestCancelledError(
+            f"Request {cancel_token.request_id} was cancelled before it started"
+        )
+    # llama calls these after every sampled token
+    criteria = [c for c in (cancel_token, timer) if c is not None]
+    stopping_criteria = StoppingCriteriaList(criteria) if criteria else None
+    # Another request may have switched models since this one was queued;
+    # re-activating a resident model is a dictionary lookup
+    _ensure_model(model_name, load_model_configs)
+    model = _slot_model(slot)
+    if isinstance(model, SpeculativeLlama):
+        model.configure_draft(
+            inference_configs.get("speculative"), inference_configs.get("num_pred_tokens")
+        )
+    delta = None
+    if session is not None:
+        delta, messages = messages, session.messages + messages
+    if PROMPT_BUILDER is None or not PROMPT_BUILDER.available:
+        if session is not None:
+            session.commit(delta, None)
+        _never_preempt(cancel_token)
+        # No chat template in the model metadata: let llama-cpp pick a chat format
+        if timer is not None:
+            timer.start_generation()
+        completion_or_chunks = model.create_chat_completion(
+            messages=messages,
+            tools=tools,
+            temperature=inference_configs["temperature"],
+            max_tokens=inference_configs["max_tokens"],
+            top_k=inference_configs["top_k"],
+            top_p=inference_configs["top_p"],
+            min_p=inference_configs["min_p"],
+            repeat_penalty=inference_configs["repetition_penalty"],
+            stop=inference_configs["stop"],
+            stream=stream,
+            stopping_criteria=stopping_criteria,
+        )
+        return _with_context_report(completion_or_chunks, None, model.n_ctx())
+
+    render_s, tokenize_s = PROMPT_BUILDER.thread_seconds()
+    # Count prompt tokens before any eval and cut the conversation to fit n_ctx
+    max_tokens = inference_configs["max_tokens"] or 0
+    reserve_tokens = (
+        min(max_tokens, CONTEXT_RESERVE_TOKENS) if max_tokens > 0 else CONTEXT_RESERVE_TOKENS
+    )
+    session_tokens = None
+    if session is not None:
+        prompt_state, session_tokens = PROMPT_BUILDER.extend(session.prompt, messages, tools)
+        session.commit(delta, prompt_state)
+    full_messages = messages
+    fitter = ContextFitter(
+        lambda msgs: (
+            session_tokens
+            if session_tokens is not None and msgs is full_messages
+            else PROMPT_BUILDER.build(msgs, tools, add_generation_prompt=True)[1]
+        ),
+        model.n_ctx(),
+        reserve_tokens,
+    )
+    messages, prompt_tokens, context_report = fitter.fit(
+        messages, inference_configs.get("context_policy", CONTEXT_POLICY)
+    )
+    if timer is not None:
+        render_s_now, tokenize_s_now = PROMPT_BUILDER.thread_seconds()
+        timer.render_s = render_s_now - render_s
+        timer.tokenize_s = tokenize_s_now - tokenize_s
+        timer.start_generation(len(prompt_tokens))
+    stop = _stop_sequences(inference_configs)
+
+    grammar = (
+        TOOL_GRAMMARS.get(tools)
+        if tools and inference_configs.get("tool_grammar", TOOL_GRAMMAR)
+        else None
+    )
+    if grammar is not None:
+        _never_preempt(cancel_token)
+        # Free text until the model opens a <tool_call>, then grammar-constrained JSON
+        chunks = constrained_tool_completion(
+            model,
+            prompt_tokens,
+            grammar,
+            max_tokens=max_tokens,
+            stop=stop,
+            stopping_criteria=criteria,
+            cancel_token=cancel_token,
+            temperature=inference_configs["temperature"],
+            top_k=inference_configs["top_k"],
+            top_p=inference_configs["top_p"],
+            min_p=inference_configs["min_p"],
+            repeat_penalty=inference_configs["repetition_penalty"],
+            model=MODEL_NAME,
+        )
+        if stream:
+            return _with_context_report(
+                completion_chunks_to_chat(chunks), context_report, model.n_ctx()
+            )
+        completion = completion_to_chat(collect_completion(chunks, model, prompt_tokens))
+        return _with_context_report(completion, context_report, model.n_ctx())
+
+    if resume is not None:
+        resume["prompt_tokens"] = prompt_tokens
+    else:
+        _never_preempt(cancel_token)
+    completion_or_chunks = create_completion_within_budget(
+        model,
+        prompt_tokens,
         temperature=inference_configs["temperature"],
         max_tokens=inference_configs["max_tokens"],
         top_k=inference_configs["top_k"],
         top_p=inference_configs["top_p"],
         min_p=inference_configs["min_p"],
         repeat_penalty=inference_configs["repetition_penalty"],
-        stop=inference_configs["stop"],
-        stream=False,
+        stop=stop,
+        stream=stream,
+        stopping_criteria=stopping_criteria,
+        # Report the model file name rather than its full path
+        model=MODEL_NAME,
+    )
+    if stream:
+        return _with_context_report(
+            completion_chunks_to_chat(completion_or_chunks), context_report, model.n_ctx()
+        )
+    return _with_context_report(
+        completion_to_chat(completion_or_chunks), context_report, model.n_ctx()
     )
-    return response
 
 
-def _stream_chat_completion(messages, tools, inference_configs):
-    """Streaming version"""
-    logger.debug("Generating streaming chat completion...")
-    response_stream = MODEL.create_chat_completion(
-        messages=messages,
-        tools=tools,
+def _never_preempt(cancel_token: Optional[CancelToken]):
+    """Drop the token budget of a completion that could not be resumed."""
+    if cancel_token is not None:
+        cancel_token.set_budget(0, None)
+
+
+def _resume_completion(
+    model_name,
+    load_model_configs,
+    resume: Dict[str, Any],
+    inference_configs,
+    stream,
+    cancel_token: CancelToken,
+    timer: Optional[RequestTimer] = None,
+    slot: Optional[InferenceSlot] = None,
+):
+    """Continue a preempted completion from its prompt plus the text it had
+    generated. The slot that ran it usually still holds those tokens in its KV
+    cache (otherwise the prefix cache does), so little is evaluated again. Only
+    the rest of max_tokens is generated, and a stream skips its role chunk."""
+    if cancel_token.cancelled:
+        raise RequestCancelledError(
+            f"Request {cancel_token.request_id} was cancelled before it resumed"
+        )
+    _ensure_model(model_name, load_model_configs)
+    model = _slot_model(slot)
+    if isinstance(model, SpeculativeLlama):
+        model.configure_draft(
+            inference_configs.get("speculative"), inference_configs.get("num_pred_tokens")
+        )
+    generated = model.tokenize(resume["text"].encode("utf-8"), add_bos=False, special=True)
+    max_tokens = inference_configs["max_tokens"] or 0
+    if max_tokens > 0:
+        max_tokens = max(max_tokens - cancel_token.generated_tokens, 1)
+    completion_or_chunks = create_completion_within_budget(
+        model,
+        list(resume["prompt_tokens"]) + list(generated),
         temperature=inference_configs["temperature"],
-        max_tokens=inference_configs["max_tokens"],
+        max_tokens=max_tokens,
         top_k=inference_configs["top_k"],
         top_p=inference_configs["top_p"],
         min_p=inference_configs["min_p"],
         repeat_penalty=inference_configs["repetition_penalty"],
-        stop=inference_configs["stop"],
+        stop=_stop_sequences(inference_configs),
+        stream=stream,
+        stopping_criteria=StoppingCriteriaList(
+            [c for c in (cancel_token, timer) if c is not None]
+        ),
+        model=MODEL_NAME,
+    )
+    if stream:
+        return itertools.islice(completion_chunks_to_chat(completion_or_chunks), 1, None)
+    return completion_to_chat(completion_or_chunks)
+
+
+def _append_completion(
+    completion: Dict[str, Any], continuation: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Fold the completion of a resumed request into what it generated before."""
+    choice, rest = completion["choices"][0], continuation["choices"][0]
+    choice["message"]["content"] = (choice["message"]["content"] or "") + (
+        rest["message"]["content"] or ""
+    )
+    choice["finish_reason"] = rest["finish_reason"]
+    added = continuation["usage"]["completion_tokens"]
+    completion["usage"]["completion_tokens"] += added
+    completion["usage"]["total_tokens"] += added
+    return completion
+
+
+def _stop_sequences(inference_configs) -> List[str]:
+    """The request's stop strings plus the template's end-of-turn token."""
+    stop = inference_configs["stop"]
+    stop = [] if stop is None else [stop] if isinstance(stop, str) else list(stop)
+    if PROMPT_BUILDER.eos_token:
+        stop.append(PROMPT_BUILDER.eos_token)
+    return stop
+
+
+def _with_context_report(
+    completion_or_chunks, context_report: Optional[Dict[str, Any]], n_ctx: int
+):
+    """Attach the model's effective n_ctx and what the context policy cut to the
+    response (the first chunk when streaming), so clients can budget history."""
+
+    def annotate(completion: Dict[str, Any]):
+        completion["n_ctx"] = n_ctx
+        if context_report is not None:
+            completion["context"] = context_report
+
+    if isinstance(completion_or_chunks, dict):
+        annotate(completion_or_chunks)
+        return completion_or_chunks
+
+    def chunks():
+        for i, chunk in enumerate(completion_or_chunks):
+            if i == 0:
+                annotate(chunk)
+            yield chunk
+
+    return chunks()
+
+
+def _chat_completion(
+    model_name,
+    load_model_configs,
+    messages,
+    tools,
+    inference_configs,
+    cancel_token=None,
+    timer=None,
+    slot=None,
+    session=None,
+    resume=None,
+):
+    """Non-streaming version"""
+    logger.debug("Generating non-streaming chat completion...")
+    # Switch models first so the acceptance counters below are the right model's
+    _ensure_model(model_name, load_model_configs)
+    model = _slot_model(slot)
+    before = _speculative_counts(model)
+    response = _create_chat_completion(
+        model_name,
+        load_model_configs,
+        messages,
+        tools,
+        inference_configs,
+        stream=False,
+        cancel_token=cancel_token,
+        timer=timer,
+        slot=slot,
+        session=session,
+        resume=resume,
+    )
+    if before is not None:
+        response["speculative"] = _speculative_usage(model, before)
+    return response
+
+
+def _slot_model(slot: Optional[InferenceSlot]) -> Llama:
+    """The active model's context for slot (the model itself outside slot jobs)."""
+    if slot is not None and slot.model is not None:
+        return slot.model
+    return MODEL
+
+
+def _slot_key(messages, tools) -> List[str]:
+    """What a request puts at the front of the KV cache, for slot affinity."""
+    return [content_hash(tools)] + [content_hash(message) for message in messages]
+
+
+def _speculative_counts(model):
+    if not isinstance(model, SpeculativeLlama):
+        return None
+    stats = model.speculative_stats()
+    return stats["drafted_tokens"], stats["accepted_tokens"], stats["verify_steps"]
+
+
+def _speculative_usage(model, before) -> Dict[str, Any]:
+    """Draft acceptance for the completion that ran since _speculative_counts()."""
+    drafted, accepted, steps = (
+        now - then for now, then in zip(_speculative_counts(model) or before, before)
+    )
+    return {
+        "drafted_tokens": drafted,
+        "accepted_tokens": accepted,
+        "verify_steps": steps,
+        "acceptance_rate": round(accepted / drafted, 3) if drafted else 0.0,
+    }
+
+
+def _stream_chat_completion(
+    model_name,
+    load_model_configs,
+    messages,
+    tools,
+    inference_configs,
+    cancel_token=None,
+    timer=None,
+    slot=None,
+    session=None,
+    resume=None,
+):
+    """Streaming version: yields chat completion chunks, then DONE_FRAME. They are
+    coalesced and encoded into SSE frames on the event loop (see _sse_frames()).
+
+    If the generation is preempted, its finish chunk and [DONE] are held back:
+    the finish chunk and the text so far go into resume, and the caller requeues
+    the request to stream the rest."""
+    logger.debug("Generating streaming chat completion...")
+    if cancel_token is not None and cancel_token.cancelled:
+        # Cancelled while queued: end the stream without generating
+        yield DONE_FRAME
+        return
+    response_stream = _create_chat_completion(
+        model_name,
+        load_model_configs,
+        messages,
+        tools,
+        inference_configs,
         stream=True,
+        cancel_token=cancel_token,
+        timer=timer,
+        slot=slot,
+        session=session,
+        resume=resume,
     )
 
+    model = _slot_model(slot)
+    before = _speculative_counts(model)
     chunk_count = 0
+    text = [resume.get("text", "")] if resume is not None else []
     for chunk in response_stream:
         chunk_count += 1
-        # Convert dictionary to JSON string before yielding
-        yield f"data: {json.dumps(chunk)}\n\n"
+        choice = chunk["choices"][0] if chunk.get("choices") else {}
+        if resume is not None:
+            text.append((choice.get("delta") or {}).get("content") or "")
+        if cancel_token is not None and cancel_token.cancelled:
+            if (
+                cancel_token.preempted
+                and resume is not None
+                and "prompt_tokens" in resume
+                and choice.get("finish_reason") is not None
+            ):
+                resume["text"] = "".join(text)
+                resume["finish_chunk"] = chunk
+                logger.debug(f"Stream preempted after {chunk_count} chunks; requeueing.")
+                return
+            _mark_cancelled(chunk, cancel_token)
+        yield chunk
+    yield DONE_FRAME
     logger.debug(f"Streaming finished after {chunk_count} chunks.")
+    if before is not None:
+        logger.debug(f"Speculative decoding: {_speculative_usage(model, before)}")
+
+
+def _sse_frames(chunks, stream_options: Optional[Dict[str, Any]] = None):
+    """Coalesce streamed chunks per stream_options and encode them as compact SSE
+    frames. Runs on the event loop, so the interval is a real deadline: pending
+    text is sent once it is that old, even while the next token is computed."""
+    stream_options = stream_options or {}
+    chunk_tokens = int(stream_options.get("chunk_tokens", STREAM_CHUNK_TOKENS))
+    interval_s = float(stream_options.get("interval_ms", STREAM_INTERVAL_MS)) / 1000.0
+    # Serialized with the fastest available encoder (orjson when installed)
+    return encode_frames(coalesce_chunks(chunks, chunk_tokens, interval_s))
+
+
+def _mark_cancelled(completion: Dict[str, Any], cancel_token: CancelToken):
+    for choice in completion.get("choices", []):
+        if choice.get("finish_reason") is not None:
+            choice["finish_reason"] = _stop_outcome(cancel_token)
+
+
+def _stop_outcome(cancel_token: CancelToken, outcome: str = "ok") -> str:
+    """How a request ended: preempted, cancelled or the given outcome."""
+    if cancel_token.preempted:
+        return PREEMPTED
+    return "cancelled" if cancel_token.cancelled else outcome
+
+
+async def _cancel_on_disconnect(http_request: Request, cancel_token: CancelToken):
+    """Cancel the generation once the client disconnects. The request body has
+    already been read, so the next ASGI message is the disconnect."""
+    while not cancel_token.cancelled:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            CANCELLATIONS.cancel(cancel_token.request_id, "client disconnected")
+            return
+
+
+async def _stream_with_cancellation(
+    frames,
+    cancel_token: CancelToken,
+    timer: RequestTimer,
+    session: Optional[Session] = None,
+    cache_key: Optional[str] = None,
+    resume: Optional[Dict[str, Any]] = None,
+    requeue: Optional[Callable[[], Any]] = None,
+):
+    """Relay SSE frames; if the response is torn down early (client disconnect),
+    stop the generation at its next token. Ends the session's turn, if any.
+    With a cache_key, a stream that completes is kept in RESPONSE_CACHE.
+
+    A preempted stream ends without its finish chunk (kept in resume); requeue()
+    then queues the rest of it, whose frames are relayed in the same response."""
+    completed = False
+    outcome = "cancelled"
+    sent_frames = [] if cache_key is not None else None
+    try:
+        while frames is not None:
+            async for frame in frames:
+                # The generator resumes once the frame has been written to the socket
+                sent_at = time.monotonic()
+                yield frame
+                timer.sse_write_s += time.monotonic() - sent_at
+                if sent_frames is not None:
+                    sent_frames.append(frame)
+            frames = None
+            finish_chunk = resume.pop("finish_chunk", None) if resume is not None else None
+            if finish_chunk is None:
+                break
+            # Preempted: continue behind the work that preempted it
+            if cancel_token.resume():
+                try:
+                    frames = requeue()
+                    continue
+                except QueueFullError:
+                    cancel_token.cancel(PREEMPTED)
+            _mark_cancelled(finish_chunk, cancel_token)
+            frames = _replay_frames([encode_frame(finish_chunk), DONE_FRAME])
+        completed = True
+        outcome = _stop_outcome(cancel_token)
+        if outcome == "ok" and sent_frames is not None:
+            RESPONSE_CACHE.put(cache_key, sent_frames)
+    except RequestCancelledError as e:
+        # Cancelled before it reached a slot: nothing was generated
+        logger.info(str(e))
+        completed = True
+        yield DONE_FRAME
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        if not completed:
+            cancel_token.cancel("client disconnected")
+        CANCELLATIONS.finish(cancel_token)
+        METRICS.observe_request(timer, outcome)
+        if session is not None:
+            SESSIONS.end_turn(session)
+
+
+async def _replay_frames(frames: List[bytes]):
+    for frame in frames:
+        yield frame
+
+
+def _response_cache_key(
+    model_name: str,
+    load_model_configs: Dict[str, Any],
+    messages,
+    tools,
+    request,
+    session: Optional[Session],
+) -> Optional[str]:
+    """Cache key of a deterministic request, or None if its response is not cached.
+
+    Session turns change the session, so they always run.
+    """
+    inference_configs = request.inference_configs or {}
+    if (
+        not RESPONSE_CACHE.enabled
+        or session is not None
+        or inference_configs.get("temperature") != 0
+        or not inference_configs.get("response_cache", True)
+    ):
+        return None
+    return response_key(
+        model=model_name,
+        load_model_configs=load_model_configs,
+        messages=messages,
+        tools=tools,
+        inference_configs={k: v for k, v in inference_configs.items() if k != "response_cache"},
+        stream=bool(request.stream),
+        # Streams are kept as frames, which depend on how tokens were coalesced
+        stream_options=request.stream_options if request.stream else None,
+    )
+
+
+def _append_line(path: str, line: str):
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        logger.warning(f"Could not record request to {path}: {e}")
+
+
+async def _record_request(request: ChatCompletionRequest):
+    """Append the request body to RECORD_REQUESTS_PATH as one JSON line, off the event loop."""
+    line = json.dumps(request.model_dump(exclude_none=True), ensure_ascii=False) + "\n"
+    async with RECORD_LOCK:
+        await asyncio.to_thread(_append_line, RECORD_REQUESTS_PATH, line)
 
 
 def format_prompt(messages, tools):
     # Actual input received by the model
-    model_template = MODEL.metadata.get("tokenizer.chat_template")
-    template = Template(model_template)
     logger.debug(
         f"format_prompt called with {len(messages)} messages and {len(tools) if tools else 0} tools."
     )
-    rendered_prompt = template.render(messages=messages, tools=tools)
-    # logger.debug(f"MODEL.chat_handler: {MODEL.chat_handler}")
-    # rendered_prompt = MODEL.chat_handler(llama=MODEL, messages=messages, tools=tools)
-    # rendered_prompt = FORMATTER(messages=messages, tools=tools).prompt
-    # logger.debug(
-    #     "Actual prompt into llm:\n"
-    #     + rendered_prompt
-    # )
+    rendered_prompt, _ = PROMPT_BUILDER.build(messages, tools, add_generation_prompt=False)
     return rendered_prompt
 
 
+def tokenize_prompt(messages, tools, add_generation_prompt: bool = False) -> List[int]:
+    """Prompt tokens for messages/tools; only the conversation tail is tokenized
+    when the system/tools prefix has been seen before."""
+    _, prompt_tokens = PROMPT_BUILDER.build(
+        messages, tools, add_generation_prompt=add_generation_prompt
+    )
+    return prompt_tokens
+
+
 def format_messages(messages):
     # if tool_call is None, remove it
     formatted_messages = []
@@ -303,6 +1501,103 @@ def format_tools(tools):
     return t_tools
 
 
+def _restore_cache(messages, tools, temperature):
+    """Build (or load) the prompt cache for messages/tools. Runs on the inference worker."""
+    prompt_tokens = tokenize_prompt(messages, tools)
+    cache_context = Cache.build_cache(
+        cache_dir=STATE_CACHE_DIR,
+        prompts=prompt_tokens,
+        model=MODEL,
+        model_name=MODEL_NAME,
+        temperature=temperature,
+        capacity_bytes=STATE_CACHE_DISK_BYTES,
+        ram_capacity_bytes=STATE_CACHE_RAM_BYTES,
+        template_hash=PROMPT_BUILDER.template_hash,
+    )
+    MODEL.load_state(cache_context)
+    if isinstance(MODEL.cache, PrefixStateCache):
+        MODEL.cache[cache_context.input_ids[: cache_context.n_tokens]] = cache_context
+    return cache_context.n_tokens
+
+
+async def _warmup_from_spec(path: str):
+    """Pre-evaluate the warmup spec's prefix for the active model in the background.
+
+    The state is stored in the /restore_cache state store, keyed by model (cache
+    directory), chat template hash and prefix tokens, so on the next boot this is
+    a disk read instead of a full prompt evaluation.
+    """
+    global WARMUP_STATUS
+    spec = load_warmup_spec(path)
+    if spec is None:
+        WARMUP_STATUS = {"state": "no_spec", "path": path}
+        return
+    if MODEL is None:
+        WARMUP_STATUS = {"state": "skipped", "path": path, "error": "no model loaded"}
+        return
+    try:
+        request = RestoreCacheRequest(messages=spec[0], tools=spec[1])
+        messages = format_messages(request.messages)
+        tools = format_tools(request.tools)
+    except Exception as e:
+        logger.warning(f"Invalid warmup spec {path}: {e}")
+        WARMUP_STATUS = {"state": "failed", "path": path, "error": str(e)}
+        return
+
+    WARMUP_STATUS = {"state": "running", "path": path, "model": MODEL_NAME}
+    start = time.monotonic()
+    try:
+        n_tokens = await SCHEDULER.submit(
+            _restore_cache, messages, tools, 0.0, priority=PRIORITY_HIGH
+        )
+    except Exception as e:
+        logger.error(f"Boot warmup failed: {e}")
+        WARMUP_STATUS = {"state": "failed", "path": path, "error": str(e)}
+        return
+    elapsed = time.monotonic() - start
+    WARMUP_STATUS = {
+        "state": "ready",
+        "path": path,
+        "model": MODEL_NAME,
+        "prefix_tokens": int(n_tokens),
+        "elapsed_s": round(elapsed, 3),
+    }
+    logger.info(f"Boot warmup ready: {n_tokens} prefix tokens in {elapsed:.2f}s")
+
+
+@app.get("/autotune")
+async def autotune_status():
+    return {**TUNING.stats(), "models": TUNING.list()}
+
+
+@app.post("/autotune")
+async def autotune_model(request: AutotuneRequest):
+    model_name = request.model_name or MODEL_NAME
+    if model_name is None:
+        raise HTTPException(status_code=400, detail="No model_name given and no model is active")
+    model_path = _model_path(model_name)
+    if not BACKEND.model_exists(model_path):
+        raise HTTPException(status_code=404, detail=f"Model '{model_name}' not found in models directory")
+    if request.prompt_tokens < 16 or request.decode_tokens < 1:
+        raise HTTPException(status_code=400, detail="prompt_tokens must be >= 16 and decode_tokens >= 1")
+    entry = await asyncio.to_thread(TUNING.get, model_path)
+    if entry is not None and not request.force:
+        return {"status": "ok", "tuned": False, "model": model_name, **entry}
+    try:
+        # Runs alone on the inference worker, so no generation skews the timings
+        entry = await SCHEDULER.submit(
+            _tune_model, model_path, request.prompt_tokens, request.decode_tokens
+        )
+    except QueueFullError as e:
+        logger.warning(f"Rejected autotune request: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error auto-tuning {model_name}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error auto-tuning model: {str(e)}")
+    # Resident models keep the options they were loaded with until they are reloaded
+    return {"status": "ok", "tuned": True, "model": model_name, **entry}
+
+
 @app.post("/restore_cache")
 async def restore_cache(request: RestoreCacheRequest):
     global MODEL
@@ -312,80 +1607,623 @@ async def restore_cache(request: RestoreCacheRequest):
         messages = format_messages(request.messages)
         tools = format_tools(request.tools)
         # handle cache
-        prompt = format_prompt(messages, tools)
-        cache_context = Cache.build_cache(
-            cache_dir=os.path.join(os.path.dirname(__file__), "cache"),
-            prompts=prompt,
-            model=MODEL,
-            model_name=MODEL_NAME,
-            temperature=request.inference_configs["temperature"],
-        )
-        MODEL.load_state(cache_context)
+        await SCHEDULER.submit(
+            _restore_cache, messages, tools, request.inference_configs["temperature"]
+        )
         return {"status": "ok", "message": "cache is restored"}
+    except QueueFullError as e:
+        logger.warning(f"Rejected restore_cache request: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error restoring cache: {e}")
         raise HTTPException(status_code=500, detail=f"Error restoring cache: {str(e)}")
 
 
+async def _activate_model(model_name: str, load_model_configs: Dict[str, Any]):
+    """Load model_name unless it is active or resident with matching configs."""
+    if model_name == MODEL_NAME:
+        return
+    resident = MODEL_POOL.get(model_name)
+    try:
+        if resident is None or not resident.matches(load_model_configs):
+            # Load off the inference worker; the active model keeps serving
+            # other requests until this one is ready
+            task = MODEL_LOADER.start(model_name, _model_path(model_name), load_model_configs)
+            await asyncio.shield(task.future)
+            logger.info(f"Model has been changed to {MODEL_NAME}")
+    except QueueFullError as e:
+        logger.warning(f"Rejected chat completion request: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        logger.error(f"Failed to load requested model '{model_name}': {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error loading model '{model_name}': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}")
+
+
 @app.post("/chat/completions")
-async def create_chat_completion(request: ChatCompletionRequest):
-    global MODEL
-    global MODEL_NAME
+async def create_chat_completion(
+    request: ChatCompletionRequest, http_request: Request, response: Response
+):
     if request.model is None or request.model == "":
         raise HTTPException(status_code=400, detail="Model name must be provided")
-    elif request.model != MODEL_NAME:
-        try:
-            load_model(request.model, request.load_model_configs)
-            logger.info(f"Model has been changed to {MODEL_NAME}")
-        except ValueError as e:
-            logger.error(f"Failed to load requested model '{request.model}': {e}")
-            raise HTTPException(status_code=404, detail=str(e))
-        except Exception as e:
-            logger.error(
-                f"Unexpected error loading model '{request.model}': {e}", exc_info=True
-            )
-            raise HTTPException(
-                status_code=500, detail=f"Error loading model: {str(e)}"
-            )
+    if RECORD_REQUESTS_PATH:
+        await _record_request(request)
+    client = _admit(request, http_request)
+    await _activate_model(request.model, request.load_model_configs)
+
+    # Log request details at DEBUG level (excluding potentially sensitive message content)
+    debug_request_summary = {
+        "model": request.model,
+        "num_messages": len(request.messages),
+        "num_tools": len(request.tools) if request.tools else 0,
+        "stream": request.stream,
+        "inference_keys": list(request.inference_configs.keys()),
+        "load_model_keys": list(request.load_model_configs.keys()),
+    }
+    logger.debug(f"Chat completion request details: {debug_request_summary}")
+
+    messages = format_messages(request.messages)
+    tools = format_tools(request.tools) if request.tools else []
+    return await _serve_chat_completion(
+        request.model,
+        request.load_model_configs,
+        messages,
+        tools,
+        request,
+        http_request,
+        response,
+        slot_key=_slot_key(messages, tools),
+        client=client,
+    )
 
-    try:
-        # Log request details at DEBUG level (excluding potentially sensitive message content)
-        debug_request_summary = {
-            "model": request.model,
-            "num_messages": len(request.messages),
-            "num_tools": len(request.tools) if request.tools else 0,
-            "stream": request.stream,
-            "inference_keys": list(request.inference_configs.keys()),
-            "load_model_keys": list(request.load_model_configs.keys()),
-        }
-        logger.debug(f"Chat completion request details: {debug_request_summary}")
 
-        messages = format_messages(request.messages)
-        tools = format_tools(request.tools) if request.tools else []
+def _queue_full(e: QueueFullError) -> HTTPException:
+    """429 with a Retry-After, so clients back off or fail over instead of waiting."""
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(max(math.ceil(e.retry_after_s), 1))},
+    )
+
 
+def _admit(request, http_request: Request) -> str:
+    """Check the request's class and reject it right away if the queue (or its
+    client's or class's share) is full. Returns the client it is queued for."""
+    request_class = request.request_class or "interactive"
+    if request_class not in REQUEST_CLASSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown request_class '{request_class}'; use one of {list(REQUEST_CLASSES)}",
+        )
+    client = (
+        request.client_id
+        or http_request.headers.get("X-Client-ID")
+        or (http_request.client.host if http_request.client is not None else None)
+        or "local"
+    )
+    try:
+        SCHEDULER.check_admission(REQUEST_CLASSES[request_class], client)
+    except QueueFullError as e:
+        METRICS.observe_request(RequestTimer(bool(getattr(request, "stream", False))), "rejected")
+        logger.warning(f"Rejected {request_class} chat completion from {client}: {e}")
+        raise _queue_full(e)
+    return client
+
+
+async def _serve_chat_completion(
+    model_name: str,
+    load_model_configs: Dict[str, Any],
+    messages,
+    tools,
+    request,
+    http_request: Request,
+    response: Response,
+    slot_key: List[str],
+    session: Optional[Session] = None,
+    client: Optional[str] = None,
+):
+    """Queue a chat completion and return its response (a stream or a completion).
+
+    request supplies stream, inference_configs, stream_options, request_id and
+    request_class (already checked by _admit()). With a session, messages are the
+    turn's new messages and the session's turn ends when the completion does.
+    """
+    # Set once a streaming response owns the session's turn
+    handed_off = False
+    try:
         # Check if stream parameter is in request
         stream = request.stream
 
+        request_id = request.request_id or f"req-{uuid.uuid4().hex}"
+        cache_key = _response_cache_key(
+            model_name, load_model_configs, messages, tools, request, session
+        )
+        if cache_key is not None:
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                METRICS.observe_request(RequestTimer(stream), "cached")
+                headers = {"X-Request-ID": request_id, "X-Cache": "hit"}
+                if stream:
+                    return StreamingResponse(
+                        _replay_frames(cached),
+                        media_type="text/event-stream",
+                        headers={"Cache-Control": "no-cache", **headers},
+                    )
+                response.headers.update(headers)
+                return cached
+            response.headers["X-Cache"] = "miss"
+        max_tokens = request.inference_configs.get("max_tokens") or 0
+        if max_tokens <= 0 and MODEL is not None:
+            max_tokens = MODEL.n_ctx()
+        try:
+            cancel_token = CANCELLATIONS.register(request_id, max_tokens)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        timer = RequestTimer(stream)
+        request_class = request.request_class or "interactive"
+        priority = REQUEST_CLASSES[request_class]
+        token_budget = int(
+            request.inference_configs.get("token_budget", TOKEN_BUDGETS[request_class]) or 0
+        )
+        if token_budget > 0:
+            cancel_token.set_budget(token_budget, lambda: SCHEDULER.preemption_pending(priority))
+        # Runs on a free inference slot, preferring one that served the same
+        # prefix (or the session's pinned slot); a request for another model
+        # waits until it can switch alone. Within its class, the queue is
+        # shared fairly with other clients
+        slot_options = {
+            "slot_key": slot_key,
+            "exclusive": lambda: model_name != MODEL_NAME or MODEL is None,
+            "pin": session.session_id if session is not None else None,
+            "priority": priority,
+            "client": client,
+            "job_id": request_id,
+        }
+
+        # Filled in by the completion, so a preempted one can be resumed
+        resume: Dict[str, Any] = {}
+
         if stream:
             logger.debug("Starting stream response generation.")
+
+            def stream_frames(session: Optional[Session] = None):
+                chunks = SCHEDULER.submit_stream(
+                    _stream_chat_completion,
+                    model_name,
+                    load_model_configs,
+                    messages,
+                    tools,
+                    request.inference_configs,
+                    cancel_token,
+                    timer,
+                    session=session,
+                    resume=resume,
+                    **slot_options,
+                )
+                return _sse_frames(chunks, request.stream_options)
+
+            try:
+                frames = stream_frames(session)
+            except Exception:
+                CANCELLATIONS.finish(cancel_token)
+                METRICS.observe_request(timer, "rejected")
+                raise
+            handed_off = True
+            headers = {
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "X-Request-ID": request_id,
+            }
+            # Sent before the first token, so clients can show the wait or fail over
+            queued = SCHEDULER.queue_info(request_id)
+            if queued is not None and queued["state"] == "queued":
+                headers["X-Queue-Position"] = str(queued["position"])
+                headers["X-Estimated-Wait-S"] = str(queued["estimated_wait_s"])
+            if cache_key is not None:
+                headers["X-Cache"] = "miss"
             return StreamingResponse(
-                _stream_chat_completion(messages, tools, request.inference_configs),
+                _stream_with_cancellation(
+                    frames, cancel_token, timer, session, cache_key, resume, stream_frames
+                ),
                 media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                },
+                headers=headers,
             )
         else:
             logger.debug("Starting non-stream response generation.")
-            # Get the generator object
-            return _chat_completion(messages, tools, request.inference_configs)
-
+            response.headers["X-Request-ID"] = request_id
+            watcher = asyncio.create_task(_cancel_on_disconnect(http_request, cancel_token))
+            outcome = "error"
+            try:
+                completion = await SCHEDULER.submit(
+                    _chat_completion,
+                    model_name,
+                    load_model_configs,
+                    messages,
+                    tools,
+                    request.inference_configs,
+                    cancel_token,
+                    timer,
+                    session=session,
+                    resume=resume,
+                    **slot_options,
+                )
+                # Preempted: continue behind the work that preempted it
+                while "prompt_tokens" in resume and cancel_token.resume():
+                    resume["text"] = completion["choices"][0]["message"]["content"] or ""
+                    try:
+                        continuation = await SCHEDULER.submit(
+                            _chat_completion,
+                            model_name,
+                            load_model_configs,
+                            messages,
+                            tools,
+                            request.inference_configs,
+                            cancel_token,
+                            timer,
+                            resume=resume,
+                            **slot_options,
+                        )
+                    except QueueFullError:
+                        cancel_token.cancel(PREEMPTED)
+                        break
+                    completion = _append_completion(completion, continuation)
+                outcome = "ok"
+            except QueueFullError:
+                outcome = "rejected"
+                raise
+            finally:
+                watcher.cancel()
+                CANCELLATIONS.finish(cancel_token)
+                METRICS.observe_request(timer, _stop_outcome(cancel_token, outcome))
+            if cancel_token.cancelled:
+                _mark_cancelled(completion, cancel_token)
+            elif cache_key is not None:
+                RESPONSE_CACHE.put(cache_key, copy.deepcopy(completion))
+            return completion
+
+    except HTTPException:
+        raise
+    except RequestCancelledError as e:
+        logger.info(str(e))
+        raise HTTPException(status_code=499, detail=str(e))
+    except QueueFullError as e:
+        logger.warning(f"Rejected chat completion request: {e}")
+        raise _queue_full(e)
     except Exception as e:
         logger.error(f"Error creating chat completion: {e}", exc_info=True)
         raise HTTPException(
             status_code=500, detail=f"Error creating chat completion: {str(e)}"
         )
+    finally:
+        if session is not None and not handed_off:
+            SESSIONS.end_turn(session)
+
+
+@app.post("/sessions")
+async def open_session(request: OpenSessionRequest):
+    """Open a session holding tools and history server-side; turns then send
+    only their new messages to /sessions/{session_id}/chat/completions."""
+    await _activate_model(request.model, request.load_model_configs)
+    tools = format_tools(request.tools) if request.tools else []
+    try:
+        session = SESSIONS.open(request.model, tools, request.load_model_configs)
+    except SessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if request.messages:
+        # Initial history (e.g. the system prompt), tokenized with the first turn
+        session.commit(format_messages(request.messages), None)
+        session.uploaded_messages += len(request.messages)
+    logger.info(f"Opened session {session.session_id} for {request.model}")
+    return {"status": "ok", "n_ctx": MODEL.n_ctx(), **session.info()}
+
+
+@app.get("/sessions")
+async def list_sessions():
+    return {
+        **SESSIONS.stats(),
+        "sessions": [
+            {**info, "pinned_slot": SCHEDULER.pinned_slot(info["session_id"])}
+            for info in SESSIONS.list()
+        ],
+    }
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    try:
+        session = SESSIONS.get(session_id)
+    except SessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {**session.info(), "pinned_slot": SCHEDULER.pinned_slot(session_id)}
+
+
+@app.delete("/sessions/{session_id}")
+async def close_session(session_id: str):
+    if not SESSIONS.close(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return {"status": "ok", "message": f"session {session_id} is closed"}
+
+
+@app.post("/sessions/{session_id}/chat/completions")
+async def session_chat_completion(
+    session_id: str, request: SessionTurnRequest, http_request: Request, response: Response
+):
+    """A chat completion over the session's history plus the turn's new messages."""
+    client = _admit(request, http_request)
+    try:
+        session = SESSIONS.start_turn(session_id, request.base)
+    except SessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    try:
+        await _activate_model(session.model, session.load_model_configs)
+        delta = format_messages(request.messages)
+        session.uploaded_messages += len(delta)
+        logger.debug(
+            f"Session {session_id} turn: {len(delta)} new messages after {request.base}"
+        )
+        slot_key = session.slot_key + [content_hash(message) for message in delta]
+    except BaseException:
+        SESSIONS.end_turn(session)
+        raise
+    # The turn ends when the completion (or its stream) does
+    return await _serve_chat_completion(
+        session.model,
+        session.load_model_configs,
+        delta,
+        session.tools,
+        request,
+        http_request,
+        response,
+        slot_key=slot_key,
+        session=session,
+        client=client,
+    )
+
+
+def _fork_prefix(
+    model_name, load_model_configs, branch_messages, tools, cancel_token, slot=None
+):
+    """Build every branch's prompt and evaluate the prefix they share once, on
+    the slot's context. Returns the prompts, the prefix state and a report."""
+    if cancel_token.cancelled:
+        raise RequestCancelledError(
+            f"Request {cancel_token.request_id} was cancelled before it started"
+        )
+    _ensure_model(model_name, load_model_configs)
+    model = _slot_model(slot)
+    prompts = [
+        PROMPT_BUILDER.build(messages, tools, add_generation_prompt=True)[1]
+        for messages in branch_messages
+    ]
+    shared = shared_prefix_length(prompts)
+    started = time.perf_counter()
+    state, reused = evaluate_prefix(model, list(prompts[0][:shared]))
+    report = {
+        "tokens": shared,
+        "reused_tokens": reused,
+        "evaluated_tokens": shared - reused,
+        "eval_s": round(time.perf_counter() - started, 3),
+    }
+    logger.debug(f"Batch {cancel_token.request_id} prefix: {report}")
+    return prompts, state, report
+
+
+def _batch_branch(
+    model_name,
+    load_model_configs,
+    prefix_state,
+    prompt_tokens,
+    inference_configs,
+    cancel_token,
+    slot=None,
+):
+    """Generate one branch from the forked prefix state; only the branch's own
+    prompt suffix is evaluated."""
+    _ensure_model(model_name, load_model_configs)
+    model = _slot_model(slot)
+    started = time.perf_counter()
+    forked = fork(model, prefix_state, prompt_tokens)
+    completion = create_completion_within_budget(
+        model,
+        prompt_tokens,
+        temperature=inference_configs["temperature"],
+        max_tokens=inference_configs["max_tokens"],
+        top_k=inference_configs["top_k"],
+        top_p=inference_configs["top_p"],
+        min_p=inference_configs["min_p"],
+        repeat_penalty=inference_configs["repetition_penalty"],
+        stop=_stop_sequences(inference_configs),
+        stopping_criteria=StoppingCriteriaList([cancel_token]),
+        model=MODEL_NAME,
+    )
+    result = completion_to_chat(completion)
+    result["timings"] = {
+        "slot": slot.index if slot is not None else None,
+        "forked": forked,
+        "suffix_tokens": len(prompt_tokens) - prefix_state.n_tokens,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+    return result
+
+
+def _tokenizer(model_name: Optional[str]):
+    """(name, model, prompt builder) to tokenize with: the active model, or a
+    resident one from the pool. Never loads or switches models."""
+    if model_name and model_name != MODEL_NAME:
+        resident = MODEL_POOL.get(model_name)
+        if resident is not None:
+            return model_name, resident.model, resident.prompt_builder
+        if not BACKEND.model_exists(_model_path(model_name)):
+            raise HTTPException(status_code=404, detail=f"Model '{model_name}' not found")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Model '{model_name}' is not loaded; load it with /setModel first",
+        )
+    if MODEL is None:
+        raise HTTPException(status_code=503, detail="LLM model not loaded")
+    return MODEL_NAME, MODEL, PROMPT_BUILDER
+
+
+def _require_template(builder: Optional[ChatPromptBuilder], model_name: str):
+    if builder is None or not builder.available:
+        raise HTTPException(
+            status_code=400, detail=f"Model {model_name} has no chat template to render messages with"
+        )
+
+
+@app.post("/tokenize")
+async def tokenize(request: TokenizeRequest):
+    """Token ids of raw text, or of messages and tools rendered as a prompt.
+    Runs off the inference worker, so it does not wait for generations."""
+    model_name, model, builder = _tokenizer(request.model)
+    if request.text is not None:
+        tokens = await asyncio.to_thread(
+            model.tokenize, request.text.encode("utf-8"), add_bos=request.add_bos, special=True
+        )
+    elif request.messages is not None:
+        _require_template(builder, model_name)
+        tools = format_tools(request.tools) if request.tools else []
+        _, tokens = await asyncio.to_thread(
+            builder.build,
+            format_messages(request.messages),
+            tools,
+            request.add_generation_prompt,
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Provide either text or messages")
+    return {
+        "model": model_name,
+        "tokens": list(tokens),
+        "count": len(tokens),
+        "n_ctx": model.n_ctx(),
+    }
+
+
+@app.post("/count_tokens")
+async def count_tokens(request: CountTokensRequest):
+    """Prompt tokens per message, for the tool schemas and for the generation
+    prompt, from the token count cache (see token_counts.py)."""
+    model_name, model, builder = _tokenizer(request.model)
+    _require_template(builder, model_name)
+    messages = format_messages(request.messages)
+    tools = format_tools(request.tools) if request.tools else []
+    result = await asyncio.to_thread(
+        TOKEN_COUNTER.count, model_name, builder, messages, tools, request.add_generation_prompt
+    )
+    if request.exact:
+        _, tokens = await asyncio.to_thread(
+            builder.build, messages, tools, request.add_generation_prompt
+        )
+        result["exact_total_tokens"] = len(tokens)
+    return {"model": model_name, "n_ctx": model.n_ctx(), **result}
+
+
+@app.post("/chat/completions/batch")
+async def batch_chat_completion(
+    request: BatchCompletionRequest, http_request: Request, response: Response
+):
+    """Several completions continuing one conversation (a reply and a title, or
+    candidate plans). The prompt prefix all branches share is evaluated once and
+    forked into each branch (see kv_fork.py); branches run on free inference
+    slots next to each other."""
+    if not request.branches or len(request.branches) > MAX_BATCH_BRANCHES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch needs 1 to {MAX_BATCH_BRANCHES} branches, got {len(request.branches)}",
+        )
+    client = _admit(request, http_request)
+    await _activate_model(request.model, request.load_model_configs)
+    if PROMPT_BUILDER is None or not PROMPT_BUILDER.available:
+        raise HTTPException(
+            status_code=400, detail=f"Model {request.model} has no chat template to batch with"
+        )
+    messages = format_messages(request.messages)
+    tools = format_tools(request.tools) if request.tools else []
+    branch_messages = [messages + format_messages(branch.messages) for branch in request.branches]
+    branch_configs = [
+        {**request.inference_configs, **branch.inference_configs} for branch in request.branches
+    ]
+
+    request_id = request.request_id or f"batch-{uuid.uuid4().hex}"
+    response.headers["X-Request-ID"] = request_id
+    try:
+        cancel_token = CANCELLATIONS.register(
+            request_id, sum(config.get("max_tokens") or 0 for config in branch_configs)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    options = {
+        "exclusive": lambda: request.model != MODEL_NAME or MODEL is None,
+        "priority": REQUEST_CLASSES[request.request_class or "interactive"],
+        "client": client,
+        "job_id": request_id,
+    }
+    watcher = asyncio.create_task(_cancel_on_disconnect(http_request, cancel_token))
+    started = time.monotonic()
+    try:
+        prompts, prefix_state, prefix = await SCHEDULER.submit(
+            _fork_prefix,
+            request.model,
+            request.load_model_configs,
+            branch_messages,
+            tools,
+            cancel_token,
+            slot_key=_slot_key(messages, tools),
+            **options,
+        )
+        # A branch whose queue slot is refused fails alone
+        results = await asyncio.gather(
+            *(
+                SCHEDULER.submit(
+                    _batch_branch,
+                    request.model,
+                    request.load_model_configs,
+                    prefix_state,
+                    prompt_tokens,
+                    config,
+                    cancel_token,
+                    slot_key=_slot_key(branch, tools),
+                    **options,
+                )
+                for branch, prompt_tokens, config in zip(branch_messages, prompts, branch_configs)
+            ),
+            return_exceptions=True,
+        )
+    except QueueFullError as e:
+        logger.warning(f"Rejected batch chat completion request: {e}")
+        raise _queue_full(e)
+    except RequestCancelledError as e:
+        logger.info(str(e))
+        raise HTTPException(status_code=499, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error creating batch chat completion: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail=f"Error creating batch chat completion: {str(e)}"
+        )
+    finally:
+        watcher.cancel()
+        CANCELLATIONS.finish(cancel_token)
+
+    branches = []
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error(f"Batch {request_id} branch {index} failed: {result}")
+            branches.append({"index": index, "error": str(result)})
+            continue
+        if cancel_token.cancelled:
+            _mark_cancelled(result, cancel_token)
+        branches.append({"index": index, **result})
+    return {
+        "id": request_id,
+        "object": "chat.completion.batch",
+        "model": request.model,
+        "n_ctx": MODEL.n_ctx(),
+        "prefix": prefix,
+        "branches": branches,
+        "elapsed_s": round(time.monotonic() - started, 3),
+    }
 
 
 def main():
@@ -396,6 +2234,12 @@ def main():
     parser.add_argument(
         "--port", type=int, default=8000, help="Port to bind the server to"
     )
+    parser.add_argument(
+        "--uds",
+        type=str,
+        default=None,
+        help="Serve on this Unix domain socket path instead of host and port",
+    )
     parser.add_argument(
         "--model_name",
         type=str,
@@ -403,6 +2247,237 @@ def main():
         help="Default LLM model to use",
     )
     parser.add_argument("--n_ctx", type=int, default=4096, help="Default LLM N_CTX")
+    parser.add_argument(
+        "--cache_type_k",
+        type=str,
+        default="f16",
+        choices=list(KV_CACHE_TYPES),
+        help="Default KV cache type for keys",
+    )
+    parser.add_argument(
+        "--cache_type_v",
+        type=str,
+        default="f16",
+        choices=list(KV_CACHE_TYPES),
+        help="Default KV cache type for values (quantized types enable flash attention)",
+    )
+    parser.add_argument(
+        "--fit_n_ctx",
+        action="store_true",
+        help="Shrink n_ctx by default to the largest context whose KV cache fits in free RAM",
+    )
+    parser.add_argument(
+        "--no_mmap",
+        action="store_true",
+        help="Read model weights into memory instead of mapping the file by default",
+    )
+    parser.add_argument(
+        "--mlock",
+        action="store_true",
+        help="Lock model weights in RAM by default so they are never paged out "
+        "(needs a large enough RLIMIT_MEMLOCK)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Read the default model file into the page cache on a background thread "
+        "at startup, ahead of the load",
+    )
+    parser.add_argument(
+        "--ram_reserve_mb",
+        type=int,
+        default=512,
+        help="RAM in MB left free for the OS and compute buffers when fitting n_ctx",
+    )
+    parser.add_argument(
+        "--max_queue_size",
+        type=int,
+        default=16,
+        help="Maximum number of inference requests waiting for the model",
+    )
+    parser.add_argument(
+        "--max_queued_per_client",
+        type=int,
+        default=0,
+        help="Requests one client may have waiting; more are rejected with 429 (0: no limit)",
+    )
+    parser.add_argument(
+        "--max_background_queue",
+        type=int,
+        default=8,
+        help="Background-class requests that may be waiting, so they cannot fill the "
+        "queue for interactive ones (0: no limit)",
+    )
+    parser.add_argument(
+        "--background_token_budget",
+        type=int,
+        default=256,
+        help="Tokens a background request generates before it may be preempted for "
+        "waiting interactive work (0: never preempt)",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        help="Inference slots: contexts per model that generate concurrently",
+    )
+    parser.add_argument(
+        "--token_count_cache_entries",
+        type=int,
+        default=4096,
+        help="Per-message token counts kept for /count_tokens",
+    )
+    parser.add_argument(
+        "--max_batch_branches",
+        type=int,
+        default=8,
+        help="Branches one /chat/completions/batch request may fork its prefix into",
+    )
+    parser.add_argument(
+        "--max_sessions",
+        type=int,
+        default=16,
+        help="Open /sessions kept; the least recently used idle one is closed beyond this",
+    )
+    parser.add_argument(
+        "--session_ttl_s",
+        type=float,
+        default=1800.0,
+        help="Sessions idle for longer than this many seconds are closed",
+    )
+    parser.add_argument(
+        "--max_resident_models",
+        type=int,
+        default=2,
+        help="Number of loaded models kept resident for fast switching",
+    )
+    parser.add_argument(
+        "--model_ram_budget_mb",
+        type=int,
+        default=0,
+        help="RAM budget in MB for resident models (weights + KV cache); 0 means no limit",
+    )
+    parser.add_argument(
+        "--prefix_cache_entries",
+        type=int,
+        default=4,
+        help="Evaluated prompts kept in RAM for automatic KV prefix reuse (0 disables)",
+    )
+    parser.add_argument(
+        "--prefix_cache_mb",
+        type=int,
+        default=256,
+        help="RAM budget in MB for the prefix reuse states (0 disables)",
+    )
+    parser.add_argument(
+        "--state_cache_ram_mb",
+        type=int,
+        default=512,
+        help="RAM budget in MB for the hot tier of the restore_cache state store",
+    )
+    parser.add_argument(
+        "--state_cache_disk_mb",
+        type=int,
+        default=2048,
+        help="Disk budget in MB for the restore_cache state store",
+    )
+    parser.add_argument(
+        "--stream_chunk_tokens",
+        type=int,
+        default=1,
+        help="Default tokens per SSE frame (0, or 1 with an interval: time budget only)",
+    )
+    parser.add_argument(
+        "--stream_interval_ms",
+        type=int,
+        default=0,
+        help="Default maximum time in ms a token waits before its SSE frame is sent",
+    )
+    parser.add_argument(
+        "--speculative",
+        type=str,
+        default="off",
+        help='Default speculative decoding: "off", "prompt_lookup" or a draft GGUF file name',
+    )
+    parser.add_argument(
+        "--context_policy",
+        type=str,
+        default="drop_oldest",
+        choices=POLICIES,
+        help="How prompts that do not fit n_ctx are cut before evaluation",
+    )
+    parser.add_argument(
+        "--context_reserve_tokens",
+        type=int,
+        default=512,
+        help="Tokens kept free for generation when fitting a prompt into n_ctx",
+    )
+    parser.add_argument(
+        "--tool_grammar",
+        action="store_true",
+        help="Constrain tool calls to the tools' JSON schemas by default",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="llama",
+        choices=BACKENDS,
+        help='Model backend; "fake" serves a deterministic fake model for load testing',
+    )
+    parser.add_argument(
+        "--fake_prompt_ms_per_token",
+        type=float,
+        default=0.5,
+        help="Fake backend: simulated prompt eval time per token in ms",
+    )
+    parser.add_argument(
+        "--fake_token_ms",
+        type=float,
+        default=20.0,
+        help="Fake backend: simulated decode time per generated token in ms",
+    )
+    parser.add_argument(
+        "--record_requests",
+        type=str,
+        default=None,
+        help="Append every /chat/completions body to this JSONL file (replayed by loadgen.py)",
+    )
+    parser.add_argument(
+        "--warmup_spec",
+        type=str,
+        default=None,
+        help="JSON file with the system prompt and tools to pre-evaluate at boot",
+    )
+    parser.add_argument(
+        "--response_cache_entries",
+        type=int,
+        default=0,
+        help="Responses of temperature-0 chat completions kept for identical requests (0 disables)",
+    )
+    parser.add_argument(
+        "--response_cache_ttl_s",
+        type=float,
+        default=600.0,
+        help="Seconds a cached response stays valid",
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Benchmark threads and batch sizes for the default model at startup unless "
+        "a result for it and this CPU is stored",
+    )
+    parser.add_argument(
+        "--autotune_prompt_tokens",
+        type=int,
+        default=256,
+        help="Prompt tokens evaluated per auto-tune benchmark",
+    )
+    parser.add_argument(
+        "--autotune_decode_tokens",
+        type=int,
+        default=32,
+        help="Tokens decoded per auto-tune benchmark",
+    )
     parser.add_argument(
         "--log-level",
         type=str,
@@ -420,12 +2495,75 @@ def main():
     # --- Logging is now configured ---
     logger.info(f"Logging level set to: {args.log_level.upper()}")
 
+    SCHEDULER.max_queue_size = args.max_queue_size
+    SCHEDULER.max_queued_per_client = args.max_queued_per_client
+    SCHEDULER.max_queued_by_priority = {PRIORITY_LOW: args.max_background_queue}
+    TOKEN_BUDGETS["background"] = args.background_token_budget
+    SCHEDULER.configure_slots(args.parallel)
+    SESSIONS.max_sessions = args.max_sessions
+    TOKEN_COUNTER.max_entries = args.token_count_cache_entries
+    global MAX_BATCH_BRANCHES
+    MAX_BATCH_BRANCHES = args.max_batch_branches
+    SESSIONS.ttl_s = args.session_ttl_s
+    RESPONSE_CACHE.max_entries = args.response_cache_entries
+    RESPONSE_CACHE.ttl_s = args.response_cache_ttl_s
+    MODEL_POOL.max_models = args.max_resident_models
+    MODEL_POOL.ram_budget_bytes = args.model_ram_budget_mb << 20
+    global DEFAULT_N_CTX
+    DEFAULT_N_CTX = args.n_ctx
+    global DEFAULT_TYPE_K, DEFAULT_TYPE_V, FIT_N_CTX, RAM_RESERVE_BYTES
+    DEFAULT_TYPE_K = args.cache_type_k
+    DEFAULT_TYPE_V = args.cache_type_v
+    FIT_N_CTX = args.fit_n_ctx
+    RAM_RESERVE_BYTES = args.ram_reserve_mb << 20
+    global DEFAULT_USE_MMAP, DEFAULT_USE_MLOCK
+    DEFAULT_USE_MMAP = not args.no_mmap
+    DEFAULT_USE_MLOCK = args.mlock
+    global PREFIX_CACHE_ENTRIES, PREFIX_CACHE_BYTES
+    PREFIX_CACHE_ENTRIES = args.prefix_cache_entries
+    PREFIX_CACHE_BYTES = args.prefix_cache_mb << 20
+    global STATE_CACHE_RAM_BYTES, STATE_CACHE_DISK_BYTES
+    STATE_CACHE_RAM_BYTES = args.state_cache_ram_mb << 20
+    STATE_CACHE_DISK_BYTES = args.state_cache_disk_mb << 20
+    global STREAM_CHUNK_TOKENS, STREAM_INTERVAL_MS
+    STREAM_CHUNK_TOKENS = args.stream_chunk_tokens
+    STREAM_INTERVAL_MS = args.stream_interval_ms
+    global WARMUP_SPEC_PATH
+    WARMUP_SPEC_PATH = args.warmup_spec
+    global DEFAULT_SPECULATIVE
+    DEFAULT_SPECULATIVE = args.speculative
+    global TOOL_GRAMMAR
+    TOOL_GRAMMAR = args.tool_grammar
+    global CONTEXT_POLICY, CONTEXT_RESERVE_TOKENS
+    CONTEXT_POLICY = args.context_policy
+    CONTEXT_RESERVE_TOKENS = args.context_reserve_tokens
+    global BACKEND, RECORD_REQUESTS_PATH
+    BACKEND = make_backend(
+        args.backend,
+        prompt_eval_s_per_token=args.fake_prompt_ms_per_token / 1000,
+        token_s=args.fake_token_ms / 1000,
+    )
+    RECORD_REQUESTS_PATH = args.record_requests
+
     # Set default model if provided via command line, otherwise use the one from request
     global MODEL_NAME
     if args.model_name:
         try:
             MODEL_NAME = args.model_name
-            load_model_configs = {"n_ctx": args.n_ctx}
+            # The defaults spelled out, so clients sending them match this load
+            load_model_configs = {
+                "n_ctx": args.n_ctx,
+                "type_k": args.cache_type_k,
+                "type_v": args.cache_type_v,
+                "fit_n_ctx": args.fit_n_ctx,
+                "use_mmap": not args.no_mmap,
+                "use_mlock": args.mlock,
+            }
+            model_path = _model_path(MODEL_NAME)
+            if args.prefetch and os.path.isfile(model_path):
+                PREFETCHER.start(model_path)
+            if args.autotune and BACKEND.model_exists(model_path) and TUNING.get(model_path) is None:
+                _tune_model(model_path, args.autotune_prompt_tokens, args.autotune_decode_tokens)
             load_model(MODEL_NAME, load_model_configs)
             # Logger is already configured, level is set
         except ValueError as e:
@@ -441,6 +2579,16 @@ def main():
             )
             sys.exit("Error loading default model.")
 
+    if args.uds:
+        global UDS_PATH
+        UDS_PATH = args.uds
+        # A socket file left by an unclean shutdown would make the bind fail
+        if os.path.exists(UDS_PATH) and stat.S_ISSOCK(os.stat(UDS_PATH).st_mode):
+            os.unlink(UDS_PATH)
+        logger.info(f"Starting LLM Server on unix socket {UDS_PATH}")
+        uvicorn.run(app, uds=UDS_PATH)
+        return
+
     logger.info(f"Starting LLM Server on {args.host}:{args.port}")
 
     # Start the server
@@ -0,0 +1,179 @@
+"""
+Sessions - Server-side conversations for /sessions. A session holds its tools
+and message history, so each turn only uploads the messages added since the
+last one. The prompt tokens of the history are kept too, so a turn only
+tokenizes its new messages, and the session's inference slot is pinned so its
+KV cache is still there on the next turn.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from distiller_cm5_python.llm_server.chat_template import PromptState, content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class SessionError(Exception):
+    """A turn that does not fit the session; status_code is the HTTP status."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Session:
+    def __init__(
+        self,
+        model: str,
+        tools: List[Dict[str, Any]],
+        load_model_configs: Dict[str, Any],
+    ):
+        self.session_id = f"sess-{uuid.uuid4().hex}"
+        self.model = model
+        self.tools = tools
+        self.load_model_configs = load_model_configs
+        self.messages: List[Dict[str, Any]] = []
+        # Slot affinity key, extended message by message instead of rehashed
+        self.slot_key: List[str] = [content_hash(tools)]
+        # Prompt of self.messages for the model it was last built with
+        self.prompt: Optional[PromptState] = None
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        # A turn is queued or running; turns of one session are sequential
+        self.busy = False
+
+        # Stats
+        self.turns = 0
+        self.uploaded_messages = 0
+
+    def commit(self, delta: List[Dict[str, Any]], prompt: Optional[PromptState]):
+        """Append a turn's new messages once its prompt has been built."""
+        self.messages.extend(delta)
+        self.slot_key.extend(content_hash(message) for message in delta)
+        self.prompt = prompt
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "model": self.model,
+            "tools": len(self.tools),
+            "messages": len(self.messages),
+            "prompt_tokens": len(self.prompt.tokens) if self.prompt is not None else 0,
+            "turns": self.turns,
+            "uploaded_messages": self.uploaded_messages,
+            "busy": self.busy,
+            "created_at": self.created_at,
+            "idle_s": round(time.monotonic() - self.last_used, 3),
+        }
+
+
+class SessionRegistry:
+    """Open sessions, least recently used first.
+
+    Sessions idle for longer than ttl_s are closed, and opening one beyond
+    max_sessions closes the least recently used idle session. on_close(session_id)
+    is called for every closed session (the server unpins its slot).
+    """
+
+    def __init__(self, max_sessions: int = 16, ttl_s: float = 1800.0, on_close=None):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.on_close = on_close
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self.opened = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _close(self, session: Session):
+        self._sessions.pop(session.session_id, None)
+        if self.on_close is not None:
+            self.on_close(session.session_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        for session in list(self._sessions.values()):
+            # A busy session this old lost its turn (its stream was never started)
+            if now - session.last_used > self.ttl_s:
+                logger.info(f"Session {session.session_id} expired after {self.ttl_s:.0f}s idle")
+                self.expired += 1
+                self._close(session)
+
+    def open(
+        self, model: str, tools: List[Dict[str, Any]], load_model_configs: Dict[str, Any]
+    ) -> Session:
+        with self._lock:
+            self._expire()
+            while len(self._sessions) >= self.max_sessions:
+                idle = next((s for s in self._sessions.values() if not s.busy), None)
+                if idle is None:
+                    raise SessionError(
+                        f"Too many open sessions ({len(self._sessions)}/{self.max_sessions})",
+                        503,
+                    )
+                logger.info(f"Session {idle.session_id} evicted for a new session")
+                self.evicted += 1
+                self._close(idle)
+            session = Session(model, tools, load_model_configs)
+            self._sessions[session.session_id] = session
+            self.opened += 1
+            return session
+
+    def get(self, session_id: str) -> Session:
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise SessionError(f"Session '{session_id}' not found", 404)
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def start_turn(self, session_id: str, base: int) -> Session:
+        """The session for a turn whose new messages follow its first base messages."""
+        session = self.get(session_id)
+        if session.busy:
+            raise SessionError(f"Session '{session_id}' already has a turn in progress", 409)
+        if base != len(session.messages):
+            raise SessionError(
+                f"Session '{session_id}' has {len(session.messages)} messages, "
+                f"the turn expects {base}",
+                409,
+            )
+        session.busy = True
+        return session
+
+    def end_turn(self, session: Session):
+        session.busy = False
+        session.turns += 1
+        session.last_used = time.monotonic()
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            self._close(session)
+            return True
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._expire()
+            return [session.info() for session in self._sessions.values()]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_s": self.ttl_s,
+                "opened": self.opened,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,160 @@
+"""
+Speculative Decoding - Draft tokens (prompt lookup or a small draft GGUF) that the
+main model verifies in one batch, so repeated text costs one eval per several tokens.
+"""
+import logging
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+import numpy.typing as npt
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+logger = logging.getLogger(__name__)
+
+PROMPT_LOOKUP = "prompt_lookup"
+
+# llama-cpp-python recommends 10 for GPU and 2 for CPU-only inference
+DEFAULT_NUM_PRED_TOKENS = 2
+
+
+class GgufDraftModel(LlamaDraftModel):
+    """Greedy drafts from a small model sharing the main model's vocabulary."""
+
+    def __init__(self, model: Llama, num_pred_tokens: int = DEFAULT_NUM_PRED_TOKENS):
+        self.model = model
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        draft = []
+        if self.num_pred_tokens <= 0:
+            return np.array(draft, dtype=np.intc)
+        # generate() reuses the draft model's own KV prefix, so only new tokens are evaluated
+        for token in self.model.generate(input_ids.tolist(), temp=0.0):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+    def close(self):
+        self.model.close()
+
+
+class SpeculativeLlama(Llama):
+    """Llama whose draft verification does not need logits_all.
+
+    Passing draft_model to Llama turns on logits_all, which allocates an
+    n_ctx x n_vocab score matrix and copies every evaluated token's logits into
+    it. Sampling happens inside llama.cpp, so only the verification batch
+    ([sampled token] + drafts) needs logits at every position; prompt batches
+    need them only at the last token and nothing is copied back to Python.
+
+    Also counts drafted and accepted tokens for the acceptance rate.
+    """
+
+    def __init__(self, *args, draft: Optional[LlamaDraftModel] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if isinstance(draft, GgufDraftModel) and draft.model.n_vocab() != self.n_vocab():
+            draft.close()
+            self.close()
+            raise ValueError("Draft model vocabulary does not match the main model")
+        # Set after construction so llama-cpp-python does not force logits_all
+        self.default_draft = draft
+        self.draft_model = self._draft if draft is not None else None
+        self.num_pred_tokens = getattr(draft, "num_pred_tokens", DEFAULT_NUM_PRED_TOKENS)
+        # Length of the last draft; the next eval is its verification batch
+        self._pending_draft = 0
+        self._last_verify: Optional[tuple] = None  # (n_past, n_drafted)
+
+        # Stats
+        self.drafted_tokens = 0
+        self.accepted_tokens = 0
+        self.verify_steps = 0
+
+    def _draft(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        draft_tokens = self.default_draft(input_ids, **kwargs)
+        self._pending_draft = len(draft_tokens)
+        return draft_tokens
+
+    def _settle_verify(self):
+        # generate() truncates n_tokens to the first rejected draft token, so
+        # whatever survived of the last verification batch was accepted
+        if self._last_verify is not None:
+            n_past, n_drafted = self._last_verify
+            self.accepted_tokens += min(max(self.n_tokens - n_past - 1, 0), n_drafted)
+            self._last_verify = None
+
+    def eval(self, tokens: Sequence[int]):
+        self._settle_verify()
+        verifying = self._pending_draft > 0 and len(tokens) > 1
+        self._pending_draft = 0
+        if verifying:
+            self.drafted_tokens += len(tokens) - 1
+            self.verify_steps += 1
+            self._last_verify = (self.n_tokens, len(tokens) - 1)
+
+        self._ctx.kv_cache_seq_rm(-1, self.n_tokens, -1)
+        for i in range(0, len(tokens), self.n_batch):
+            batch = tokens[i : min(len(tokens), i + self.n_batch)]
+            n_past = self.n_tokens
+            n_tokens = len(batch)
+            self._batch.set_batch(batch=batch, n_past=n_past, logits_all=verifying)
+            self._ctx.decode(self._batch)
+            self.input_ids[n_past : n_past + n_tokens] = batch
+            self.n_tokens += n_tokens
+
+    def reset(self):
+        self._settle_verify()
+        super().reset()
+        self._pending_draft = 0
+
+    def configure_draft(self, enabled: Optional[bool] = None, num_pred_tokens: Optional[int] = None):
+        """Per-request overrides; called before each completion on the inference worker."""
+        if self.default_draft is None:
+            return
+        self._settle_verify()
+        self.draft_model = self._draft if enabled is None or enabled else None
+        self.default_draft.num_pred_tokens = (
+            num_pred_tokens if num_pred_tokens is not None else self.num_pred_tokens
+        )
+        self._pending_draft = 0
+
+    def speculative_stats(self) -> Dict[str, Any]:
+        self._settle_verify()
+        return {
+            "enabled": self.default_draft is not None,
+            "drafted_tokens": self.drafted_tokens,
+            "accepted_tokens": self.accepted_tokens,
+            "verify_steps": self.verify_steps,
+            "acceptance_rate": (
+                round(self.accepted_tokens / self.drafted_tokens, 3) if self.drafted_tokens else 0.0
+            ),
+        }
+
+    def close(self):
+        if isinstance(self.default_draft, GgufDraftModel):
+            self.default_draft.close()
+        super().close()
+
+
+def make_draft(
+    speculative: Any,
+    models_dir: str,
+    n_ctx: int,
+    num_pred_tokens: int = DEFAULT_NUM_PRED_TOKENS,
+) -> Optional[LlamaDraftModel]:
+    """Build the draft source named by a load config value.
+
+    True or "prompt_lookup" selects prompt lookup; a .gguf file name from the
+    models directory selects a draft model; False/None/"off" disables it.
+    """
+    if speculative in (None, False, "", "off", "none"):
+        return None
+    if speculative is True or speculative == PROMPT_LOOKUP:
+        return LlamaPromptLookupDecoding(max_ngram_size=2, num_pred_tokens=num_pred_tokens)
+    draft_path = f"{models_dir}/{speculative}"
+    try:
+        draft_model = Llama(model_path=draft_path, verbose=False, n_gpu_layers=0, n_ctx=n_ctx)
+    except ValueError as e:
+        raise ValueError(f"Draft model '{speculative}' could not be loaded: {e}")
+    return GgufDraftModel(draft_model, num_pred_tokens=num_pred_tokens)
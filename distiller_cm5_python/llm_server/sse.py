@@ -0,0 +1,142 @@
+"""
+SSE Framing - Turns chat completion chunks into compact Server-Sent Events,
+coalescing consecutive content tokens into one frame per time/token budget.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    ENCODER = "orjson"
+except ImportError:
+    _JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def _dumps(obj: Any) -> bytes:
+        return _JSON_ENCODER.encode(obj).encode("utf-8")
+
+    ENCODER = "json"
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+
+def compact_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop null and empty fields (logprobs, unset finish_reason, empty deltas) from a chunk."""
+    choices = []
+    for choice in chunk.get("choices", []):
+        compact = {"index": choice.get("index", 0)}
+        delta = {k: v for k, v in (choice.get("delta") or {}).items() if v is not None}
+        if delta:
+            compact["delta"] = delta
+        if choice.get("finish_reason") is not None:
+            compact["finish_reason"] = choice["finish_reason"]
+        choices.append(compact)
+    frame = {k: v for k, v in chunk.items() if k != "choices" and v is not None}
+    frame["choices"] = choices
+    return frame
+
+
+def encode_frame(chunk: Dict[str, Any]) -> bytes:
+    return b"data: " + _dumps(compact_chunk(chunk)) + b"\n\n"
+
+
+def _content_of(chunk: Dict[str, Any]) -> Optional[str]:
+    """The delta content of a plain content chunk, or None for any other chunk."""
+    choices = chunk.get("choices") or []
+    if len(choices) != 1 or choices[0].get("finish_reason") is not None:
+        return None
+    delta = choices[0].get("delta") or {}
+    if set(delta) != {"content"} or not isinstance(delta["content"], str):
+        return None
+    return delta["content"]
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[Union[Dict[str, Any], bytes]],
+    max_tokens: int = 1,
+    max_interval_s: float = 0.0,
+) -> AsyncIterator[Union[Dict[str, Any], bytes]]:
+    """Merge consecutive content chunks until max_tokens have been merged or
+    max_interval_s has passed since the first pending one.
+
+    max_interval_s is a deadline: pending content is flushed when it expires
+    even if the next token has not arrived yet. Role, tool call and finish
+    chunks (and ready-made frames as bytes) are passed through unchanged, after
+    any pending content. max_tokens <= 0 disables the token budget, and so does
+    max_tokens == 1 when an interval is set, since a one-token frame would never
+    wait; without an interval that leaves the stream as is.
+    """
+    iterator = chunks.__aiter__()
+    if max_interval_s > 0 and max_tokens == 1:
+        max_tokens = 0
+    if max_interval_s <= 0 and max_tokens <= 1:
+        async for chunk in iterator:
+            yield chunk
+        return
+
+    pending: Optional[Dict[str, Any]] = None
+    pending_parts = []
+    pending_since = 0.0
+
+    def flush():
+        pending["choices"][0]["delta"]["content"] = "".join(pending_parts)
+        return pending
+
+    next_chunk: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+            timeout = None
+            if pending is not None and max_interval_s > 0:
+                timeout = max(pending_since + max_interval_s - time.monotonic(), 0.0)
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+            if not done:
+                # Deadline passed while the next token is still being generated
+                yield flush()
+                pending, pending_parts = None, []
+                continue
+            future, next_chunk = next_chunk, None
+            try:
+                chunk = future.result()
+            except StopAsyncIteration:
+                break
+
+            content = None if isinstance(chunk, bytes) else _content_of(chunk)
+            if content is None:
+                if pending is not None:
+                    yield flush()
+                    pending, pending_parts = None, []
+                yield chunk
+                continue
+
+            if pending is None:
+                pending, pending_since = chunk, time.monotonic()
+            pending_parts.append(content)
+            if (max_tokens > 0 and len(pending_parts) >= max_tokens) or (
+                max_interval_s > 0 and time.monotonic() - pending_since >= max_interval_s
+            ):
+                yield flush()
+                pending, pending_parts = None, []
+
+        if pending is not None:
+            yield flush()
+    finally:
+        if next_chunk is not None and not next_chunk.done():
+            next_chunk.cancel()
+
+
+async def encode_frames(
+    chunks: AsyncIterator[Union[Dict[str, Any], bytes]],
+) -> AsyncIterator[bytes]:
+    """SSE frames for chunks; items that already are frames pass through."""
+    async for chunk in chunks:
+        yield chunk if isinstance(chunk, bytes) else encode_frame(chunk)
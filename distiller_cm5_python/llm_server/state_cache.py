@@ -0,0 +1,274 @@
+"""
+State Cache - Two-tier (RAM + disk) LRU store for saved llama states with byte
+budgets per tier and a persistent index so startup does not scan or unpickle.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+from llama_cpp.llama import LlamaState
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.json"
+STATE_SUFFIX = ".state"
+# Lookups only reorder the index; persist that at most this often
+INDEX_SAVE_INTERVAL_S = 30.0
+# What the diskcache-backed LlamaDiskCache used to leave in the same directory
+LEGACY_DB_FILES = ("cache.db", "cache.db-wal", "cache.db-shm")
+LEGACY_SUBDIR_RE = re.compile(r"^[0-9a-f]{2}$")
+
+
+def state_nbytes(state: LlamaState) -> int:
+    """Approximate RAM held by a LlamaState."""
+    return int(state.llama_state_size) + state.input_ids.nbytes + state.scores.nbytes
+
+
+class StateCache:
+    """LRU cache of llama states keyed by string, with a hot RAM tier over a disk tier.
+
+    Writes go through to disk so states survive restarts. Each tier evicts its
+    least recently used entries once it exceeds its byte budget; RAM evictions
+    simply drop the in-memory copy, disk evictions delete the file. The index
+    file records every disk entry in LRU order, so lookups after a restart are a
+    dict access rather than a directory walk. Hits only reorder it in memory;
+    the reordering is written out with the next put or eviction, or at most
+    every INDEX_SAVE_INTERVAL_S seconds.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ram_capacity_bytes: int = 512 << 20,
+        disk_capacity_bytes: int = 2 << 30,
+    ):
+        self.cache_dir = cache_dir
+        self.ram_capacity_bytes = ram_capacity_bytes
+        self.disk_capacity_bytes = disk_capacity_bytes
+        self._ram: "OrderedDict[str, LlamaState]" = OrderedDict()
+        self._ram_bytes = 0
+        self._index: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+        self._lock = threading.RLock()
+
+        # Stats
+        self.ram_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.ram_evictions = 0
+        self.disk_evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._remove_legacy_files()
+        self._load_index()
+
+    @staticmethod
+    def make_key(tokens: Sequence[int], *parts: Any) -> str:
+        """Stable key for a token sequence plus anything else the state depends on (e.g. n_ctx)."""
+        digest = hashlib.sha256(np.asarray(tokens, dtype=np.int32).tobytes())
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+        return digest.hexdigest()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, INDEX_FILENAME)
+
+    def _state_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + STATE_SUFFIX)
+
+    @property
+    def disk_bytes(self) -> int:
+        return sum(entry["size"] for entry in self._index.values())
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = []
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable state cache index {self._index_path}: {e}")
+            entries = []
+
+        for entry in entries:
+            if os.path.exists(self._state_path(entry["key"])):
+                self._index[entry["key"]] = entry
+
+        # Drop state files the index does not know about (e.g. interrupted writes)
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(STATE_SUFFIX) and filename[: -len(STATE_SUFFIX)] not in self._index:
+                self._remove_file(os.path.join(self.cache_dir, filename))
+
+        self._evict_disk()
+        logger.debug(
+            f"State cache at {self.cache_dir}: {len(self._index)} entries, {self.disk_bytes} bytes on disk"
+        )
+
+    def _remove_legacy_files(self):
+        """Delete the diskcache database and value shards of the old LlamaDiskCache."""
+        if not os.path.exists(os.path.join(self.cache_dir, LEGACY_DB_FILES[0])):
+            return
+        for filename in LEGACY_DB_FILES:
+            self._remove_file(os.path.join(self.cache_dir, filename))
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if LEGACY_SUBDIR_RE.match(filename) and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"Removed legacy disk cache files from {self.cache_dir}")
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self._index.values()), f)
+        os.replace(tmp_path, self._index_path)
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+
+    def _touch_index(self, key: str):
+        """Mark key most recently used; the index file catches up lazily."""
+        self._index[key]["last_used"] = time.time()
+        self._index.move_to_end(key)
+        self._index_dirty = True
+        if time.monotonic() - self._index_saved_at >= INDEX_SAVE_INTERVAL_S:
+            self.flush()
+
+    def flush(self):
+        """Write the index out if lookups have reordered it since the last save."""
+        with self._lock:
+            if self._index_dirty:
+                try:
+                    self._save_index()
+                except OSError as e:
+                    logger.warning(f"Failed to save state cache index {self._index_path}: {e}")
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove state cache file {path}: {e}")
+
+    def _put_ram(self, key: str, state: LlamaState):
+        if key in self._ram:
+            self._ram_bytes -= state_nbytes(self._ram.pop(key))
+        size = state_nbytes(state)
+        if size > self.ram_capacity_bytes:
+            return
+        self._ram[key] = state
+        self._ram_bytes += size
+        while self._ram_bytes > self.ram_capacity_bytes and self._ram:
+            _, evicted = self._ram.popitem(last=False)
+            self._ram_bytes -= state_nbytes(evicted)
+            self.ram_evictions += 1
+
+    def _evict_disk(self):
+        evicted = False
+        while self.disk_bytes > self.disk_capacity_bytes and self._index:
+            key, _ = self._index.popitem(last=False)
+            self._remove_file(self._state_path(key))
+            self.disk_evictions += 1
+            evicted = True
+            logger.debug(f"State cache evicted {key[:12]} from disk")
+        if evicted:
+            self._save_index()
+
+    def get(self, key: str) -> Optional[LlamaState]:
+        """Return the state for key (promoting it in both tiers), or None."""
+        with self._lock:
+            if key in self._ram:
+                self._ram.move_to_end(key)
+                if key in self._index:
+                    self._touch_index(key)
+                self.ram_hits += 1
+                return self._ram[key]
+
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            try:
+                with open(self._state_path(key), "rb") as f:
+                    state = pickle.load(f)
+            except Exception as e:
+                logger.warning(f"Dropping unreadable state cache entry {key[:12]}: {e}")
+                del self._index[key]
+                self._remove_file(self._state_path(key))
+                self._save_index()
+                self.misses += 1
+                return None
+
+            self._touch_index(key)
+            self._put_ram(key, state)
+            self.disk_hits += 1
+            return state
+
+    def put(self, key: str, state: LlamaState):
+        """Store state in the RAM tier and write it through to disk."""
+        with self._lock:
+            path = self._state_path(key)
+            tmp_path = path + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Failed to write state cache entry {key[:12]}: {e}")
+                self._remove_file(tmp_path)
+            else:
+                self._index.pop(key, None)
+                self._index[key] = {
+                    "key": key,
+                    "size": os.path.getsize(path),
+                    "n_tokens": int(state.n_tokens),
+                    "last_used": time.time(),
+                }
+                self._save_index()
+                self._evict_disk()
+            self._put_ram(key, state)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._ram or key in self._index
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                self._remove_file(self._state_path(key))
+            self._index.clear()
+            self._ram.clear()
+            self._ram_bytes = 0
+            self._save_index()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.ram_hits + self.disk_hits + self.misses
+            return {
+                "ram_entries": len(self._ram),
+                "ram_bytes": self._ram_bytes,
+                "ram_capacity_bytes": self.ram_capacity_bytes,
+                "disk_entries": len(self._index),
+                "disk_bytes": self.disk_bytes,
+                "disk_capacity_bytes": self.disk_capacity_bytes,
+                "ram_hits": self.ram_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    round((self.ram_hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+                ),
+                "ram_evictions": self.ram_evictions,
+                "disk_evictions": self.disk_evictions,
+            }
@@ -0,0 +1,127 @@
+"""
+Token Counts - Prompt token cost of each message under a model's chat template,
+for /count_tokens. A message's cost is the tokens its turn adds to the rendered
+prompt; costs are cached by model and message content hash, so a client
+counting its growing history again only pays for the new messages.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from distiller_cm5_python.llm_server.chat_template import ChatPromptBuilder, content_hash
+
+logger = logging.getLogger(__name__)
+
+# Stands in for the system message when turns are rendered on their own
+_BASE_SYSTEM = {"role": "system", "content": ""}
+
+
+class TokenCounter:
+    """LRU of token counts keyed by model, template and content hash."""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key: str, compute: Callable[[], int]) -> int:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        count = compute()
+        with self._lock:
+            self._counts[key] = count
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def count(
+        self,
+        model_name: str,
+        builder: ChatPromptBuilder,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+        add_generation_prompt: bool = True,
+    ) -> Dict[str, Any]:
+        """Per-message token counts, the tool schemas' share of the system prefix
+        and the generation prompt; total_tokens is their sum.
+
+        A leading system message is counted with the template's preamble (bos,
+        header). Other turns are rendered after an empty system message and
+        counted by what they add, so templates that merge neighbouring turns
+        (e.g. consecutive tool results) can differ from a full build by a few
+        tokens.
+        """
+        scope = content_hash(model_name, builder.template_hash)
+
+        def tokens_of(text: str) -> int:
+            return len(builder.tokenize(text))
+
+        def added_by(base: List[Dict[str, Any]], extra, generation: bool = False) -> int:
+            base_text = builder.render(base, None, add_generation_prompt=False)
+            text = builder.render(base + extra, None, add_generation_prompt=generation)
+            if not text.startswith(base_text):
+                return tokens_of(text)
+            return tokens_of(text[len(base_text) :])
+
+        has_system = bool(messages) and messages[0].get("role") == "system"
+        system = messages[0] if has_system else _BASE_SYSTEM
+        bare_prefix = self._cached(
+            content_hash(scope, "prefix", system),
+            lambda: tokens_of(builder.render([system], None, add_generation_prompt=False)),
+        )
+        prefix = bare_prefix
+        if tools:
+            prefix = self._cached(
+                content_hash(scope, "prefix", system, tools),
+                lambda: tokens_of(builder.render([system], tools, add_generation_prompt=False)),
+            )
+
+        counts = [bare_prefix] if has_system else []
+        for message in messages[1:] if has_system else messages:
+            counts.append(
+                self._cached(
+                    content_hash(scope, "message", message),
+                    lambda: added_by([_BASE_SYSTEM], [message]),
+                )
+            )
+        generation_prompt = 0
+        if add_generation_prompt:
+            generation_prompt = self._cached(
+                content_hash(scope, "generation"),
+                lambda: added_by([_BASE_SYSTEM], [], generation=True),
+            )
+        return {
+            "messages": counts,
+            # A conversation without a system message still gets the template's preamble
+            "prefix_tokens": 0 if has_system else bare_prefix,
+            "tools_tokens": prefix - bare_prefix,
+            "generation_prompt_tokens": generation_prompt,
+            "total_tokens": (
+                sum(counts)
+                + (0 if has_system else bare_prefix)
+                + prefix
+                - bare_prefix
+                + generation_prompt
+            ),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._counts),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,242 @@
+"""
+Tool Grammar - Compiles the request's tool JSON schemas into a llama grammar and
+applies it only inside <tool_call> blocks, so emitted tool calls always parse and
+match their tool's parameters while free text before them stays unconstrained.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+from llama_cpp import Llama, LlamaGrammar, StoppingCriteriaList
+
+from distiller_cm5_python.llm_server.cancellation import CancelToken
+from distiller_cm5_python.llm_server.chat_template import content_hash
+from distiller_cm5_python.llm_server.prefix_cache import PrefixStateCache
+
+logger = logging.getLogger(__name__)
+
+TOOL_CALL_OPEN = "<tool_call>"
+TOOL_CALL_CLOSE = "</tool_call>"
+
+
+def tool_call_schema(tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """JSON schema of one {"name": ..., "arguments": {...}} call to any of tools."""
+    calls = []
+    for tool in tools:
+        function = tool.get("function") or {}
+        if not function.get("name"):
+            continue
+        calls.append(
+            {
+                "type": "object",
+                "properties": {
+                    "name": {"const": function["name"]},
+                    "arguments": function.get("parameters") or {"type": "object"},
+                },
+                "required": ["name", "arguments"],
+                "additionalProperties": False,
+            }
+        )
+    if len(calls) == 1:
+        return calls[0]
+    return {"oneOf": calls}
+
+
+class ToolGrammarCache:
+    """Compiled tool-call grammars keyed by a hash of the tool schemas."""
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._grammars: "OrderedDict[str, Optional[LlamaGrammar]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self.hits = 0
+        self.compiles = 0
+        self.failures = 0
+
+    def get(self, tools: List[Dict[str, Any]]) -> Optional[LlamaGrammar]:
+        """Grammar for tools, or None if their schemas cannot be compiled."""
+        key = content_hash(tools)
+        with self._lock:
+            if key in self._grammars:
+                self._grammars.move_to_end(key)
+                self.hits += 1
+                return self._grammars[key]
+
+        started = time.monotonic()
+        try:
+            grammar = LlamaGrammar.from_json_schema(
+                json.dumps(tool_call_schema(tools)), verbose=False
+            )
+            self.compiles += 1
+            logger.debug(
+                f"Compiled tool-call grammar for {len(tools)} tools in "
+                f"{time.monotonic() - started:.3f}s"
+            )
+        except Exception as e:
+            # Unsupported schema features: generate tool calls unconstrained
+            logger.warning(f"Could not compile tool schemas into a grammar: {e}")
+            self.failures += 1
+            grammar = None
+
+        with self._lock:
+            self._grammars[key] = grammar
+            while len(self._grammars) > self.max_entries:
+                self._grammars.popitem(last=False)
+        return grammar
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._grammars),
+                "hits": self.hits,
+                "compiles": self.compiles,
+                "failures": self.failures,
+            }
+
+
+class _ToolCallStart:
+    """StoppingCriteria that fires once the generated tokens end with <tool_call>.
+
+    llama passes the evaluated tokens, so this fires one sampled token after the
+    tag; that extra token is discarded and the tag itself is part of the output.
+    """
+
+    def __init__(self, open_tokens: List[int], prompt_length: int):
+        self.open_tokens = open_tokens
+        self.prompt_length = prompt_length
+        self.triggered = False
+
+    def __call__(self, input_ids, logits) -> bool:
+        n = len(self.open_tokens)
+        if len(input_ids) - n >= self.prompt_length and list(input_ids[-n:]) == self.open_tokens:
+            self.triggered = True
+        return self.triggered
+
+
+def _text_chunk(template: Dict[str, Any], text: str, finish_reason: Optional[str] = None):
+    return {
+        "id": template["id"],
+        "object": "text_completion",
+        "created": template["created"],
+        "model": template["model"],
+        "choices": [
+            {"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}
+        ],
+    }
+
+
+def constrained_tool_completion(
+    llama: Llama,
+    prompt_tokens: List[int],
+    grammar: LlamaGrammar,
+    max_tokens: int,
+    stop: List[str],
+    stopping_criteria: Optional[List[Any]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    **completion_kwargs,
+) -> Iterator[Dict[str, Any]]:
+    """Stream a text completion whose tool calls are generated under grammar.
+
+    Generation alternates between free segments, which stop as soon as the model
+    opens a <tool_call> block, and constrained segments that produce exactly one
+    call object (the grammar ends in EOS). The tag newlines and the closing tag
+    are inserted by the server. Each segment continues from the KV state of the
+    previous one, so only the inserted tokens are evaluated again. Yields llama
+    text completion chunks, ending with one that carries the finish_reason.
+    """
+    open_tokens = llama.tokenize(TOOL_CALL_OPEN.encode("utf-8"), add_bos=False, special=True)
+    close_tokens = llama.tokenize(
+        f"\n{TOOL_CALL_CLOSE}".encode("utf-8"), add_bos=False, special=True
+    )
+    newline_tokens = llama.tokenize(b"\n", add_bos=False, special=True)
+
+    tokens = list(prompt_tokens)
+    template: Optional[Dict[str, Any]] = None
+    finish_reason = "length"
+    in_call = False
+    segments = 0
+    cache = llama.cache
+    saves = not isinstance(cache, PrefixStateCache) or cache.fits(len(prompt_tokens))
+    if not saves:
+        # The state would be over the prefix cache budget; look up but never store
+        cache.detach(llama, tokens)
+    try:
+        while True:
+            budget = max_tokens
+            if max_tokens > 0:
+                budget = max_tokens - (len(tokens) - len(prompt_tokens))
+                if budget <= 0:
+                    finish_reason = "length"
+                    break
+
+            detector = None if in_call else _ToolCallStart(open_tokens, len(tokens))
+            criteria = list(stopping_criteria or []) + ([detector] if detector else [])
+            segment_finish = "length"
+            for chunk in llama.create_completion(
+                prompt=tokens,
+                max_tokens=budget,
+                stop=[] if in_call else stop,
+                stopping_criteria=StoppingCriteriaList(criteria) if criteria else None,
+                grammar=grammar if in_call else None,
+                stream=True,
+                **completion_kwargs,
+            ):
+                if template is None:
+                    template = chunk
+                choice = chunk["choices"][0]
+                if choice["finish_reason"] is not None:
+                    segment_finish = choice["finish_reason"]
+                if choice["text"]:
+                    yield _text_chunk(template, choice["text"])
+            # Later segments resume from the live KV state; the cache is only
+            # consulted for the first one and written once at the end
+            llama.cache = None
+            segments += 1
+
+            finish_reason = segment_finish
+            if segment_finish != "stop" or (cancel_token is not None and cancel_token.cancelled):
+                break
+            if in_call:
+                # The grammar accepted one complete call object
+                yield _text_chunk(template, f"\n{TOOL_CALL_CLOSE}")
+                forced = close_tokens
+                in_call = False
+            elif detector.triggered:
+                yield _text_chunk(template, "\n")
+                forced = newline_tokens
+                in_call = True
+            else:
+                # EOS or a stop sequence outside a tool call
+                break
+            tokens = llama.input_ids[: llama.n_tokens].tolist() + forced
+    finally:
+        llama.cache = cache
+
+    if cache is not None and segments > 1 and saves:
+        cache[llama.input_ids[: llama.n_tokens].tolist()] = llama.save_state()
+    if template is not None:
+        yield _text_chunk(template, "", finish_reason)
+
+
+def collect_completion(
+    chunks: Iterator[Dict[str, Any]], model: Llama, prompt_tokens: List[int]
+) -> Dict[str, Any]:
+    """Fold the chunks of constrained_tool_completion into one text completion."""
+    parts = []
+    last = None
+    for chunk in chunks:
+        parts.append(chunk["choices"][0]["text"])
+        last = chunk
+    completion_tokens = max(model.n_tokens - len(prompt_tokens), 0)
+    completion = _text_chunk(last, "".join(parts), last["choices"][0]["finish_reason"])
+    completion["usage"] = {
+        "prompt_tokens": len(prompt_tokens),
+        "completion_tokens": completion_tokens,
+        "total_tokens": len(prompt_tokens) + completion_tokens,
+    }
+    return completion
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Transport Bench - Compares TCP loopback with a Unix domain socket between the
+client and the server: per-request overhead (sequential GET /health on a
+keep-alive session) and per-chunk overhead (inter-frame gaps of a streamed
+chat completion).
+
+By default it starts two fake-backend servers with zero simulated latency, one
+per transport, so the numbers are transport and server overhead only. Pass
+--tcp_url and --unix_url to measure servers that are already running.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from distiller_cm5_python.client.llm_infra.transport import (
+    client_session,
+    get_status,
+    http_base_url,
+)
+from distiller_cm5_python.llm_server.loadgen import DEFAULT_BODY, percentile
+from distiller_cm5_python.utils.logger import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+START_TIMEOUT_S = 30.0
+
+
+def _latency(values: List[float]) -> Dict[str, Optional[float]]:
+    """Microsecond statistics of a list of durations in seconds."""
+    return {
+        name: round(value * 1e6, 1) if value is not None else None
+        for name, value in (
+            ("mean", sum(values) / len(values) if values else None),
+            ("p50", percentile(values, 50)),
+            ("p99", percentile(values, 99)),
+        )
+    }
+
+
+async def bench_requests(server_url: str, requests: int) -> Dict[str, Any]:
+    """Round trip of sequential GET /health requests on one connection."""
+    endpoint = f"{http_base_url(server_url)}/health"
+    durations = []
+    async with client_session(server_url) as session:
+        # The first request opens the connection; it is not measured
+        async with session.get(endpoint) as response:
+            await response.read()
+        for _ in range(requests):
+            started = time.perf_counter()
+            async with session.get(endpoint) as response:
+                await response.read()
+            durations.append(time.perf_counter() - started)
+    return {"requests": requests, "request_us": _latency(durations)}
+
+
+async def bench_chunks(server_url: str, streams: int, model: str) -> Dict[str, Any]:
+    """Gaps between consecutive SSE frames of streamed chat completions."""
+    endpoint = f"{http_base_url(server_url)}/chat/completions"
+    body = {**DEFAULT_BODY, "model": model, "stream": True}
+    body["inference_configs"] = {**DEFAULT_BODY["inference_configs"], "max_tokens": 256}
+    gaps = []
+    frames = 0
+    async with client_session(server_url) as session:
+        for _ in range(streams):
+            last = None
+            async with session.post(endpoint, json=body) as response:
+                response.raise_for_status()
+                async for raw_line in response.content:
+                    if not raw_line.startswith(b"data:"):
+                        continue
+                    now = time.perf_counter()
+                    if last is not None:
+                        gaps.append(now - last)
+                    last = now
+                    frames += 1
+    return {"streams": streams, "frames": frames, "chunk_us": _latency(gaps)}
+
+
+async def bench(server_url: str, requests: int, streams: int, model: str) -> Dict[str, Any]:
+    report = await bench_requests(server_url, requests)
+    report.update(await bench_chunks(server_url, streams, model))
+    return report
+
+
+def _wait_ready(server_url: str, process: subprocess.Popen):
+    deadline = time.monotonic() + START_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server for {server_url} exited with code {process.returncode}")
+        try:
+            if get_status(server_url, "/health", timeout=1) == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server for {server_url} did not start within {START_TIMEOUT_S}s")
+
+
+def _start_server(bind_args: List[str], model: str) -> subprocess.Popen:
+    command = [
+        sys.executable,
+        SERVER_SCRIPT,
+        *bind_args,
+        "--backend",
+        "fake",
+        "--model_name",
+        model,
+        "--fake_prompt_ms_per_token",
+        "0",
+        "--fake_token_ms",
+        "0",
+        "--log-level",
+        "warning",
+    ]
+    logger.info(f"Starting server: {' '.join(command)}")
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+
+def format_report(reports: Dict[str, Dict[str, Any]]) -> str:
+    lines = [f"{'':<6} {'request mean':>12} {'p50':>8} {'p99':>8}   {'chunk mean':>10} {'p50':>8} {'p99':>8}"]
+    for name, report in reports.items():
+        request, chunk = report["request_us"], report["chunk_us"]
+        lines.append(
+            f"{name:<6} {request['mean']:>10.1f}us {request['p50']:>6.1f}us {request['p99']:>6.1f}us"
+            f"   {chunk['mean']:>8.1f}us {chunk['p50']:>6.1f}us {chunk['p99']:>6.1f}us"
+        )
+    tcp, unix = reports.get("tcp"), reports.get("unix")
+    if tcp and unix:
+        lines.append(
+            f"unix/tcp: requests {unix['request_us']['mean'] / tcp['request_us']['mean']:.2f}x, "
+            f"chunks {unix['chunk_us']['mean'] / tcp['chunk_us']['mean']:.2f}x"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP vs Unix socket transport benchmark")
+    parser.add_argument("--tcp_url", type=str, default=None, help="Running server to use over TCP")
+    parser.add_argument(
+        "--unix_url", type=str, default=None, help="Running server to use, as unix:///path"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port of the TCP server started")
+    parser.add_argument("--model", type=str, default="fake.gguf", help="Model name in requests")
+    parser.add_argument("--requests", type=int, default=2000, help="Sequential requests to time")
+    parser.add_argument("--streams", type=int, default=20, help="Streamed completions to time")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        default="warning",
+        choices=["debug", "info", "warning", "error", "critical"],
+        help="Log level",
+    )
+    args = parser.parse_args()
+    setup_logging(log_level=getattr(logging, args.log_level.upper(), logging.WARNING))
+
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        targets = {"tcp": args.tcp_url, "unix": args.unix_url}
+        try:
+            if targets["tcp"] is None:
+                targets["tcp"] = f"http://127.0.0.1:{args.port}"
+                processes.append(
+                    (targets["tcp"], _start_server(["--port", str(args.port)], args.model))
+                )
+            if targets["unix"] is None:
+                socket_path = os.path.join(tmp_dir, "llm_server.sock")
+                targets["unix"] = f"unix://{socket_path}"
+                processes.append((targets["unix"], _start_server(["--uds", socket_path], args.model)))
+            for server_url, process in processes:
+                _wait_ready(server_url, process)
+
+            reports = {
+                name: asyncio.run(bench(server_url, args.requests, args.streams, args.model))
+                for name, server_url in targets.items()
+            }
+        except (RuntimeError, aiohttp.ClientError) as e:
+            sys.exit(f"Error: {e}")
+        finally:
+            for _, process in processes:
+                process.terminate()
+                process.wait(timeout=10)
+
+    print(json.dumps(reports, indent=2) if args.json else format_report(reports))
+
+
+if __name__ == "__main__":
+    main()
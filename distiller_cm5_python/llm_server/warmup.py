@@ -0,0 +1,37 @@
+"""
+Warmup Spec - The static prompt prefix (system prompt + tool schemas) the server
+pre-evaluates at boot so the first query after power-on starts from a warm KV cache.
+
+The spec is a JSON file, usually written by the client once it knows its tools:
+
+    {"messages": [{"role": "system", "content": "..."}, ...], "tools": [...]}
+
+A bare {"system_prompt": "...", "tools": [...]} is accepted as well.
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def load_warmup_spec(path: str) -> Optional[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """Return (messages, tools) from a warmup spec file, or None if there is none."""
+    try:
+        with open(path, "r") as f:
+            spec = json.load(f)
+    except FileNotFoundError:
+        logger.info(f"No warmup spec at {path}, skipping boot warmup")
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable warmup spec {path}: {e}")
+        return None
+
+    messages = spec.get("messages")
+    if not messages and spec.get("system_prompt"):
+        messages = [{"role": "system", "content": spec["system_prompt"]}]
+    if not messages:
+        logger.warning(f"Warmup spec {path} has no messages or system_prompt, skipping")
+        return None
+    return messages, spec.get("tools") or []
+
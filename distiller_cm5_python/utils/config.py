@@ -109,10 +109,17 @@ class Config:
             "LLM_TOP_K": ["top_k"],
             "LLM_REPETITION_PENALTY": ["repetition_penalty"],
             "LLM_N_CTX": ["n_ctx"],
+            "LLM_KV_CACHE_TYPE": ["kv_cache_type"],
+            "LLM_FIT_N_CTX": ["fit_n_ctx"],
+            "LLM_PREFETCH_MODEL": ["prefetch_model"],
+            "LLM_USE_MLOCK": ["use_mlock"],
             "LLM_MAX_TOKENS": ["max_tokens"],
             "LLM_STOP": ["stop"],  # Needs careful handling for list conversion
             "STREAMING_ENABLED": ["streaming"],
             "STREAMING_CHUNK_SIZE": ["streaming_chunk_size"],
+            "STREAMING_INTERVAL_MS": ["streaming_interval_ms"],
+            "LLM_TOOL_GRAMMAR": ["tool_grammar"],
+            "LLM_SESSIONS": ["sessions"],
             "MAX_MESSAGES_LENGTH": ["max_messages_length"],
         }
 
@@ -314,7 +321,16 @@ TIMEOUT = get_active_config("timeout", 120)  # Provide a sensible default
 STREAMING_ENABLED = get_active_config("streaming", True)  # Default to True
 STREAMING_CHUNK_SIZE = get_active_config(
     "streaming_chunk_size", 4
-)  # Default based on old config
+)  # Tokens coalesced into one SSE frame by the llama-cpp server
+STREAMING_INTERVAL_MS = get_active_config(
+    "streaming_interval_ms", 30
+)  # Max time a streamed token waits for its frame
+TOOL_GRAMMAR = get_active_config(
+    "tool_grammar", None
+)  # Constrain tool calls to their JSON schemas; None keeps the server default
+SESSIONS_ENABLED = get_active_config(
+    "sessions", False
+)  # Keep the conversation in a llama-cpp server session and upload only new messages
 
 # Other parameters from the active provider (with defaults)
 TEMPERATURE = get_active_config("temperature", 0.7)
@@ -323,10 +339,25 @@ TOP_K = get_active_config("top_k", 20)
 MIN_P = get_active_config("min_p", 0.0)
 REPETITION_PENALTY = get_active_config("repetition_penalty", 1.0)
 N_CTX = get_active_config("n_ctx", 32768)  # Context window size
+KV_CACHE_TYPE = get_active_config(
+    "kv_cache_type", "f16"
+)  # llama-cpp KV cache type for keys and values, e.g. "q8_0" to halve its RAM
+FIT_N_CTX = get_active_config(
+    "fit_n_ctx", False
+)  # Let the llama-cpp server shrink n_ctx to what free RAM allows
+PREFETCH_MODEL = get_active_config(
+    "prefetch_model", True
+)  # Read the model file into the page cache while the llama-cpp server starts
+USE_MLOCK = get_active_config(
+    "use_mlock", False
+)  # Lock the model weights in RAM so they are never paged out
 MAX_TOKENS = get_active_config("max_tokens", 4096)  # Max generation tokens
 STOP = get_active_config("stop", ["\n\n"])  # Stop sequences
 MAX_MESSAGES_LENGTH = get_active_config("max_messages_length", 100)  # History length
 LLAMA_CPP_START_WAIT_TIME = get_active_config("timeout", 30)  # Default 3 seconds
+WARMUP_SPEC_PATH = get_active_config(
+    "warmup_spec_path", None
+)  # Opt-in: system prompt + tools the local llama-cpp server pre-evaluates at boot
 
 # Non-LLM specific configurations (remain as before)
 DEFAULT_SYSTEM_PROMPT = config.get(
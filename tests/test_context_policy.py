@@ -0,0 +1,95 @@
+"""ContextFitter policies, with one prompt token per character."""
+import pytest
+
+from distiller_cm5_python.llm_server.context_policy import (
+    MIN_TOOL_RESULT_CHARS,
+    ContextFitter,
+    ContextOverflowError,
+)
+
+
+def build(messages):
+    # A role token, then one token per character of content
+    tokens = []
+    for message in messages:
+        tokens.append(ord(message["role"][0]))
+        tokens.extend(ord(c) for c in message["content"])
+    return tokens
+
+
+def conversation(turns, chars=100):
+    messages = [{"role": "system", "content": "s" * 50}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": str(i) * chars})
+        messages.append({"role": "assistant", "content": str(i) * chars})
+    return messages
+
+
+def test_prompt_that_fits_is_left_alone():
+    messages = conversation(2)
+    fitted, tokens, report = ContextFitter(build, n_ctx=1024, reserve_tokens=64).fit(
+        messages, "drop_oldest"
+    )
+
+    assert fitted is messages
+    assert tokens == build(messages)
+    assert report is None
+
+
+def test_drop_oldest_keeps_system_and_latest_turns():
+    messages = conversation(4)
+    fitter = ContextFitter(build, n_ctx=600, reserve_tokens=100)
+    fitted, tokens, report = fitter.fit(messages, "drop_oldest")
+
+    assert len(tokens) <= fitter.budget
+    assert fitted[0] == messages[0]
+    assert fitted[-2:] == messages[-2:]
+    # Whole turns go: each is a user message and its answer
+    assert report["dropped_messages"] == len(messages) - len(fitted)
+    assert report["dropped_messages"] % 2 == 0
+    assert report["prompt_tokens"] == len(tokens)
+
+
+def test_truncate_tool_results_shortens_the_longest_result():
+    messages = [
+        {"role": "system", "content": "s" * 50},
+        {"role": "user", "content": "u" * 50},
+        {"role": "tool", "content": "t" * 2000},
+        {"role": "tool", "content": "k" * 100},
+    ]
+    fitter = ContextFitter(build, n_ctx=1200, reserve_tokens=200)
+    fitted, tokens, report = fitter.fit(messages, "truncate_tool_results")
+
+    assert len(tokens) <= fitter.budget
+    assert report["truncated_tool_results"] == 1
+    assert report["dropped_messages"] == 0
+    assert "[truncated" in fitted[2]["content"]
+    assert len(fitted[2]["content"]) >= MIN_TOOL_RESULT_CHARS
+    assert fitted[3] == messages[3]
+    # The request's own messages are not modified
+    assert messages[2]["content"] == "t" * 2000
+
+
+def test_sliding_window_keeps_the_system_prefix_and_the_recent_tail():
+    messages = conversation(4)
+    tokens = build(messages)
+    fitter = ContextFitter(build, n_ctx=400, reserve_tokens=100)
+    _, fitted, report = fitter.fit(messages, "sliding_window")
+
+    prefix = build(messages[:1])
+    assert len(fitted) == fitter.budget
+    assert fitted[: len(prefix)] == prefix
+    assert fitted[len(prefix) :] == tokens[len(tokens) - (fitter.budget - len(prefix)) :]
+    assert report["dropped_tokens"] == len(tokens) - len(fitted)
+
+
+def test_error_policy_keeps_llama_wording():
+    messages = conversation(4)
+    with pytest.raises(ContextOverflowError, match=r"Requested tokens \(\d+\) exceed context"):
+        ContextFitter(build, n_ctx=400, reserve_tokens=100).fit(messages, "error")
+
+
+def test_latest_turn_alone_too_long_is_rejected():
+    messages = conversation(1, chars=1000)
+    with pytest.raises(ContextOverflowError):
+        ContextFitter(build, n_ctx=600, reserve_tokens=100).fit(messages, "drop_oldest")
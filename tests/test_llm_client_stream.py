@@ -0,0 +1,42 @@
+"""The client's streaming parser sees tags that the server's frames split."""
+from distiller_cm5_python.client.mid_layer.llm_client import _THINK_TAG_RE, _split_partial_tag
+
+
+def handle(frames):
+    """Content as the streaming loop hands it on, one entry per frame, plus what is
+    still held back when the stream ends."""
+    held, handled = "", []
+    for frame in frames:
+        content, held = _split_partial_tag(held + frame)
+        handled.append(content)
+    return handled, held
+
+
+def test_tag_split_across_frames_is_held_until_complete():
+    handled, held = handle(["Let me check <tool", "_call>\n{\"name\": \"clock\"}"])
+
+    assert handled[0] == "Let me check "
+    assert handled[1].startswith("<tool_call>")
+    assert held == ""
+
+
+def test_think_tags_split_across_frames_are_removed():
+    handled, held = handle(["<th", "ink>\nplanning</th", "ink>\n\nAnswer"])
+
+    assert [_THINK_TAG_RE.sub("", content) for content in handled] == ["", "planning", "Answer"]
+    assert held == ""
+
+
+def test_text_that_only_looks_like_a_tag_is_released():
+    handled, held = handle(["1 <", " 2 and x <t", "able>"])
+
+    assert "".join(handled) == "1 < 2 and x <table>"
+    assert held == ""
+
+
+def test_stream_ending_on_a_partial_tag_keeps_it_held():
+    handled, held = handle(["so a <thi"])
+
+    assert handled == ["so a "]
+    # The stream loop flushes this once the response is complete
+    assert held == "<thi"
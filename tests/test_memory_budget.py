@@ -0,0 +1,41 @@
+"""n_ctx fitting to free RAM."""
+from distiller_cm5_python.llm_server.memory_budget import MIN_N_CTX, N_CTX_ALIGN, fit_n_ctx
+
+MB = 1 << 20
+
+
+def test_requested_n_ctx_is_kept_when_it_fits():
+    n_ctx, report = fit_n_ctx(4096, 1000 * MB, 100_000, 4000 * MB, 500 * MB)
+
+    assert n_ctx == 4096
+    assert report["limited_by"] == "requested"
+
+
+def test_memory_limits_n_ctx_for_every_slot():
+    # 1000 MB left for the KV cache at 128 KB per token, over two slots
+    n_ctx, report = fit_n_ctx(32768, 1000 * MB, 128 << 10, 2500 * MB, 500 * MB, n_contexts=2)
+
+    assert report["limited_by"] == "memory"
+    assert n_ctx % N_CTX_ALIGN == 0
+    assert n_ctx * (128 << 10) * 2 <= 1000 * MB
+    assert (n_ctx + N_CTX_ALIGN) * (128 << 10) * 2 > 1000 * MB
+
+
+def test_trained_context_caps_n_ctx():
+    n_ctx, report = fit_n_ctx(32768, 0, 1024, 8000 * MB, 0, trained_n_ctx=8192)
+
+    assert n_ctx == 8192
+    assert report["limited_by"] == "trained_context_length"
+
+
+def test_never_below_the_minimum():
+    n_ctx, _ = fit_n_ctx(4096, 1000 * MB, 128 << 10, 1000 * MB, 500 * MB)
+
+    assert n_ctx == MIN_N_CTX
+
+
+def test_unknown_memory_keeps_the_request():
+    n_ctx, report = fit_n_ctx(4096, 1000 * MB, 0, 0, 500 * MB)
+
+    assert n_ctx == 4096
+    assert report["limited_by"] == "unknown_memory"
@@ -0,0 +1,75 @@
+"""ModelPool residency bounds and background-load matching, on fake-backend models."""
+import asyncio
+
+from distiller_cm5_python.llm_server.backends import FakeBackend
+from distiller_cm5_python.llm_server.model_loader import ModelLoadTask
+from distiller_cm5_python.llm_server.model_pool import ModelPool, ResidentModel
+
+BACKEND = FakeBackend(prompt_eval_s_per_token=0.0, token_s=0.0)
+
+
+def load(model_path, load_model_configs):
+    return BACKEND.load(model_path, load_model_configs.get("n_ctx", 512))
+
+
+def model_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(bytes(size))
+    return str(path)
+
+
+def test_evicts_least_recently_used_beyond_max_models():
+    pool = ModelPool(load, max_models=2)
+    for name in ("a", "b", "a", "c"):
+        pool.acquire(name, name, {})
+
+    assert list(pool.stats()["resident_models"]) == ["a", "c"]
+    assert pool.active == "c"
+    assert pool.loads == 3
+    assert pool.hits == 1
+    assert pool.evictions == 1
+
+
+def test_ram_budget_unloads_the_previous_model(tmp_path):
+    pool = ModelPool(load, max_models=4, ram_budget_bytes=1000)
+    pool.acquire("a", model_file(tmp_path, "a.gguf", 600), {})
+    pool.acquire("b", model_file(tmp_path, "b.gguf", 600), {})
+
+    assert pool.stats()["resident_models"] == ["b"]
+    assert pool.resident_bytes == 600
+
+
+def test_background_switch_unloads_the_replaced_model():
+    pool = ModelPool(load, max_models=1)
+    pool.acquire("a", "a", {})
+    # What ModelLoader does off the worker: the active model keeps serving meanwhile
+    pool.add(ResidentModel("b", load("b", {}), {}, 0.0))
+    assert pool.stats()["resident_models"] == ["a", "b"]
+
+    pool.acquire("b", "b", {})
+
+    assert pool.stats()["resident_models"] == ["b"]
+    assert pool.active == "b"
+    assert pool.loads == 2
+
+
+def test_other_load_configs_replace_the_resident_model():
+    pool = ModelPool(load, max_models=2)
+    pool.acquire("a", "a", {"n_ctx": 512})
+    resident = pool.acquire("a", "a", {"n_ctx": 1024})
+
+    assert pool.stats()["resident_models"] == ["a"]
+    assert resident.model.n_ctx() == 1024
+    assert pool.hits == 0
+
+
+def test_load_task_matches_name_and_load_configs():
+    async def check():
+        task = ModelLoadTask("a", "a.gguf", {"n_ctx": 512, "cache_type": "q8_0"})
+        return (
+            task.matches("a", {"n_ctx": 512}),
+            task.matches("a", {"n_ctx": 1024}),
+            task.matches("b", {}),
+        )
+
+    assert asyncio.run(check()) == (True, False, False)
@@ -0,0 +1,88 @@
+"""Prefix state cache lookups, byte budget and skipped saves, on a fake model."""
+from distiller_cm5_python.llm_server.backends import FakeBackend
+from distiller_cm5_python.llm_server.kv_fork import shared_prefix_length
+from distiller_cm5_python.llm_server.prefix_cache import (
+    PrefixStateCache,
+    create_completion_within_budget,
+)
+
+BACKEND = FakeBackend(prompt_eval_s_per_token=0.0, token_s=0.0, reply="ok")
+
+
+def model_with_cache(**options):
+    model = BACKEND.load("fake.gguf", 512)
+    model.set_cache(PrefixStateCache(state_bytes_per_token=model.state_bytes_per_token, **options))
+    return model
+
+
+def state_of(model, tokens):
+    model.reset()
+    model.eval(tokens)
+    return model.save_state()
+
+
+def test_longest_cached_prefix_wins():
+    model = model_with_cache(min_prefix_tokens=4)
+    cache = model.cache
+    cache[list(range(8))] = state_of(model, list(range(8)))
+    cache[list(range(100, 120))] = state_of(model, list(range(100, 120)))
+
+    prefix_len, state = cache.lookup(list(range(100, 112)) + [7, 7])
+    assert prefix_len == 12
+    assert state.n_tokens == 20
+    # Too short a match is a miss
+    assert cache.lookup([0, 1, 2, 9]) == (0, None)
+
+
+def test_byte_budget_evicts_and_skips_oversized_states():
+    model = model_with_cache(min_prefix_tokens=4, capacity_bytes=100 * 4096)
+    cache = model.cache
+    cache[list(range(60))] = state_of(model, list(range(60)))
+    cache[list(range(200, 260))] = state_of(model, list(range(200, 260)))
+
+    assert cache.stats()["entries"] == 1
+    assert cache.evictions == 1
+    assert cache.cache_size <= cache.capacity_bytes
+
+    cache[list(range(300, 420))] = state_of(model, list(range(300, 420)))
+    assert cache.oversized == 1
+    assert cache.stats()["entry_tokens"] == [60]
+
+
+def test_completion_saves_its_state_when_it_fits():
+    model = model_with_cache(capacity_bytes=1 << 20)
+    prompt = list(range(1000, 1040))
+    create_completion_within_budget(model, prompt, max_tokens=8, model="fake.gguf")
+
+    assert model.cache.saves == 1
+    assert model.cache.skipped_saves == 0
+
+
+def test_completion_over_the_budget_reuses_but_does_not_save():
+    model = model_with_cache(capacity_bytes=64 * 4096)
+    cache = model.cache
+    cache[list(range(32))] = state_of(model, list(range(32)))
+    model.reset()
+    prompt = list(range(32)) + list(range(1000, 1100))
+
+    evaluated = model.evaluated_tokens
+    chunks = create_completion_within_budget(
+        model, prompt, stream=True, max_tokens=8, model="fake.gguf"
+    )
+    assert model.cache is None
+    text = "".join(chunk["choices"][0]["text"] for chunk in chunks)
+
+    assert text == "ok"
+    assert model.cache is cache
+    assert cache.saves == 1
+    assert cache.skipped_saves == 1
+    assert cache.hits == 1
+    # Only the part after the cached prefix was evaluated for the prompt
+    assert model.evaluated_tokens - evaluated < len(prompt)
+
+
+def test_shared_prefix_leaves_a_token_to_evaluate():
+    assert shared_prefix_length([[1, 2, 3, 4], [1, 2, 3, 5], [1, 2, 3, 4, 6]]) == 3
+    assert shared_prefix_length([[1, 2, 3], [1, 2, 3]]) == 2
+    assert shared_prefix_length([[1, 2], [3, 4]]) == 0
+    assert shared_prefix_length([]) == 0
@@ -0,0 +1,68 @@
+"""Response cache keys and LRU/TTL behaviour."""
+from distiller_cm5_python.llm_server.response_cache import ResponseCache, response_key
+
+MESSAGES = [{"role": "user", "content": "What time is it?"}]
+TOOLS = [{"type": "function", "function": {"name": "clock", "parameters": {"type": "object"}}}]
+
+
+def key(**overrides):
+    parts = {
+        "model": "qwen.gguf",
+        "load_model_configs": {"n_ctx": 4096},
+        "messages": MESSAGES,
+        "tools": TOOLS,
+        "inference_configs": {"temperature": 0, "max_tokens": 64},
+        "stream": False,
+        "stream_options": None,
+    }
+    parts.update(overrides)
+    return response_key(**parts)
+
+
+def test_key_ignores_dict_order():
+    reordered = {"max_tokens": 64, "temperature": 0}
+    assert key(inference_configs=reordered) == key()
+    assert key(load_model_configs={"n_ctx": 4096}) == key()
+
+
+def test_key_covers_everything_that_decides_the_response():
+    base = key()
+    assert key(model="other.gguf") != base
+    assert key(load_model_configs={"n_ctx": 2048}) != base
+    assert key(messages=[{"role": "user", "content": "What day is it?"}]) != base
+    assert key(tools=[]) != base
+    assert key(inference_configs={"temperature": 0, "max_tokens": 65}) != base
+    assert key(stream=True) != base
+    # Frames of a stream depend on how tokens were coalesced
+    assert key(stream=True, stream_options={"chunk_tokens": 4}) != key(stream=True)
+
+
+def test_lru_eviction_and_copies():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", {"choices": [{"message": {"content": "A"}}]})
+    cache.put("b", [b"data: b\n\n"])
+    assert cache.get("a") is not None
+    cache.put("c", [b"data: c\n\n"])
+
+    assert cache.get("b") is None
+    assert cache.get("c") == [b"data: c\n\n"]
+    # Callers may change what they get back
+    cache.get("a")["choices"][0]["message"]["content"] = "changed"
+    assert cache.get("a")["choices"][0]["message"]["content"] == "A"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_miss():
+    cache = ResponseCache(max_entries=4, ttl_s=-1.0)
+    cache.put("a", [b"data: a\n\n"])
+
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache()
+    cache.put("a", [b"data: a\n\n"])
+
+    assert not cache.enabled
+    assert cache.get("a") is None
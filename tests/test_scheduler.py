@@ -0,0 +1,86 @@
+"""Admission limits of the inference scheduler, with cancelled and abandoned jobs."""
+import asyncio
+import threading
+
+import pytest
+
+from distiller_cm5_python.llm_server.scheduler import InferenceScheduler, QueueFullError
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def blocked_scheduler(max_queue_size):
+    """A started scheduler whose only worker is busy until the returned event is set."""
+    scheduler = InferenceScheduler(max_queue_size=max_queue_size)
+    await scheduler.start()
+    release = threading.Event()
+    running = asyncio.ensure_future(scheduler.submit(release.wait, job_id="running"))
+    while scheduler.queue_info("running") is None or scheduler.queue_depth:
+        await asyncio.sleep(0.01)
+    return scheduler, release, running
+
+
+def test_full_queue_rejects():
+    async def check():
+        scheduler, release, running = await blocked_scheduler(1)
+        queued = asyncio.ensure_future(scheduler.submit(lambda: "a", job_id="a"))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            scheduler.check_admission()
+        release.set()
+        await running
+        assert await queued == "a"
+        await scheduler.stop()
+
+    run(check())
+
+
+def test_dropped_jobs_stop_counting_at_once():
+    async def check():
+        scheduler, release, running = await blocked_scheduler(2)
+        queued = asyncio.ensure_future(scheduler.submit(lambda: "a", job_id="a", client="x"))
+        stream = scheduler.submit_stream(lambda: iter(["b"]), job_id="b", client="x")
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 2
+
+        assert scheduler.drop_queued("a", RuntimeError("cancelled a")) == 1
+        assert scheduler.drop_queued("b", RuntimeError("cancelled b")) == 1
+        assert scheduler.queue_depth == 0
+        assert scheduler.stats()["queued_by_client"] == {}
+        scheduler.check_admission()
+
+        with pytest.raises(RuntimeError, match="cancelled a"):
+            await queued
+        with pytest.raises(RuntimeError, match="cancelled b"):
+            async for _ in stream:
+                pass
+        release.set()
+        await running
+        await scheduler.stop()
+
+    run(check())
+
+
+def test_abandoned_stream_frees_its_queue_place():
+    async def check():
+        scheduler, release, running = await blocked_scheduler(1)
+        stream = scheduler.submit_stream(lambda: iter(["a"]), job_id="a")
+        reader = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 1
+
+        # The client went away before the job started
+        reader.cancel()
+        await asyncio.sleep(0)
+        await stream.aclose()
+        await asyncio.sleep(0)
+
+        assert scheduler.queue_depth == 0
+        scheduler.check_admission()
+        release.set()
+        await running
+        await scheduler.stop()
+
+    run(check())
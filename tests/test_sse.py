@@ -0,0 +1,112 @@
+"""SSE chunk compaction and token coalescing."""
+import asyncio
+import json
+import time
+
+from distiller_cm5_python.llm_server.sse import (
+    DONE_FRAME,
+    coalesce_chunks,
+    compact_chunk,
+    encode_frame,
+    encode_frames,
+)
+
+
+def content_chunk(text):
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+    }
+
+
+def finish_chunk():
+    return {"id": "chatcmpl-1", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+
+async def stream(items, delays=None):
+    for i, item in enumerate(items):
+        if delays and delays[i]:
+            await asyncio.sleep(delays[i])
+        yield item
+
+
+def collect(chunks):
+    async def run():
+        return [(round(time.monotonic() - started, 2), chunk) async for chunk in chunks]
+
+    started = time.monotonic()
+    return asyncio.run(run())
+
+
+def contents(results):
+    return [
+        chunk["choices"][0]["delta"].get("content") if isinstance(chunk, dict) else chunk
+        for _, chunk in results
+    ]
+
+
+def test_compact_chunk_drops_null_and_empty_fields():
+    chunk = {
+        "id": "chatcmpl-1",
+        "system_fingerprint": None,
+        "choices": [
+            {"index": 0, "delta": {"role": None}, "logprobs": None, "finish_reason": None}
+        ],
+    }
+
+    assert compact_chunk(chunk) == {"id": "chatcmpl-1", "choices": [{"index": 0}]}
+    frame = encode_frame(chunk)
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    assert json.loads(frame[len(b"data: ") :]) == compact_chunk(chunk)
+
+
+def test_merges_up_to_max_tokens():
+    chunks = [content_chunk(c) for c in "abcde"]
+    results = collect(coalesce_chunks(stream(chunks), max_tokens=2))
+
+    assert contents(results) == ["ab", "cd", "e"]
+
+
+def test_other_chunks_flush_pending_content_and_pass_through():
+    role = {"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+    items = [role, content_chunk("a"), content_chunk("b"), finish_chunk(), DONE_FRAME]
+    results = collect(coalesce_chunks(stream(items), max_tokens=4))
+
+    assert [chunk for _, chunk in results] == [
+        role,
+        content_chunk("ab"),
+        finish_chunk(),
+        DONE_FRAME,
+    ]
+
+
+def test_interval_is_a_deadline_while_the_next_token_is_slow():
+    chunks = [content_chunk(c) for c in "abcd"]
+    results = collect(
+        coalesce_chunks(stream(chunks, [0, 0, 0, 0.3]), max_tokens=8, max_interval_s=0.05)
+    )
+
+    assert contents(results) == ["abc", "d"]
+    # "abc" went out at its deadline, not when "d" arrived
+    assert results[0][0] < 0.2
+
+
+def test_one_token_budget_with_an_interval_coalesces_by_time():
+    chunks = [content_chunk(c) for c in "abc"]
+    results = collect(coalesce_chunks(stream(chunks), max_tokens=1, max_interval_s=0.05))
+
+    assert contents(results) == ["abc"]
+
+
+def test_one_token_budget_without_an_interval_passes_through():
+    chunks = [content_chunk(c) for c in "abc"]
+    results = collect(coalesce_chunks(stream(chunks), max_tokens=1))
+
+    assert [chunk for _, chunk in results] == chunks
+
+
+def test_encode_frames_keeps_ready_frames():
+    results = collect(encode_frames(stream([content_chunk("a"), DONE_FRAME])))
+
+    assert [frame for _, frame in results] == [encode_frame(content_chunk("a")), DONE_FRAME]
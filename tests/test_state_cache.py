@@ -0,0 +1,80 @@
+"""Two-tier state store: budgets, the persistent index and legacy files."""
+import json
+import os
+
+import numpy as np
+from llama_cpp.llama import LlamaState
+
+from distiller_cm5_python.llm_server import state_cache
+from distiller_cm5_python.llm_server.state_cache import INDEX_FILENAME, StateCache
+
+
+def make_state(n_tokens, nbytes=1000):
+    return LlamaState(
+        input_ids=np.arange(n_tokens, dtype=np.intc),
+        scores=np.zeros((1, 8), dtype=np.single),
+        n_tokens=n_tokens,
+        llama_state=bytes(nbytes),
+        llama_state_size=nbytes,
+        seed=0,
+    )
+
+
+def index_keys(cache_dir):
+    with open(os.path.join(cache_dir, INDEX_FILENAME)) as f:
+        return [entry["key"] for entry in json.load(f)]
+
+
+def test_entries_survive_a_restart(tmp_path):
+    cache = StateCache(str(tmp_path))
+    key = StateCache.make_key([1, 2, 3], 4096)
+    cache.put(key, make_state(3))
+
+    reopened = StateCache(str(tmp_path))
+    state = reopened.get(key)
+
+    assert state is not None and state.n_tokens == 3
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.get(StateCache.make_key([1, 2, 3], 2048)) is None
+
+
+def test_tiers_evict_least_recently_used(tmp_path):
+    cache = StateCache(str(tmp_path), ram_capacity_bytes=2500, disk_capacity_bytes=2500)
+    for key in ("a", "b", "c"):
+        cache.put(key, make_state(4))
+
+    stats = cache.stats()
+    assert stats["ram_entries"] == 2 and stats["ram_bytes"] <= 2500
+    assert stats["disk_bytes"] <= 2500
+    assert "a" not in cache
+    assert not os.path.exists(os.path.join(tmp_path, "a" + state_cache.STATE_SUFFIX))
+
+
+def test_hits_reorder_the_index_lazily(tmp_path):
+    cache = StateCache(str(tmp_path))
+    cache.put("a", make_state(4))
+    cache.put("b", make_state(4))
+    reopened = StateCache(str(tmp_path))
+    index_path = os.path.join(tmp_path, INDEX_FILENAME)
+    written = os.stat(index_path).st_mtime_ns
+
+    reopened.get("a")
+    assert os.stat(index_path).st_mtime_ns == written
+    assert index_keys(tmp_path) == ["a", "b"]
+
+    reopened.flush()
+    assert index_keys(tmp_path) == ["b", "a"]
+
+
+def test_legacy_disk_cache_files_are_removed(tmp_path):
+    (tmp_path / "cache.db").write_bytes(b"sqlite")
+    (tmp_path / "cache.db-wal").write_bytes(b"")
+    (tmp_path / "3f").mkdir()
+    (tmp_path / "3f" / "a1").mkdir()
+    (tmp_path / "3f" / "a1" / "0123.val").write_bytes(b"pickle")
+    (tmp_path / "notes").mkdir()
+
+    cache = StateCache(str(tmp_path))
+    cache.put("a", make_state(4))
+
+    assert sorted(os.listdir(tmp_path)) == sorted(["a.state", INDEX_FILENAME, "notes"])
@@ -0,0 +1,31 @@
+"""JSON schema of a tool call."""
+from distiller_cm5_python.llm_server.tool_grammar import tool_call_schema
+
+WEATHER = {
+    "type": "function",
+    "function": {
+        "name": "weather",
+        "parameters": {"type": "object", "properties": {"city": {"type": "string"}}},
+    },
+}
+CLOCK = {"type": "function", "function": {"name": "clock"}}
+
+
+def test_single_tool_schema():
+    schema = tool_call_schema([WEATHER])
+
+    assert schema["properties"]["name"] == {"const": "weather"}
+    assert schema["properties"]["arguments"] == WEATHER["function"]["parameters"]
+    assert schema["required"] == ["name", "arguments"]
+    assert schema["additionalProperties"] is False
+
+
+def test_one_of_several_tools():
+    schema = tool_call_schema([WEATHER, CLOCK, {"type": "function", "function": {}}])
+
+    assert [call["properties"]["name"]["const"] for call in schema["oneOf"]] == [
+        "weather",
+        "clock",
+    ]
+    # A tool without parameters still takes an arguments object
+    assert schema["oneOf"][1]["properties"]["arguments"] == {"type": "object"}